@@ -0,0 +1,108 @@
+"""
+Wall-clock time of deleting messages for clean, against a fake HTTP layer with a fixed round trip
+and a per channel rate limit bucket like discord's.
+
+Usage: python -m benchmarks.clean_deletion [--rtt 0.05] [--bucket 50] [--per 1.0]
+"""
+import argparse
+import asyncio
+import time
+
+import discord
+
+from utils.deleter import MessageDeleter
+
+
+class FakeBucket:
+    """Token bucket that makes callers wait like the library does after a 429"""
+
+    def __init__(self, limit: int, per: float) -> None:
+        self.limit = limit
+        self.per = per
+        self.remaining = limit
+        self.reset = time.monotonic() + per
+        self.lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        async with self.lock:
+            now = time.monotonic()
+            if now >= self.reset:
+                self.remaining = self.limit
+                self.reset = now + self.per
+            if self.remaining == 0:
+                await asyncio.sleep(self.reset - now)
+                self.remaining = self.limit
+                self.reset = time.monotonic() + self.per
+            self.remaining -= 1
+
+
+class FakeHTTP:
+    def __init__(self, rtt: float, bucket: FakeBucket) -> None:
+        self.rtt = rtt
+        self.bucket = bucket
+        self.requests = 0
+
+    async def request(self) -> None:
+        await self.bucket.acquire()
+        self.requests += 1
+        await asyncio.sleep(self.rtt)
+
+
+class FakePartialMessage:
+    def __init__(self, http: FakeHTTP, id: int) -> None:
+        self.http = http
+        self.id = id
+
+    async def delete(self) -> None:
+        await self.http.request()
+
+
+class FakeChannel:
+    def __init__(self, http: FakeHTTP) -> None:
+        self.http = http
+
+    def get_partial_message(self, id: int) -> FakePartialMessage:
+        return FakePartialMessage(self.http, id)
+
+    async def delete_messages(self, messages) -> None:
+        await self.http.request()
+
+
+def make_messages(count: int) -> list[discord.Object]:
+    now = discord.utils.utcnow()
+    return [discord.Object(discord.utils.time_snowflake(now) - i) for i in range(count)]
+
+
+async def sequential(channel: FakeChannel, messages) -> None:
+    # What Mod._sad_clean used to do
+    for message in messages:
+        await channel.get_partial_message(message.id).delete()
+
+
+async def run(args: argparse.Namespace) -> None:
+    print(f'{"messages":>8} {"sequential":>11} {"concurrent":>11} {"bulk":>8}')
+    for count in (25, 100, 1000):
+        timings = []
+        for strategy in ('sequential', 'concurrent', 'bulk'):
+            http = FakeHTTP(args.rtt, FakeBucket(args.bucket, args.per))
+            channel = FakeChannel(http)
+            messages = make_messages(count)
+            start = time.perf_counter()
+            if strategy == 'sequential':
+                await sequential(channel, messages)
+            else:
+                await MessageDeleter(channel, bulk=strategy == 'bulk').delete(messages)
+            timings.append(time.perf_counter() - start)
+        print(f'{count:>8} {timings[0]:>10.2f}s {timings[1]:>10.2f}s {timings[2]:>7.2f}s')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rtt', type=float, default=0.05, help='Round trip time of a request in seconds')
+    parser.add_argument('--bucket', type=int, default=50, help='Requests allowed per rate limit window')
+    parser.add_argument('--per', type=float, default=1.0, help='Length of the rate limit window in seconds')
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,327 @@
+"""
+Command throughput of the whole bot without Discord. Builds a Kannushi with the real cogs on top of a fake
+gateway and a fake HTTP layer, then replays MESSAGE_CREATE payloads through on_message, get_context,
+the checks, the commands and the error handler.
+
+A message counts as done once every event it caused, e.g. on_command_error, has finished.
+Messages the bot sends are echoed back through the gateway like Discord does.
+
+Scenarios:
+    chatter  messages that are not commands
+    clean    ?clean by a moderator, bulk deletes the bot's messages and the invocations
+    upload   output too long for a message, goes through Context.send and build_files
+    checks   ?prefix add by someone without Manage Server, fails the permission check
+    errors   ?clean with a bad argument, handled by the error handler
+
+Recorded payloads (one MESSAGE_CREATE per line, either the event or just its data) can be replayed with
+--record, they are moved into the fake guild and channel.
+
+Usage: python -m benchmarks.gateway_replay [--scenarios chatter,clean] [--count 2000] [--rate 0] [--rtt 0]
+"""
+import argparse
+import asyncio
+import contextvars
+import gc
+import itertools
+import json
+import logging
+import pathlib
+import statistics
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+from typing import Any, Optional
+
+import discord
+import psutil
+
+try:
+    import config  # noqa: F401
+except ImportError:
+    # main imports the config, a throwaway one is enough here
+    _config_dir = tempfile.mkdtemp()
+    pathlib.Path(_config_dir, 'config.py').write_text("BOT_TOKEN = ''\nDBURI = ''\nPREFIXES = ['?']\n")
+    sys.path.insert(0, _config_dir)
+
+import main as bot_main  # noqa: E402
+from utils.prefixes import PrefixStore  # noqa: E402
+
+GUILD_ID = 1000
+CHANNEL_ID = 1001
+MOD_ROLE_ID = 1002
+BOT_ROLE_ID = 1003
+BOT_ID = 2000
+OWNER_ID = 2001
+MOD_ID = 2002
+USER_IDS = range(3000, 3050)
+EXTENSIONS = ('cogs.error_handler', 'cogs.mod', 'cogs.owner', 'cogs.settings')
+
+PERMISSIONS = discord.Permissions(manage_messages=True, manage_guild=True, send_messages=True,
+                                  read_messages=True, read_message_history=True, add_reactions=True,
+                                  attach_files=True)
+SCENARIOS = {
+    'chatter': lambda i: ((USER_IDS[i % len(USER_IDS)],), f'just talking about things, message number {i}'),
+    'clean': lambda i: ((MOD_ID,), '?clean 100'),
+    'upload': lambda i: ((OWNER_ID,), '?eval return "x" * 5000'),
+    'checks': lambda i: ((USER_IDS[i % len(USER_IDS)],), '?prefix add !'),
+    'errors': lambda i: ((MOD_ID,), '?clean lots'),
+}
+
+replay_id: contextvars.ContextVar[Optional[int]] = contextvars.ContextVar('replay_id', default=None)
+snowflakes = itertools.count(discord.utils.time_snowflake(discord.utils.utcnow()))
+
+
+def user_payload(user_id: int, *, bot: bool = False) -> dict[str, Any]:
+    return {'id': str(user_id), 'username': f'user{user_id}', 'discriminator': '0', 'global_name': None,
+            'avatar': None, 'bot': bot}
+
+
+def member_payload(user_id: int, roles: tuple[int, ...] = ()) -> dict[str, Any]:
+    return {'user': user_payload(user_id, bot=user_id == BOT_ID), 'roles': [str(r) for r in roles],
+            'joined_at': '2020-01-01T00:00:00+00:00', 'deaf': False, 'mute': False, 'flags': 0}
+
+
+def guild_payload() -> dict[str, Any]:
+    members = [member_payload(BOT_ID, (BOT_ROLE_ID,)), member_payload(MOD_ID, (MOD_ROLE_ID,)),
+               member_payload(OWNER_ID)]
+    members.extend(member_payload(user_id) for user_id in USER_IDS)
+    everyone = discord.Permissions(send_messages=True, read_messages=True, read_message_history=True)
+    return {
+        'id': str(GUILD_ID), 'name': 'Benchmark', 'owner_id': str(OWNER_ID), 'member_count': len(members),
+        'roles': [
+            {'id': str(GUILD_ID), 'name': '@everyone', 'permissions': str(everyone.value), 'position': 0},
+            {'id': str(MOD_ROLE_ID), 'name': 'Mod', 'permissions': str(PERMISSIONS.value), 'position': 1},
+            {'id': str(BOT_ROLE_ID), 'name': 'Bot', 'permissions': str(PERMISSIONS.value), 'position': 2},
+        ],
+        'channels': [{'id': str(CHANNEL_ID), 'type': 0, 'name': 'benchmark', 'position': 0,
+                      'permission_overwrites': []}],
+        'members': members, 'emojis': [], 'stickers': [], 'features': [], 'voice_states': [], 'presences': [],
+        'threads': [], 'stage_instances': [], 'guild_scheduled_events': [],
+    }
+
+
+def message_payload(author_id: int, content: str, *, message_id: Optional[int] = None, **extra) -> dict[str, Any]:
+    data = {
+        'id': str(message_id or next(snowflakes)), 'channel_id': str(CHANNEL_ID), 'guild_id': str(GUILD_ID),
+        'author': user_payload(author_id, bot=author_id == BOT_ID), 'content': content,
+        'timestamp': discord.utils.utcnow().isoformat(), 'edited_timestamp': None, 'tts': False,
+        'mention_everyone': False, 'mentions': [], 'mention_roles': [], 'attachments': [], 'embeds': [],
+        'pinned': False, 'type': 0,
+    }
+    if author_id != BOT_ID:
+        data['member'] = {k: v for k, v in member_payload(author_id).items() if k != 'user'}
+        if author_id == MOD_ID:
+            data['member']['roles'] = [str(MOD_ROLE_ID)]
+    data.update(extra)
+    return data
+
+
+class FakeHTTP:
+    """Answers the requests the cogs make, after a fixed round trip"""
+
+    def __init__(self, state: Any, rtt: float) -> None:
+        self.state = state
+        self.rtt = rtt
+        self.requests: dict[str, int] = {}
+        self.uploaded: int = 0
+
+    async def request(self, route: discord.http.Route, *, files=None, form=None, **kwargs) -> Any:
+        key = f'{route.method} {route.path}'
+        self.requests[key] = self.requests.get(key, 0) + 1
+        if self.rtt:
+            await asyncio.sleep(self.rtt)
+
+        if key == 'POST /channels/{channel_id}/messages':
+            if files:
+                payload = json.loads(next(part['value'] for part in form if part['name'] == 'payload_json'))
+                for file in files:
+                    self.uploaded += len(file.fp.read())  # Like reading it into the request body
+            else:
+                payload = kwargs.get('json') or {}
+            data = message_payload(BOT_ID, payload.get('content') or '')
+            # The gateway sends our own messages back to us, outside of whatever caused them
+            asyncio.get_running_loop().call_soon(self.state.parse_message_create, data,
+                                                 context=contextvars.Context())
+            return data
+        if key == 'PATCH /channels/{channel_id}/messages/{message_id}':
+            return message_payload(BOT_ID, kwargs.get('json', {}).get('content') or '')
+        if key == 'GET /channels/{channel_id}/messages':
+            return []
+        if key == 'POST /users/@me/channels':
+            recipient = kwargs['json']['recipient_id']
+            return {'id': str(next(snowflakes)), 'type': 1, 'recipients': [user_payload(int(recipient))]}
+        if key == 'GET /users/{user_id}':
+            raise discord.NotFound(SimpleNamespace(status=404, reason='Not Found'),
+                                   {'code': 10013, 'message': 'Unknown User'})
+        return None
+
+
+class Tracker:
+    """Counts the event handlers still running for each replayed message"""
+
+    def __init__(self) -> None:
+        self.started: dict[int, float] = {}
+        self.pending: dict[int, int] = {}
+        self.latencies: list[float] = []
+        self.finished_at: float = 0.0
+        self.done: asyncio.Event = asyncio.Event()
+        self.expected: int = 0
+
+    def begin(self, rid: int) -> None:
+        self.pending[rid] = self.pending.get(rid, 0) + 1
+
+    def end(self, rid: int) -> None:
+        self.pending[rid] -= 1
+        if not self.pending[rid]:
+            self.finish(rid)
+
+    def finish(self, rid: int) -> None:
+        del self.pending[rid]
+        now = time.perf_counter()
+        self.latencies.append(now - self.started.pop(rid))
+        self.finished_at = now
+        if len(self.latencies) >= self.expected:
+            self.done.set()
+
+
+async def build_bot(rtt: float) -> tuple[bot_main.Kannushi, FakeHTTP, Tracker]:
+    bot = bot_main.Kannushi()
+    await bot._async_setup_hook()
+    state = bot._connection
+    state.user = discord.ClientUser(state=state, data=user_payload(BOT_ID, bot=True))
+
+    http = FakeHTTP(state, rtt)
+    bot.http.request = http.request  # type: ignore
+    bot.prefixes = PrefixStore(None, ['?'], bot_id=BOT_ID)  # type: ignore # Nothing that needs the database runs
+    bot.command_prefix = bot_main.get_all_prefix
+    bot.owner_id = OWNER_ID
+    for ext in EXTENSIONS:
+        await bot.load_extension(ext)
+
+    guild = discord.Guild(data=guild_payload(), state=state)  # type: ignore
+    state._add_guild(guild)
+    bot.member_guilds.rebuild(bot.guilds)
+    bot._ready.set()
+
+    tracker = Tracker()
+    schedule = bot._schedule_event
+
+    def tracked_schedule(coro, event_name, *args, **kwargs):
+        task = schedule(coro, event_name, *args, **kwargs)
+        rid = replay_id.get()
+        if rid is not None:
+            tracker.begin(rid)
+            task.add_done_callback(lambda _: tracker.end(rid))
+        return task
+
+    bot._schedule_event = tracked_schedule  # type: ignore
+    return bot, http, tracker
+
+
+def load_recorded(path: str) -> list[dict[str, Any]]:
+    payloads = []
+    with open(path) as fp:
+        for line in fp:
+            if not line.strip():
+                continue
+            data = json.loads(line)
+            data = data.get('d', data)
+            if 'author' not in data:
+                continue
+            data = message_payload(int(data['author']['id']), data.get('content', ''))
+            payloads.append(data)
+    return payloads
+
+
+async def replay(bot: bot_main.Kannushi, tracker: Tracker, payloads: list[dict[str, Any]], rate: float) -> float:
+    state = bot._connection
+    tracker.expected = len(payloads)
+    tracker.done.clear()
+    start = time.perf_counter()
+    for i, data in enumerate(payloads):
+        if rate:
+            delay = start + i / rate - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        elif i % 100 == 99:
+            await asyncio.sleep(0)
+
+        rid = int(data['id'])
+        token = replay_id.set(rid)
+        tracker.started[rid] = time.perf_counter()
+        try:
+            state.parse_message_create(data)
+        finally:
+            replay_id.reset(token)
+        if rid not in tracker.pending:  # Nothing was dispatched for it
+            tracker.finish(rid)
+
+    await tracker.done.wait()
+    return tracker.finished_at - start
+
+
+def synthetic(scenario: str, count: int) -> list[dict[str, Any]]:
+    make = SCENARIOS[scenario]
+    payloads = []
+    for i in range(count):
+        (author,), content = make(i)
+        payloads.append(message_payload(author, content))
+    return payloads
+
+
+def quantile(values: list[float], q: float) -> float:
+    return statistics.quantiles(values, n=100)[int(q * 100) - 1] if len(values) > 1 else values[0]
+
+
+async def run(args: argparse.Namespace) -> None:
+    bot, http, tracker = await build_bot(args.rtt)
+    process = psutil.Process()
+    if args.record:
+        runs = [('recorded', load_recorded(args.record))]
+    else:
+        runs = [(name, synthetic(name, args.count)) for name in args.scenarios.split(',')]
+
+    print(f'{"scenario":>10} {"messages":>9} {"msg/s":>9} {"p50":>9} {"p99":>9} {"rss":>10}')
+    for name, payloads in runs:
+        # Warm up caches and lazy imports so they do not count against the first scenario
+        await replay(bot, tracker, payloads[:min(50, len(payloads))], 0)
+        tracker.latencies.clear()
+        gc.collect()
+        rss = process.memory_info().rss
+
+        elapsed = await replay(bot, tracker, payloads, args.rate)
+        gc.collect()
+        growth = process.memory_info().rss - rss
+        latencies = tracker.latencies
+        tracker.latencies = []
+        print(f'{name:>10} {len(payloads):>9} {len(payloads) / elapsed:>9.0f} '
+              f'{quantile(latencies, 0.5) * 1000:>7.2f}ms {quantile(latencies, 0.99) * 1000:>7.2f}ms '
+              f'{growth / 1024 / 1024:>+8.1f}MB')
+
+    if args.verbose:
+        print('\nRequests:')
+        for key, count in sorted(http.requests.items(), key=lambda item: item[1], reverse=True):
+            print(f'{count:>9} {key}')
+
+    # Pending delete_after timers and the like
+    for task in asyncio.all_tasks():
+        if task is not asyncio.current_task():
+            task.cancel()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help='Comma separated scenarios to run')
+    parser.add_argument('--count', type=int, default=2000, help='Messages per scenario')
+    parser.add_argument('--rate', type=float, default=0, help='Messages per second, 0 to send as fast as possible')
+    parser.add_argument('--rtt', type=float, default=0, help='Round trip time of fake requests in seconds')
+    parser.add_argument('--record', help='File with recorded MESSAGE_CREATE payloads to replay instead')
+    parser.add_argument('--verbose', action='store_true', help='Show which requests were made')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+    asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+"""
+Formatting a list of datetimes with human_timedelta one by one, and all at once through human_timedeltas.
+Before timing anything, both are checked against the previous implementation on random and edge case inputs.
+
+Usage: python -m benchmarks.human_timedelta [--items 500] [--checks 20000]
+"""
+import argparse
+import datetime
+import random
+import timeit
+import zoneinfo
+
+from dateutil.relativedelta import relativedelta
+
+from utils.formats import plural, human_join
+from utils.time import human_timedelta, human_timedeltas
+
+UTC = datetime.timezone.utc
+ZONES = [None, UTC, datetime.timezone(datetime.timedelta(hours=5, minutes=30)),
+         datetime.timezone(datetime.timedelta(hours=-8)), zoneinfo.ZoneInfo('Europe/Berlin'),
+         zoneinfo.ZoneInfo('America/New_York'), zoneinfo.ZoneInfo('Australia/Lord_Howe')]
+# Seconds, around the 28 day cut over and month ends, years
+SPANS = [60, 3600, 86400, 7 * 86400, 27 * 86400, 28 * 86400, 29 * 86400, 31 * 86400, 62 * 86400,
+         365 * 86400, 4 * 366 * 86400, 40 * 365 * 86400]
+
+
+def reference(
+        dt: datetime.datetime,
+        *,
+        source=None,
+        accuracy=3,
+        brief=False,
+        suffix=True,
+) -> str:
+    """human_timedelta as it was before the fast path"""
+    now = source or datetime.datetime.now(datetime.timezone.utc)
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=datetime.timezone.utc)
+
+    if now.tzinfo is None:
+        now = now.replace(tzinfo=datetime.timezone.utc)
+
+    now = now.replace(microsecond=0)
+    dt = dt.replace(microsecond=0)
+
+    now = now.astimezone(datetime.timezone.utc)
+    dt = dt.astimezone(datetime.timezone.utc)
+
+    if dt > now:
+        delta = relativedelta(dt, now)
+        output_suffix = ''
+    else:
+        delta = relativedelta(now, dt)
+        output_suffix = ' ago' if suffix else ''
+
+    attrs = [
+        ('year', 'y'),
+        ('month', 'mo'),
+        ('day', 'd'),
+        ('hour', 'h'),
+        ('minute', 'm'),
+        ('second', 's'),
+    ]
+
+    output = []
+    for attr, brief_attr in attrs:
+        elem = getattr(delta, attr + 's')
+        if not elem:
+            continue
+
+        if attr == 'day':
+            weeks = delta.weeks
+            if weeks:
+                elem -= weeks * 7
+                if not brief:
+                    output.append(format(plural(weeks), 'week'))
+                else:
+                    output.append(f'{weeks}w')
+
+        if elem <= 0:
+            continue
+
+        if brief:
+            output.append(f'{elem}{brief_attr}')
+        else:
+            output.append(format(plural(elem), attr))
+
+    if accuracy is not None:
+        output = output[:accuracy]
+
+    if len(output) == 0:
+        return 'now'
+    else:
+        if not brief:
+            return human_join(output, final='and') + output_suffix
+        else:
+            return ' '.join(output) + output_suffix
+
+
+def random_datetime(rng: random.Random, source: datetime.datetime, spans: list[int]) -> datetime.datetime:
+    offset = rng.uniform(-1, 1) * rng.choice(spans)
+    if rng.random() < 0.2:
+        offset = round(offset)  # Whole seconds hit the exact boundaries
+    dt = source.astimezone(UTC) + datetime.timedelta(seconds=offset)
+    zone = rng.choice(ZONES)
+    return dt.replace(tzinfo=None) if zone is None else dt.astimezone(zone)
+
+
+def check(rng: random.Random, checks: int) -> None:
+    for _ in range(checks):
+        day = rng.choice((1, 15, 28, 29, 30, 31))
+        year, month = rng.randrange(1990, 2040), rng.randrange(1, 13)
+        while True:
+            try:
+                source = datetime.datetime(year, month, day, rng.randrange(24), rng.randrange(60), rng.randrange(60),
+                                           rng.randrange(1_000_000))
+                break
+            except ValueError:
+                day -= 1
+        zone = rng.choice(ZONES)
+        source = source if zone is None else source.replace(tzinfo=zone)
+        dts = [random_datetime(rng, source, SPANS) for _ in range(5)] + [source]
+        kwargs = {'accuracy': rng.choice((None, 0, 1, 2, 3, 7)), 'brief': rng.random() < 0.5,
+                  'suffix': rng.random() < 0.5}
+        expected = [reference(dt, source=source, **kwargs) for dt in dts]
+        assert [human_timedelta(dt, source=source, **kwargs) for dt in dts] == expected, (source, dts, kwargs)
+        assert human_timedeltas(dts, source=source, **kwargs) == expected, (source, dts, kwargs)
+    print(f'{checks * 6} datetimes formatted identically to the previous implementation')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--items', type=int, default=500, help='Datetimes formatted per message')
+    parser.add_argument('--checks', type=int, default=20_000)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    check(rng, args.checks)
+
+    source = datetime.datetime.now(UTC)
+    print(f'{"deltas up to":<14} {"reference":>10} {"single":>10} {"batch":>10}')
+    for label, spans in (('an hour', [3600]), ('a week', [7 * 86400]), ('a year', [365 * 86400]),
+                         ('mixed', SPANS)):
+        dts = [random_datetime(rng, source, spans) for _ in range(args.items)]
+        results = []
+        for func in (lambda: [reference(dt, source=source) for dt in dts],
+                     lambda: [human_timedelta(dt, source=source) for dt in dts],
+                     lambda: human_timedeltas(dts, source=source)):
+            results.append(min(timeit.repeat(func, number=5, repeat=10)) / 5 / len(dts))
+        print(f'{label:<14} ' + ' '.join(f'{r * 1e6:>8.2f}us' for r in results))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""
+Event loop lag while logging at a high rate, with a synchronous file handler on the loop
+and with the bot's own pipeline: DroppingQueueHandler, FlushingQueueListener and BufferedRotatingFileHandler.
+
+Usage: python -m benchmarks.logging_lag [--rate 20000] [--seconds 3]
+"""
+import argparse
+import asyncio
+import logging
+import queue
+import statistics
+import tempfile
+import time
+from logging.handlers import RotatingFileHandler
+
+from utils.log_queue import BufferedRotatingFileHandler, DroppingQueueHandler, FlushingQueueListener
+
+FORMAT = logging.Formatter('[{asctime}] [{levelname:<7}] {name}: {message}', '%Y-%m-%d %H:%M:%S', style='{')
+
+
+async def measure(log: logging.Logger, rate: int, seconds: float) -> tuple[list[float], int]:
+    lags: list[float] = []
+    stop = time.perf_counter() + seconds
+    interval = 0.01
+
+    async def monitor():
+        while time.perf_counter() < stop:
+            start = time.perf_counter()
+            await asyncio.sleep(interval)
+            lags.append(time.perf_counter() - start - interval)
+
+    async def produce():
+        sent = 0
+        batch = max(1, rate // 100)  # Log in bursts every 10ms, like a busy gateway
+        while time.perf_counter() < stop:
+            for _ in range(batch):
+                log.info('MESSAGE_CREATE for guild %s channel %s', 1234567890, sent)
+                sent += 1
+            await asyncio.sleep(0.01)
+        return sent
+
+    _, sent = await asyncio.gather(monitor(), produce())
+    return lags, sent
+
+
+def report(label: str, lags: list[float], sent: int, seconds: float, dropped: int = 0) -> None:
+    lags_ms = sorted(lag * 1000 for lag in lags)
+    p99 = lags_ms[int(len(lags_ms) * 0.99) - 1]
+    print(f'{label:<6} mean {statistics.mean(lags_ms):7.2f}ms  p99 {p99:7.2f}ms  max {lags_ms[-1]:7.2f}ms  '
+          f'{sent / seconds:9.0f} records/s  {dropped} dropped')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rate', type=int, default=20_000, help='Records logged per second')
+    parser.add_argument('--seconds', type=float, default=3.0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        log = logging.getLogger('bench.sync')
+        log.propagate = False
+        log.setLevel(logging.INFO)
+        handler = RotatingFileHandler(f'{tmp}/sync.log', maxBytes=32 * 1024 * 1024, backupCount=5, encoding='utf-8')
+        handler.setFormatter(FORMAT)
+        log.addHandler(handler)
+        lags, sent = asyncio.run(measure(log, args.rate, args.seconds))
+        handler.close()
+        report('sync', lags, sent, args.seconds)
+
+        log = logging.getLogger('bench.queue')
+        log.propagate = False
+        log.setLevel(logging.INFO)
+        handler = BufferedRotatingFileHandler(f'{tmp}/queue.log', maxBytes=32 * 1024 * 1024, backupCount=5,
+                                              encoding='utf-8')
+        handler.setFormatter(FORMAT)
+        q = queue.Queue(maxsize=10_000)
+        queue_handler = DroppingQueueHandler(q)
+        log.addHandler(queue_handler)
+        listener = FlushingQueueListener(q, handler, respect_handler_level=True)
+        listener.start()
+        lags, sent = asyncio.run(measure(log, args.rate, args.seconds))
+        listener.stop()
+        handler.close()
+        report('queue', lags, sent, args.seconds, queue_handler.dropped)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""
+Memory, build time and query latency of the NameIndex behind Context.find, with made up member names
+(a username, and for some members a display name and a nickname) at 10k, 100k and 1M members.
+
+Usage: python -m benchmarks.name_search [--queries 2000] [--sizes 10000 100000 1000000]
+"""
+import argparse
+import random
+import string
+import time
+import tracemalloc
+
+from utils.search import NameIndex
+
+SYLLABLES = ['ka', 'ri', 'to', 'mi', 'shi', 'na', 'ro', 'lu', 'an', 'el', 'jo', 'hn', 'sa', 'ki', 'da', 've',
+             'xx', 'the', 'dark', 'lord', 'cat', 'neo', 'zen', 'moon', 'star', 'fox', 'bit', 'pix']
+
+
+def make_name(rng: random.Random) -> str:
+    name = ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4)))
+    if rng.random() < 0.3:
+        name += str(rng.randrange(1000))
+    return name
+
+
+def make_members(count: int, rng: random.Random) -> list[tuple[int, tuple]]:
+    members = []
+    for i in range(count):
+        username = make_name(rng)
+        display = f'{make_name(rng).title()} {make_name(rng).title()}' if rng.random() < 0.5 else None
+        nick = make_name(rng) if rng.random() < 0.2 else None
+        members.append((10 ** 17 + i, (nick, display, username)))
+    return members
+
+
+def typo(name: str, rng: random.Random) -> str:
+    i = rng.randrange(1, len(name))
+    return name[:i] + rng.choice(string.ascii_lowercase) + name[i + 1:]
+
+
+def latency(index: NameIndex, queries: list[str]) -> str:
+    timings = []
+    for query in queries:
+        start = time.perf_counter()
+        index.search(query)
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    return f'{timings[len(timings) // 2] * 1e6:>7.0f}us {timings[int(len(timings) * 0.99)] * 1e6:>7.0f}us'
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--queries', type=int, default=2000)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    for size in args.sizes:
+        members = make_members(size, rng)
+        # Built twice since tracing allocations slows building down a lot
+        tracemalloc.start()
+        traced = NameIndex()
+        traced.build(members)
+        memory, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del traced
+        start = time.perf_counter()
+        index = NameIndex()
+        index.build(members)
+        built = time.perf_counter() - start
+        print(f'{size:,} members, {index.tokens:,} tokens: built in {built:.2f}s, '
+              f'{memory / 1024 / 1024:.1f} MiB ({memory / size:.0f}B per member), '
+              f'{peak / 1024 / 1024:.1f} MiB while building')
+
+        sample = [names for _, names in rng.sample(members, args.queries)]
+        usernames = [names[2] for names in sample]
+        displays = [names[1] for names in sample if names[1]]
+        queries = {
+            'exact': usernames,
+            'prefix 2': [name[:2] for name in usernames],
+            'prefix 4': [name[:4] for name in usernames],
+            'word': [display.split()[1][:4] for display in displays],
+            'typo': [typo(name, rng) for name in usernames],
+            'missing': [''.join(rng.choices(string.ascii_lowercase, k=6)) for _ in range(args.queries)],
+        }
+        print(f'  {"query":<10} {"p50":>9} {"p99":>9}')
+        for label, batch in queries.items():
+            print(f'  {label:<10} {latency(index, batch)}')
+
+        updates = rng.sample(members, min(1000, size))
+        start = time.perf_counter()
+        for id, names in updates:
+            index.add(id, (make_name(rng), *names[1:]))
+        print(f'  rename     {(time.perf_counter() - start) / len(updates) * 1e6:>7.0f}us')
+        start = time.perf_counter()
+        for id, _ in updates:
+            index.remove(id)
+        print(f'  remove     {(time.perf_counter() - start) / len(updates) * 1e6:>7.0f}us')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""
+Cost of resolving a member's permissions in a channel on guilds with many roles and overwrites,
+computed every time like the checks used to, and through the PermissionCache.
+
+Usage: python -m benchmarks.permission_checks [--member-roles 20] [--lookups 20000]
+"""
+import argparse
+import random
+import time
+
+import discord
+
+from utils.permissions import PermissionCache
+
+GUILD_ID = 1000
+CHANNEL_ID = 1001
+# Administrators skip overwrite resolution entirely
+ADMINISTRATOR = discord.Permissions(administrator=True).value
+
+
+def build_guild(state, roles: int, member_roles: int, members: int) -> discord.Guild:
+    rng = random.Random(roles)
+    role_ids = [GUILD_ID] + [GUILD_ID + 10 + i for i in range(roles)]
+    everyone = discord.Permissions.general().value
+    role_data = [{'id': str(role_id), 'name': f'role{i}', 'position': i,
+                  'permissions': str(rng.getrandbits(40) & ~ADMINISTRATOR if i else everyone)}
+                 for i, role_id in enumerate(role_ids)]
+    # Most roles get an overwrite in the channel, like the big community servers
+    overwrites = [{'id': str(role_id), 'type': 0, 'allow': str(rng.getrandbits(40)), 'deny': str(rng.getrandbits(40))}
+                  for role_id in role_ids if rng.random() < 0.8]
+    member_data = [{'user': {'id': str(10_000 + i), 'username': f'user{i}', 'discriminator': '0', 'avatar': None},
+                    'roles': [str(r) for r in rng.sample(role_ids[1:], member_roles)],
+                    'joined_at': '2020-01-01T00:00:00+00:00', 'deaf': False, 'mute': False, 'flags': 0}
+                   for i in range(members)]
+    data = {
+        'id': str(GUILD_ID), 'name': 'Benchmark', 'owner_id': '1', 'member_count': members,
+        'roles': role_data, 'members': member_data, 'emojis': [], 'stickers': [], 'features': [],
+        'channels': [{'id': str(CHANNEL_ID), 'type': 0, 'name': 'benchmark', 'position': 0,
+                      'permission_overwrites': overwrites}],
+    }
+    guild = discord.Guild(data=data, state=state)
+    state._add_guild(guild)
+    return guild
+
+
+def measure(func, members: list[discord.Member], lookups: int) -> float:
+    start = time.perf_counter()
+    for i in range(lookups):
+        func(members[i % len(members)])
+    return (time.perf_counter() - start) / lookups
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--member-roles', type=int, default=20, help='Roles each member has')
+    parser.add_argument('--members', type=int, default=200, help='Members running commands')
+    parser.add_argument('--lookups', type=int, default=20000)
+    args = parser.parse_args()
+
+    state = discord.Client(intents=discord.Intents.all())._connection
+    print(f'{"roles":>6} {"permissions_for":>16} {"cached":>9} {"guild_permissions":>18} {"cached":>9}')
+    for roles in (50, 250, 500, 1000):
+        guild = build_guild(state, roles, min(args.member_roles, roles), args.members)
+        channel = guild.get_channel(CHANNEL_ID)
+        members = list(guild.members)
+        cache = PermissionCache()
+        for member in members:
+            assert cache.channel(channel, member) == channel.permissions_for(member)
+            assert cache.guild(member) == member.guild_permissions
+
+        uncached = measure(channel.permissions_for, members, args.lookups)
+        cached = measure(lambda m: cache.channel(channel, m), members, args.lookups)
+        guild_uncached = measure(lambda m: m.guild_permissions, members, args.lookups)
+        guild_cached = measure(cache.guild, members, args.lookups)
+        print(f'{roles:>6} {uncached * 1e6:>14.1f}us {cached * 1e6:>7.1f}us '
+              f'{guild_uncached * 1e6:>16.1f}us {guild_cached * 1e6:>7.1f}us')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+"""
+Micro-benchmark of the precompiled prefix matcher against building the prefix list and
+calling str.startswith for every message.
+
+Usage: python -m benchmarks.prefix_matcher
+"""
+import random
+import string
+import timeit
+
+from utils.prefixes import PrefixMatcher
+
+BOT_ID = 80351110224678912
+MESSAGES = 20_000
+
+
+def old_path(prefixes: list[str], content: str):
+    # What get_all_prefix and Bot.get_context used to do for every message
+    resolved = [f'<@{BOT_ID}> ', f'<@!{BOT_ID}> ']
+    resolved += prefixes
+    if content.startswith(tuple(resolved)):
+        return next(p for p in resolved if content.startswith(p))
+    return None
+
+
+def main() -> None:
+    rng = random.Random(0)
+    print(f'{"prefixes":>8} {"old":>10} {"matcher":>10} {"speedup":>8}')
+    for count in (10, 100, 1000):
+        prefixes = list({''.join(rng.choices(string.ascii_lowercase + '!?.', k=rng.randint(1, 4)))
+                         for _ in range(count * 2)})[:count]
+        matcher = PrefixMatcher([f'<@{BOT_ID}> ', f'<@!{BOT_ID}> ', *prefixes])
+        # Most messages are not commands
+        messages = [rng.choice(prefixes) + 'ping' if rng.random() < 0.1 else 'just chatting'
+                    for _ in range(MESSAGES)]
+
+        for content in messages:
+            old = old_path(prefixes, content)
+            assert old is None or matcher.match(content) is not None
+
+        old = min(timeit.repeat(lambda: [old_path(prefixes, m) for m in messages], number=1, repeat=5))
+        new = min(timeit.repeat(lambda: [matcher.match(m) for m in messages], number=1, repeat=5))
+        print(f'{count:>8} {old / MESSAGES * 1e9:8.0f}ns {new / MESSAGES * 1e9:8.0f}ns {old / new:7.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,38 @@
+"""
+Benchmark of prefix resolution per message, with a cold and a warm prefix cache.
+
+Usage: python -m benchmarks.prefix_resolution
+"""
+import random
+import timeit
+
+from utils.prefixes import PrefixStore
+
+BOT_ID = 80351110224678912
+GUILDS = 10_000
+MESSAGES = 200_000
+
+
+def run(label: str, store: PrefixStore, guild_ids: list[int]) -> None:
+    def resolve():
+        for guild_id in guild_ids:
+            store.resolve(guild_id)
+
+    best = min(timeit.repeat(resolve, number=1, repeat=5))
+    print(f'{label:<6} {best / len(guild_ids) * 1e9:8.1f} ns/message')
+
+
+def main() -> None:
+    rng = random.Random(0)
+    guild_ids = [rng.randrange(1 << 60) for _ in range(GUILDS)]
+    messages = [rng.choice(guild_ids) for _ in range(MESSAGES)]
+
+    store = PrefixStore(pool=None, default=['?', '!'], bot_id=BOT_ID)
+    run('cold', store, messages)
+
+    store.load({guild_id: ['?', f'g{i}!'] for i, guild_id in enumerate(guild_ids)})
+    run('warm', store, messages)
+
+
+if __name__ == '__main__':
+    main()
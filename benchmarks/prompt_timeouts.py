@@ -0,0 +1,74 @@
+"""
+Memory and scheduling cost of open prompts, with the task per view discord.py creates for view timeouts
+and with the PromptTracker timer wheel, and how long expiring all of them at once takes.
+
+Usage: python -m benchmarks.prompt_timeouts [--timeout 5] [--resolution 0.05]
+"""
+import argparse
+import asyncio
+import gc
+import time
+import tracemalloc
+from types import SimpleNamespace
+
+import discord
+
+from utils.prompts import PromptTracker, PromptView
+
+
+class Store:
+    """Stands in for the library's ViewStore, which only needs to be told when a view stops"""
+
+    def remove_view(self, view: discord.ui.View) -> None:
+        pass
+
+
+def build_views(count: int, timeout: float, tracker: PromptTracker) -> list[discord.ui.View]:
+    if tracker is None:
+        return [discord.ui.View(timeout=timeout) for _ in range(count)]
+    return [PromptView(SimpleNamespace(bot=SimpleNamespace(prompts=tracker), author=SimpleNamespace(id=i)),
+                       timeout=timeout)
+            for i in range(count)]
+
+
+async def run(label: str, count: int, timeout: float, tracker: PromptTracker) -> None:
+    loop = asyncio.get_running_loop()
+    store = Store()
+    gc.collect()
+    tracemalloc.start()
+    views = build_views(count, timeout, tracker)
+    start = time.perf_counter()
+    for view in views:
+        if tracker is None:
+            view._start_listening_from_store(store)  # What sending a message with the view does
+        else:
+            view.open()
+    opened = time.perf_counter()
+    await asyncio.sleep(0)  # Let the timeout tasks start sleeping
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    handles = len(loop._scheduled)  # type: ignore
+
+    await asyncio.gather(*(view.wait() for view in views))
+    # How long after the last prompt should have expired all of them were done
+    late = time.perf_counter() - (opened + timeout)
+    print(f'{label:<8} {count:>7} {(opened - start) / count * 1e6:>8.2f}us {memory / count:>8.0f}B '
+          f'{handles:>8} {late * 1000:>9.0f}ms')
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--timeout', type=float, default=5.0, help='Seconds until every prompt expires')
+    parser.add_argument('--resolution', type=float, default=0.05, help='Tick of the timer wheel')
+    args = parser.parse_args()
+
+    print(f'{"":<8} {"prompts":>7} {"open":>10} {"memory":>9} {"handles":>8} {"all done":>11}')
+    for count in (1_000, 10_000, 50_000):
+        await run('tasks', count, args.timeout, None)
+        tracker = PromptTracker(resolution=args.resolution)
+        await run('wheel', count, args.timeout, tracker)
+        tracker.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
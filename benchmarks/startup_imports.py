@@ -0,0 +1,73 @@
+"""
+Repeatable cold start benchmark that needs no network: imports the bot and every cog and builds a Kannushi
+in a fresh interpreter, the way startup does before connecting. Uses a throwaway config module.
+
+Usage: python -m benchmarks.startup_imports [--runs 10] [--top 15]
+"""
+import argparse
+import os
+import pathlib
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+CONFIG = """BOT_TOKEN = 'benchmark'
+DBURI = 'postgres://localhost/benchmark'
+PREFIXES = ['?']
+"""
+SCRIPT = """
+import time
+start = time.perf_counter()
+import importlib, pathlib
+import main
+for file in pathlib.Path('cogs').glob('**/[!_]*.py'):
+    importlib.import_module('.'.join(file.parts).removesuffix('.py'))
+main.Kannushi()
+print(f'ELAPSED {time.perf_counter() - start}')
+"""
+IMPORTTIME = re.compile(r'import time:\s+(\d+) \|\s+(\d+) \|\s*(\S+)')
+
+
+def run_once(env: dict[str, str]) -> tuple[float, dict[str, int]]:
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', SCRIPT],
+                          cwd=ROOT, env=env, capture_output=True, text=True, check=True)
+    elapsed = float(re.search(r'ELAPSED (\S+)', proc.stdout).group(1))
+    cumulative = {}
+    for match in IMPORTTIME.finditer(proc.stderr):
+        cumulative[match.group(3)] = int(match.group(2))
+    return elapsed, cumulative
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--top', type=int, default=15)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        pathlib.Path(tmp, 'config.py').write_text(CONFIG)
+        env = {**os.environ, 'PYTHONPATH': os.pathsep.join([tmp, str(ROOT)])}
+        env.pop('KANNUSHI_IMPORTTIME', None)
+
+        run_once(env)  # Warm up the filesystem and bytecode caches
+        results = [run_once(env) for _ in range(args.runs)]
+
+    timings = [elapsed for elapsed, _ in results]
+    print(f'import + setup: median {statistics.median(timings) * 1000:.1f}ms, '
+          f'min {min(timings) * 1000:.1f}ms, max {max(timings) * 1000:.1f}ms over {args.runs} runs')
+
+    modules: dict[str, list[int]] = {}
+    for _, cumulative in results:
+        for name, us in cumulative.items():
+            modules.setdefault(name, []).append(us)
+    slowest = sorted(modules.items(), key=lambda item: statistics.median(item[1]), reverse=True)[:args.top]
+    print(f'\n{"cumulative [us]":>15} | module')
+    for name, values in slowest:
+        print(f'{statistics.median(values):>15.0f} | {name}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""
+Inserts timers into a local Postgres and measures how fast the TimerManager dispatches them:
+first a backlog of overdue timers, like after a restart, then timers spread over the next few seconds.
+Everything happens in its own schema, which is dropped afterwards.
+
+Usage: python -m benchmarks.timer_dispatch [--dsn postgresql://localhost/kannushi] [--timers 100000]
+"""
+import argparse
+import asyncio
+import datetime
+import os
+import time
+import tracemalloc
+
+import asyncpg
+import discord
+
+from utils.db import json_codec
+from utils.histogram import Histogram
+from utils.timers import TimerManager
+
+SCHEMA = 'timer_benchmark'
+
+
+async def create_pool(dsn: str) -> asyncpg.Pool:
+    encoder, decoder, codec_format = json_codec()
+
+    async def init(con):
+        await con.set_type_codec('jsonb', encoder=encoder, decoder=decoder, schema='pg_catalog', format=codec_format)
+
+    con = await asyncpg.connect(dsn)
+    try:
+        await con.execute(f'DROP SCHEMA IF EXISTS {SCHEMA} CASCADE; CREATE SCHEMA {SCHEMA};')
+    finally:
+        await con.close()
+    return await asyncpg.create_pool(dsn, init=init, server_settings={'search_path': SCHEMA})
+
+
+async def run(manager: TimerManager, event: str, timers: list[tuple[datetime.datetime, dict]],
+              done: asyncio.Event) -> None:
+    start = time.perf_counter()
+    created = await manager.create_many(event, timers)
+    elapsed = time.perf_counter() - start
+    print(f'  inserted {created} timers in {elapsed:.2f}s ({created / elapsed:,.0f}/s)')
+    # Only what is allocated while dispatching, not the timers we built up front
+    baseline, _ = tracemalloc.get_traced_memory()
+    tracemalloc.reset_peak()
+    start = time.perf_counter()
+    await done.wait()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    print(f'  dispatched all in {elapsed:.2f}s ({created / elapsed:,.0f}/s), '
+          f'peak memory while dispatching {(peak - baseline) / 1024:.0f} KiB')
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dsn', default=os.environ.get('KANNUSHI_BENCH_DSN', 'postgresql://localhost/kannushi'))
+    parser.add_argument('--timers', type=int, default=100_000)
+    parser.add_argument('--spread', type=float, default=10.0, help='Seconds the upcoming timers are spread over')
+    parser.add_argument('--batch-size', type=int, default=1000)
+    args = parser.parse_args()
+
+    pool = await create_pool(args.dsn)
+    lateness = Histogram()
+    counts = {'overdue': 0, 'upcoming': 0}
+    done = {event: asyncio.Event() for event in counts}
+
+    def dispatch(name: str, timer) -> None:
+        event = name.removesuffix('_timer_complete')
+        if event == 'upcoming':
+            lateness.observe((discord.utils.utcnow() - timer.expires).total_seconds())
+        counts[event] += 1
+        if counts[event] == args.timers:
+            done[event].set()
+
+    manager = TimerManager(pool, dispatch, batch_size=args.batch_size)
+    await manager.start()
+    try:
+        tracemalloc.start()
+        now = discord.utils.utcnow()
+        print(f'Overdue backlog of {args.timers} timers')
+        overdue = [(now - datetime.timedelta(seconds=i % 3600), {'user_id': i}) for i in range(args.timers)]
+        await run(manager, 'overdue', overdue, done['overdue'])
+
+        print(f'Upcoming {args.timers} timers over {args.spread}s')
+        start = discord.utils.utcnow() + datetime.timedelta(seconds=1)
+        step = args.spread / args.timers
+        upcoming = [(start + datetime.timedelta(seconds=i * step), {'user_id': i}) for i in range(args.timers)]
+        await run(manager, 'upcoming', upcoming, done['upcoming'])
+        print(f'  lateness p50 {lateness.quantile(0.5) * 1000:.1f}ms, p99 {lateness.quantile(0.99) * 1000:.1f}ms, '
+              f'max {lateness.max * 1000:.1f}ms')
+    finally:
+        tracemalloc.stop()
+        manager.close()
+        await pool.execute(f'DROP SCHEMA {SCHEMA} CASCADE;')
+        await pool.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
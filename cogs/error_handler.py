@@ -1,43 +1,68 @@
 from __future__ import annotations
 
 import logging
+import sys
 import traceback
-from typing import TYPE_CHECKING
+from typing import Optional, TYPE_CHECKING
 
 import discord
-from discord.ext import commands
+from discord.ext import commands, tasks
+from discord.utils import format_dt
+
+from utils.errors import ErrorEntry, ErrorTracker
+from utils.prompts import TooManyPrompts
 
 if TYPE_CHECKING:
     from main import Kannushi
     from utils.context import Context
 
 logger = logging.getLogger(__name__)
+# Tracebacks with fewer frames than this are formatted on the event loop
+THREAD_TRACEBACK_FRAMES = 8
+
+
+def format_error(error: BaseException) -> tuple[str, str]:
+    """Returns the formatted traceback and its last line"""
+    lines = traceback.format_exception(type(error), error, error.__traceback__)
+    return ''.join(lines), lines[-1]
 
 
 class ErrorHandler(commands.Cog):
     def __init__(self, bot: Kannushi):
         self.bot: Kannushi = bot
+        self.errors: ErrorTracker = ErrorTracker()
         bot.on_error = self.on_error
 
+    async def cog_load(self) -> None:
+        self.send_digest.start()
+
+    async def cog_unload(self) -> None:
+        self.send_digest.cancel()
+
     @commands.Cog.listener()
     async def on_command_error(self, ctx: Context, error: commands.CommandError):
         """The event triggered when an error is raised while invoking a command.
         ctx   : Context
         error : Exception"""
+        # The error is sent or ignored from here on, the interaction must not be deferred afterwards
+        ctx.stop_auto_defer()
         await self.bot.wait_until_ready()
+        error = getattr(error, 'original', error)
+        if ctx.command is not None:
+            self.bot.metrics.command_error(ctx.command.qualified_name, error)
         if getattr(ctx, 'local_handled', False):  # Check if handled by local error handlers
-            return
+            return await ctx.dismiss_auto_defer()
 
         ignored = (commands.CommandNotFound, commands.CommandOnCooldown, commands.NotOwner)  # Tuple of errors to ignore
-        error = getattr(error, 'original', error)
 
         if isinstance(error, ignored):
-            return
+            return await ctx.dismiss_auto_defer()
 
         elif isinstance(error, commands.DisabledCommand):
             return await ctx.send(f'Command `{ctx.command}` has been disabled.')
 
         elif isinstance(error, commands.NoPrivateMessage):
+            await ctx.dismiss_auto_defer()
             return await ctx.author.send(f'The command `{ctx.command}` cannot be used in Private Messages.')
 
         elif isinstance(error, commands.BadArgument):
@@ -56,44 +81,102 @@ class ErrorHandler(commands.Cog):
             return await ctx.send(
                 f'I cannot complete this command, I am missing the following permission{"" if len(error.missing_permissions) == 1 else "s"}: {", ".join(error.missing_permissions)}')
 
+        elif isinstance(error, TooManyPrompts):
+            return await ctx.send(str(error), ephemeral=True)
+
         elif isinstance(error, commands.CheckFailure):
             return await ctx.send('Sorry, you cannot use this command')
 
         # Unhandled error, so just return the traceback
-        tb = traceback.format_exception(type(error), error, error.__traceback__)
+        tb, last_line = await self.format_traceback(error)
         logger.error(tb)
         await ctx.send(f'An unexpected error has occurred! My owner has been notified.\n'
                        f'If you really want to know what went wrong:\n'
-                       f'||```py\n{tb[-1][:150]}```||')
+                       f'||```py\n{last_line[:150]}```||')
+
+        entry, first = self.errors.record(error, where=f'command {ctx.command}')
+        if not first:  # Repeats go out in the next digest
+            return
 
         e = discord.Embed(title=f'An unhandled error occurred in {ctx.guild} | #{ctx.channel}',
                           description=f'Invocation message: {ctx.message.content}\n'
                                       f'[Jump to message]({ctx.message.jump_url})',
                           color=discord.Color.red())
         e.set_author(name=ctx.author, icon_url=ctx.author.display_avatar.url)
+        e.set_footer(text=f'Fingerprint: {entry.fingerprint}')
 
-        await self.bot.owner.send(embed=e)
-        fmt = "".join(tb)
-        if len(fmt) >= 1980:
-            paste, password = await self.bot.create_mb_paste(filename=f'traceback.py', content=fmt)
-            await self.bot.owner.send(f'Traceback too long, uploaded to {paste.url} instead.\n'
-                                      f'Password: `{password}` | Security token: `{paste.security_token}`')
-        else:
-            await self.bot.owner.send(f'```py\n{fmt}```')
+        await self.send_owner(embed=e)
+        await self.send_traceback(entry, tb)
 
     async def on_error(self, event, *args, **kwargs):
         await self.bot.wait_until_ready()
         msg = f'An error occurred in event `{event}`\nArgs: {args}\nKwargs: {kwargs}'
         logger.error(msg)
-        await self.bot.owner.send(msg)
-        tb = "".join(traceback.format_exc())
+        error = sys.exc_info()[1]
+        tb = (await self.format_traceback(error))[0] if error is not None else traceback.format_exc()
         logger.error(tb)
+
+        if error is not None:
+            entry, first = self.errors.record(error, where=f'event {event}')
+            if not first:
+                return
+            msg += f'\nFingerprint: `{entry.fingerprint}`'
+        else:
+            entry = None
+
+        await self.send_owner(msg)
+        await self.send_traceback(entry, tb)
+
+    async def send_owner(self, *args, **kwargs) -> None:
+        # Queued under the DM channel, the same key as anything else sent there, so nothing interleaves
+        channel = await self.bot.owner.create_dm()
+        await self.bot.send_queue.send(channel, *args, **kwargs)
+
+    async def format_traceback(self, error: BaseException) -> tuple[str, str]:
+        frames = sum(1 for _ in traceback.walk_tb(error.__traceback__))
+        return await self.bot.executor.thread('traceback', format_error, error,
+                                              size=frames, threshold=THREAD_TRACEBACK_FRAMES)
+
+    async def send_traceback(self, entry: Optional[ErrorEntry], tb: str):
         if len(tb) >= 1980:
             paste, password = await self.bot.create_mb_paste(filename=f'traceback.py', content=tb)
-            await self.bot.owner.send(f'Traceback too long, uploaded to {paste.url} instead.\n'
-                                      f'Password: `{password}` | Security token: `{paste.security_token}`')
+            if entry is not None:  # Shared by every repeat in the digests
+                entry.paste_url = paste.url
+            await self.send_owner(f'Traceback too long, uploaded to {paste.url} instead.\n'
+                                  f'Password: `{password}` | Security token: `{paste.security_token}`')
         else:
-            await self.bot.owner.send(f'```py\n{tb}```')
+            await self.send_owner(f'```py\n{tb}```')
+
+    @tasks.loop(minutes=10)
+    async def send_digest(self):
+        pending = self.errors.take_pending()
+        if not pending:
+            return
+
+        lines = ['**Repeated errors in the last 10 minutes**']
+        for entry, count in pending:
+            line = f'`{entry.fingerprint}` {entry.name} in {entry.where}: **{count}** more ({entry.count} total)'
+            if entry.paste_url:
+                line += f' <{entry.paste_url}>'
+            lines.append(line)
+        await self.send_owner('\n'.join(lines)[:2000])
+
+    @send_digest.before_loop
+    async def before_digest(self):
+        await self.bot.wait_until_ready()
+
+    @commands.command(name='errors')
+    @commands.is_owner()
+    async def top_errors(self, ctx: Context, limit: int = 10):
+        """Shows the most common errors since the bot started"""
+        top = self.errors.top(min(max(1, limit), 25))
+        if not top:
+            return await ctx.send('No errors so far')
+        lines = [f'`{e.fingerprint}` **{e.count}x** {e.name} in {e.where}\n'
+                 f'First seen {format_dt(e.first_seen, "R")} | Last seen {format_dt(e.last_seen, "R")}\n'
+                 f'> {e.summary[:150]}'
+                 for e in top]
+        await ctx.send('\n'.join(lines))
 
 
 async def setup(bot: Kannushi):
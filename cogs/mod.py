@@ -1,11 +1,15 @@
 from __future__ import annotations
 
+import time
 from collections import Counter
-from typing import TYPE_CHECKING
+from typing import Callable, Literal, Optional, Sequence, TYPE_CHECKING
 
 import discord
 from discord.ext import commands
 
+from utils.deleter import MessageDeleter
+from utils.message_index import RecentEntry
+
 if TYPE_CHECKING:
     from main import Kannushi
     from utils.context import Context
@@ -15,28 +19,58 @@ class Mod(commands.Cog):
     def __init__(self, bot: Kannushi):
         self.bot: Kannushi = bot
 
+    async def _delete(self, ctx: Context, messages: Sequence[RecentEntry], *, bulk: bool) -> list[RecentEntry]:
+        status: Optional[discord.Message] = None
+        last = time.monotonic()
+
+        async def progress(done: int, total: int):
+            # Only show progress for long cleans, and do not edit more than once every 2 seconds
+            nonlocal status, last
+            now = time.monotonic()
+            if done == total or now - last < 2:
+                return
+            last = now
+            content = f'Deleting messages... {done}/{total}'
+            if status is None:
+                status = await ctx.send(content)
+            else:
+                await status.edit(content=content)
+
+        deleter = MessageDeleter(ctx.channel, bulk=bulk, on_progress=progress)
+        try:
+            return await deleter.delete(messages)
+        finally:
+            if status is not None:
+                await ctx.silent_delete(status)
+
+    async def _scan(self, ctx: Context, search: int, check: Callable[[RecentEntry], bool]) -> list[RecentEntry]:
+        """Find the messages to delete, using what we have already seen and only fetching history for the gaps"""
+        entries, remaining, before = self.bot.recent_messages.window(ctx.channel.id, ctx.message.id, search)
+        if remaining:
+            matcher = self.bot.prefixes.matcher(ctx.guild and ctx.guild.id)
+            async for msg in ctx.history(limit=remaining, before=discord.Object(before)):
+                entries.append(RecentEntry.from_message(msg,
+                                                        own=msg.author == ctx.me,
+                                                        command=matcher.match(msg.content) is not None))
+        return [e for e in entries if check(e)]
+
     async def _sad_clean(self, ctx: Context, search: int): # No manage message permission, only delete bot's message
-        count = 0
-        async for msg in ctx.history(limit=search, before=ctx.message):
-            if msg.author == ctx.me and not (msg.mentions or msg.role_mentions):
-                await msg.delete()
-                count += 1
-        return {str(self.bot.user): count}
+        def check(e: RecentEntry):
+            return e.own and not e.mentions
+        deleted = await self._delete(ctx, await self._scan(ctx, search, check), bulk=False)
+        return {str(self.bot.user): len(deleted)}
 
     async def _good_clean(self, ctx: Context, search: int): # Do have permission, so delete any invocation messages as well
-        prefixes = tuple(await self.bot.get_prefix(ctx.message))
-        def check(m):
-            return m.author == ctx.me or m.content.startswith(prefixes)
-        deleted = await ctx.channel.purge(limit=search, check=check, before=ctx.message)
-        return Counter(msg.author.display_name for msg in deleted)
+        def check(e: RecentEntry):
+            return e.own or e.command
+        deleted = await self._delete(ctx, await self._scan(ctx, search, check), bulk=True)
+        return Counter(e.author_name for e in deleted)
 
     async def _non_mod_user_clean(self, ctx: Context, search: int):
-        prefixes = tuple(await self.bot.get_prefix(ctx.message))
-        def check(m):
-            return (m.author == ctx.me or m.content.startswith(prefixes)) and not (m.mentions or m.role_mentions)
-
-        deleted = await ctx.channel.purge(limit=search, check=check, before=ctx.message)
-        return Counter(msg.author.display_name for msg in deleted)
+        def check(e: RecentEntry):
+            return (e.own or e.command) and not e.mentions
+        deleted = await self._delete(ctx, await self._scan(ctx, search, check), bulk=True)
+        return Counter(e.author_name for e in deleted)
 
     @commands.command()
     async def clean(self, ctx: Context, search: int = 25):
@@ -54,8 +88,9 @@ class Mod(commands.Cog):
         Members without can search up to 25 messages.
         """
         clean_method = self._sad_clean
-        is_mod = ctx.channel.permissions_for(ctx.author).manage_messages
-        if ctx.channel.permissions_for(ctx.me).manage_messages:
+        permissions = self.bot.permission_cache
+        is_mod = permissions.channel(ctx.channel, ctx.author).manage_messages
+        if permissions.channel(ctx.channel, ctx.me).manage_messages:
             if is_mod:
                 clean_method = self._good_clean
             else:
@@ -78,6 +113,22 @@ class Mod(commands.Cog):
         await ctx.send('\n'.join(messages), delete_after=10)
         await ctx.tick(True)
 
+    @commands.hybrid_command()
+    @commands.guild_only()
+    async def find(self, ctx: Context, kind: Literal['member', 'role', 'channel'], *, query: str):
+        """Finds a member, role or channel of this server by name.
+
+        Names that match exactly are shown right away, otherwise you
+        get to pick from the closest matches, typos included.
+        """
+        try:
+            found = await ctx.find(kind, query, ephemeral=True)
+        except ValueError as e:
+            return await ctx.send(str(e), ephemeral=True)
+        if found is None:  # Nothing was picked in time
+            return
+        await ctx.send(f'{found.mention} ({found.id})', ephemeral=True, allowed_mentions=discord.AllowedMentions.none())
+
 
 async def setup(bot: Kannushi):
     await bot.add_cog(Mod(bot))
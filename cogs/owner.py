@@ -1,21 +1,27 @@
 from __future__ import annotations
 
 import io
+import itertools
 import textwrap
 import traceback
-import tabulate
-from typing import Optional, Any, TYPE_CHECKING
+from typing import Optional, Any, Iterator, TYPE_CHECKING
 from contextlib import redirect_stdout
+from datetime import datetime
 
 import discord
 from discord.ext import commands
 
 from utils.common import cleanup_code, copy_context
+from utils.lazy import lazy_import
+from utils.member_cache import sizeof
+from utils.paginator import CursorPaginator
 
 if TYPE_CHECKING:
     from main import Kannushi
     from utils.context import Context
 
+tabulate = lazy_import('tabulate')
+
 
 class Owner(commands.Cog):
     def __init__(self, bot):
@@ -53,16 +59,24 @@ class Owner(commands.Cog):
             value = stdout.getvalue()
             await ctx.send(f'```py\n{value}{traceback.format_exc()}\n```')
         else:
-            value = stdout.getvalue()
             await ctx.tick(True)
-            if ret is None:
-                if value:
-                    content = f'```py\n{value}\n```'
-                    await ctx.send(content, filetype='py')
-            else:
+            if ret is not None:
                 self._last_result = ret
-                content = f'```py\n{value}{ret}\n```'
-                await ctx.send(content, filetype='py')
+                ret = str(ret)
+            elif not stdout.tell():
+                return
+
+            if stdout.tell() + len(ret or '') >= 1980:
+                await ctx.send_stream(self._eval_output(stdout, ret), filetype='py')
+            else:
+                await ctx.send(f'```py\n{stdout.getvalue()}{ret or ""}\n```')
+
+    @staticmethod
+    def _eval_output(stdout: io.StringIO, ret: Optional[str]) -> Iterator[str]:
+        stdout.seek(0)
+        yield from iter(lambda: stdout.read(64 * 1024), '')
+        if ret:
+            yield ret
 
     @commands.command(name='as')
     async def _sudo(self, ctx, channel: Optional[discord.TextChannel], target: discord.User, *, command: str):
@@ -71,7 +85,7 @@ class Owner(commands.Cog):
         Try to resolve to a Member, if possible.
         """
         channel = channel or ctx.channel
-        author = channel.guild.get_member(target.id) or target
+        author = await self.bot.member_cache.promote(channel.guild, target.id) or target
         content = ctx.prefix + command
         new_ctx = await copy_context(ctx, author=author, channel=channel, content=content)
         if new_ctx.command is None:
@@ -130,40 +144,123 @@ class Owner(commands.Cog):
 
     @commands.command(name='guilds')
     async def get_shared_guilds(self, ctx, user: discord.User):
-        shared = []
-        for guild in self.bot.guilds:
-            if guild.get_member(user.id) is not None:
-                shared.append(guild)
+        shared = self.bot.mutual_guilds(user.id)
         fmt = "\n".join([f"{guild.name} - {guild.id}" for guild in shared])
         await ctx.send(f'```\nShared guilds with {user}\n{fmt}\n```')
 
-    @commands.command(name='sql')
-    async def run_query(self, ctx: Context, *, query):
+    @commands.command(name='memory')
+    async def member_memory(self, ctx: Context, sample: int = 1000):
+        """Shows how many bytes each cached member takes, for both the full and the compact member cache"""
+        guilds = self.bot.guilds
+        cache = self.bot.member_cache
+        full_count = sum(len(guild._members) for guild in guilds)
+        compact_count = len(cache)
+
+        full = list(itertools.islice((m for guild in guilds for m in guild._members.values()), sample))
+        compact = list(itertools.islice((m for guild in guilds for m in cache.members(guild.id)), sample))
+        full_size = sum(map(sizeof, full)) / len(full) if full else 0
+        compact_size = sum(map(sizeof, compact)) / len(compact) if compact else 0
+
+        before = (full_count + compact_count) * full_size
+        after = full_count * full_size + compact_count * compact_size
+        await ctx.send(f'```\n'
+                       f'Compact cache: {"enabled" if cache.enabled else "disabled"}\n'
+                       f'Full members:    {full_count:>9} cached, ~{full_size:.0f} bytes each\n'
+                       f'Compact members: {compact_count:>9} cached, ~{compact_size:.0f} bytes each\n'
+                       f'Before: ~{before / 1024 / 1024:.2f} MiB | After: ~{after / 1024 / 1024:.2f} MiB\n'
+                       f'```')
+
+    @commands.command(name='sendqueue')
+    async def send_queue_stats(self, ctx: Context):
+        """Shows how well outgoing messages are being coalesced"""
+        queue = self.bot.send_queue
+        await ctx.send(f'Queue depth: {queue.depth} | Requested: {queue.requested} | Sent: {queue.sent} | '
+                       f'Merge ratio: {queue.merge_ratio:.2f}')
+
+    @commands.command(name='pool')
+    async def pool_stats(self, ctx: Context, limit: int = 10):
+        """Shows how busy the database pool is and which queries keep its connections busy the longest"""
+        pool = self.bot.pool
+        metrics = pool.metrics
+        wait = metrics.acquire
+        header = (f'Connections: {pool.in_use} in use, {pool.get_idle_size()} idle, '
+                  f'{pool.get_min_size()}-{pool.get_max_size()} allowed\n'
+                  f'Acquire wait: {wait.count} acquires, p50 {wait.quantile(0.5) * 1000:.1f}ms, '
+                  f'p95 {wait.quantile(0.95) * 1000:.1f}ms, max {wait.max * 1000:.1f}ms\n')
+
+        rows = [(query[:60], stats.latency.count, stats.errors, f'{stats.latency.total * 1000:.0f}',
+                 f'{stats.latency.mean * 1000:.1f}', f'{stats.latency.quantile(0.95) * 1000:.1f}',
+                 f'{stats.latency.max * 1000:.1f}')
+                for query, stats in metrics.top(limit)]
+        table = tabulate.tabulate(rows, tablefmt='psql',
+                                  headers=['query', 'calls', 'errors', 'total ms', 'mean', 'p95', 'max'])
+        slow = '\n'.join(f'{datetime.fromtimestamp(at):%H:%M:%S} {took * 1000:.0f}ms {query[:80]}'
+                         for at, took, query in metrics.slow)
+        await ctx.send(f'```\n{header}\n{table}\n\n'
+                       f'Slow queries (>= {metrics.slow_query * 1000:.0f}ms):\n{slow or "None"}\n```')
+
+    @commands.command(name='executor')
+    async def executor_stats(self, ctx: Context):
+        """Shows how long work handed off the event loop waited and ran, per kind of task"""
+        rows = [(kind, stats.inline, stats.wait.count, stats.errors,
+                 f'{stats.wait.quantile(0.5) * 1000:.1f}', f'{stats.wait.quantile(0.95) * 1000:.1f}',
+                 f'{stats.run.quantile(0.5) * 1000:.1f}', f'{stats.run.quantile(0.95) * 1000:.1f}')
+                for kind, stats in sorted(self.bot.executor.stats.items())]
+        if not rows:
+            return await ctx.send('Nothing has been run yet')
+        table = tabulate.tabulate(rows, tablefmt='psql', headers=['kind', 'inline', 'offloaded', 'errors',
+                                                                  'wait p50', 'wait p95', 'run p50', 'run p95'])
+        await ctx.send(f'```\n{table}```')
+
+    @commands.command(name='lag')
+    async def loop_lag(self, ctx: Context, limit: int = 5):
+        """Shows how late the event loop has been running and what blocked it the most"""
+        monitor = self.bot.lag_monitor
+        lag = monitor.lag
+        lines = [f'Lag: p50 {lag.quantile(0.5) * 1000:.1f}ms | p99 {lag.quantile(0.99) * 1000:.1f}ms | '
+                 f'max {lag.max * 1000:.1f}ms | {monitor.stalls} stalls over {monitor.threshold * 1000:.0f}ms']
+        for offender in monitor.top(limit):
+            lines.append(f'\n{offender.label}: {offender.count}x, {offender.total * 1000:.0f}ms total, '
+                         f'{offender.max * 1000:.0f}ms max\n{offender.stack}')
+        await ctx.send('```\n' + '\n'.join(lines) + '```')
+
+    @commands.group(name='sql', invoke_without_command=True)
+    async def run_query(self, ctx: Context, *, query: str):
+        """Runs a query and shows the rows a page at a time, read-only queries are fetched as pages are shown"""
         query = cleanup_code(query)
 
-        is_multiple = query.count(';') > 1
-        if is_multiple:
-            # fetch does not support multiple statements
-            method = self.bot.pool.execute
-        else:
-            method = self.bot.pool.fetch
+        if query.count(';') > 1:
+            # Prepared statements do not support multiple statements
+            try:
+                status = await self.bot.pool.execute(query)
+            except Exception:
+                return await ctx.send(f'```py\n{traceback.format_exc()}\n```')
+            return await ctx.send(f'```\n{status}```')
 
         try:
-            results = await method(query)
+            await CursorPaginator(ctx, self.bot.pool, query).start()
         except Exception:
-            return await ctx.send(f'```py\n{traceback.format_exc()}\n```')
+            await ctx.send(f'```py\n{traceback.format_exc()}\n```')
 
-        rows = len(results)
-        if is_multiple or rows == 0:
-            return await ctx.send(f'```\n{results}```')
-        headers = list(results[0].keys())
-        values = [list(map(repr, v)) for v in results]
-        table = tabulate.tabulate(values, tablefmt='psql', headers=headers)
-        if len(table) > 1000:
-            await ctx.send(table, force_upload=True)
-        else:
-            await ctx.send(f'```\n{table}```')
+    @run_query.command(name='explain')
+    async def explain_query(self, ctx: Context, *, query: str):
+        """Shows the plan of a query with EXPLAIN (ANALYZE, BUFFERS).
+        The query really runs, in a transaction that is rolled back afterwards"""
+        query = cleanup_code(query).rstrip('; \n')
+        try:
+            async with self.bot.pool.acquire() as con:
+                transaction = con.transaction()
+                await transaction.start()
+                try:
+                    rows = await con.fetch(f'EXPLAIN (ANALYZE, BUFFERS) {query}')
+                finally:
+                    await transaction.rollback()
+        except Exception:
+            return await ctx.send(f'```py\n{traceback.format_exc()}\n```')
 
+        plan = [row[0] for row in rows]
+        timings = ' | '.join(line for line in plan if line.startswith(('Planning Time', 'Execution Time')))
+        await ctx.send(f'{timings}\n```\n' + '\n'.join(plan) + '\n```')
 
 async def setup(bot: Kannushi):
     await bot.add_cog(Owner(bot))
@@ -0,0 +1,57 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+from discord.ext import commands
+
+from utils.checks import has_guild_permissions
+
+if TYPE_CHECKING:
+    from main import Kannushi
+    from utils.context import Context
+
+
+class Settings(commands.Cog):
+    def __init__(self, bot: Kannushi):
+        self.bot: Kannushi = bot
+
+    @commands.group(invoke_without_command=True)
+    @commands.guild_only()
+    async def prefix(self, ctx: Context):
+        """Shows the prefixes for this server"""
+        prefixes = self.bot.prefixes.get(ctx.guild.id)
+        if not prefixes:
+            return await ctx.send(f'This server has no prefixes, you can only mention me. {ctx.me.mention}')
+        fmt = '\n'.join(f'- `{p}`' for p in prefixes)
+        await ctx.send(f'Prefixes for this server:\n{fmt}')
+
+    @prefix.command(name='add')
+    @has_guild_permissions(manage_guild=True)
+    async def prefix_add(self, ctx: Context, *, prefix: str):
+        """Adds a prefix for this server"""
+        prefixes = self.bot.prefixes.get(ctx.guild.id)
+        if prefix in prefixes:
+            return await ctx.send(f'`{prefix}` is already a prefix')
+        await self.bot.prefixes.set(ctx.guild.id, [*prefixes, prefix])
+        await ctx.tick(True)
+
+    @prefix.command(name='remove')
+    @has_guild_permissions(manage_guild=True)
+    async def prefix_remove(self, ctx: Context, *, prefix: str):
+        """Removes a prefix from this server"""
+        prefixes = self.bot.prefixes.get(ctx.guild.id)
+        if prefix not in prefixes:
+            return await ctx.send(f'`{prefix}` is not a prefix')
+        await self.bot.prefixes.set(ctx.guild.id, [p for p in prefixes if p != prefix])
+        await ctx.tick(True)
+
+    @prefix.command(name='reset')
+    @has_guild_permissions(manage_guild=True)
+    async def prefix_reset(self, ctx: Context):
+        """Resets the prefixes for this server back to the default"""
+        await self.bot.prefixes.set(ctx.guild.id, None)
+        await ctx.tick(True)
+
+
+async def setup(bot: Kannushi):
+    await bot.add_cog(Settings(bot))
@@ -1,34 +1,86 @@
-import json
+from __future__ import annotations
+
+import os
+
+if os.environ.get('KANNUSHI_IMPORTTIME'):
+    # Has to be installed before everything else is imported
+    from utils import importtime
+    importtime.install()
+
 import pathlib
 import platform
 import asyncio
 import logging
+import queue
 import secrets
+import time
 import traceback
 from datetime import datetime
-from logging.handlers import RotatingFileHandler
-from typing import Coroutine, Any, List, Optional, Union
+from typing import Coroutine, Any, Iterable, List, Optional, Union, TYPE_CHECKING
 
 import asyncpg
 import aiohttp
 import discord
-import mystbin
 from discord.ext import commands
+from discord.ext.commands.view import StringView
 
+import config
 from config import BOT_TOKEN, DBURI, PREFIXES
 from utils.context import Context
+from utils.db import InstrumentedPool, PoolMetrics, json_codec
+from utils.executor import ExecutorService
+from utils.guild_index import MemberGuildIndex
+from utils.lag import LagMonitor
+from utils.lazy import lazy_import
+from utils.log_queue import BufferedRotatingFileHandler, DroppingQueueHandler, FlushingQueueListener, JSONFormatter
+from utils.member_cache import MemberCache
+from utils.metrics import Metrics, MetricsServer
+from utils.message_index import RecentMessages
+from utils.send_queue import SendQueue
+from utils.startup import StartupTimer
+from utils.timers import TimerManager
+from utils.users import UserFetcher
+from utils.permissions import PermissionCache
+from utils.prefixes import PrefixStore
+from utils.prompts import PromptTracker
+from utils.search import SearchIndex
+from utils import importtime
+
+if TYPE_CHECKING:
+    import mystbin
+else:
+    # Only needed for long outputs and tracebacks
+    mystbin = lazy_import('mystbin')
 
 DESCRIPTION = ''
+# Extensions that have to wait for others to finish loading first, e.g. {'cogs.music': ('cogs.voice',)}
+EXTENSION_DEPENDENCIES: dict[str, tuple[str, ...]] = {}
+# Optional extensions that are not needed right away, these load in the background while we connect
+DEFERRED_EXTENSIONS = ('jishaku',)
 log = logging.getLogger()
 
 
 class Kannushi(commands.Bot):
     user: discord.ClientUser
-    pool: asyncpg.Pool
-    prefixes: list[str]
+    pool: InstrumentedPool
+    prefixes: PrefixStore
+    timers: TimerManager
+    member_guilds: MemberGuildIndex
+    member_cache: MemberCache
+    recent_messages: RecentMessages
+    send_queue: SendQueue
+    executor: ExecutorService
+    lag_monitor: LagMonitor
+    metrics: Metrics
+    permission_cache: PermissionCache
+    user_fetcher: UserFetcher
+    prompts: PromptTracker
+    search_index: SearchIndex
+    metrics_server: Optional[MetricsServer]
     session: aiohttp.ClientSession
-    mb_client: mystbin.Client
     starttime: datetime
+    startup: StartupTimer
+    log_handler: Optional[LogHandler]
 
     def __init__(self) -> None:
         super().__init__(command_prefix=[],
@@ -40,13 +92,66 @@ class Kannushi(commands.Bot):
                          intents=discord.Intents.all())
 
         self.starttime = discord.utils.utcnow()
+        self._mb_client: Optional[mystbin.Client] = None
+        self.startup = StartupTimer()
+        self.log_handler = None
+        self.member_guilds = MemberGuildIndex()
+        config = self.config
+        self.member_cache = MemberCache(self,
+                                        enabled=getattr(config, 'COMPACT_MEMBER_CACHE', False),
+                                        full_guilds=getattr(config, 'FULL_MEMBER_CACHE_GUILDS', ()),
+                                        active_ttl=getattr(config, 'MEMBER_CACHE_ACTIVE_TTL', 30 * 60))
+        self.recent_messages = RecentMessages()
+        self.send_queue = SendQueue(channels=getattr(config, 'COALESCE_CHANNELS', ()))
+        self.executor = ExecutorService(threads=getattr(config, 'EXECUTOR_THREADS', 4),
+                                        processes=getattr(config, 'EXECUTOR_PROCESSES', 2))
+        self.lag_monitor = LagMonitor(interval=getattr(config, 'LAG_INTERVAL', 0.25),
+                                      threshold=getattr(config, 'LAG_THRESHOLD', 0.1))
+        self.metrics = Metrics()
+        self.permission_cache = PermissionCache()
+        self.user_fetcher = UserFetcher(self)
+        self.search_index = SearchIndex()
+        self.prompts = PromptTracker(per_user=getattr(config, 'PROMPTS_PER_USER', 5))
+        # Seconds before slash invocations that have not responded yet are deferred, None to never defer them
+        self.auto_defer_after: Optional[float] = getattr(config, 'AUTO_DEFER_AFTER', 2.0)
+        self.metrics_server = None
+        self.before_invoke(self.record_command_prepared)
+        self.add_listener(self.record_interaction_error, 'on_command_error')
 
     async def setup_hook(self) -> None:
-        self.command_prefix = get_all_prefix(self)
-
-        # This is might not be filled if bot.is_owner has not been called, so we will fill it manually
-        app_info = await self.application_info()
-        self.owner_id = app_info.owner.id
+        with self.startup.phase('setup_hook'):
+            self.prefixes = PrefixStore(self.pool, PREFIXES,
+                                        bot_id=self.user.id,
+                                        case_insensitive=getattr(self.config, 'CASE_INSENSITIVE_PREFIXES', False))
+            await self.prefixes.start()
+            self.command_prefix = get_all_prefix
+            self.timers = TimerManager(self.pool, self.dispatch)
+            await self.timers.start()
+            self.member_cache.start()
+            self.lag_monitor.start()
+            port = getattr(self.config, 'METRICS_PORT', 9813)
+            if port is not None:
+                self.metrics_server = MetricsServer(self, host=getattr(self.config, 'METRICS_HOST', '127.0.0.1'),
+                                                    port=port)
+                await self.metrics_server.start()
+
+            # This is might not be filled if bot.is_owner has not been called, so we will fill it manually
+            with self.startup.phase('application_info'):
+                app_info = await self.application_info()
+            self.owner_id = app_info.owner.id
+
+    async def close(self) -> None:
+        self.member_cache.close()
+        self.lag_monitor.close()
+        self.prompts.close()
+        if self.metrics_server is not None:
+            await self.metrics_server.close()
+        if hasattr(self, 'timers'):
+            self.timers.close()
+        if hasattr(self, 'prefixes'):
+            await self.prefixes.close()
+        await super().close()
+        self.executor.shutdown()
 
     @property
     def owner(self) -> Optional[discord.User]:
@@ -54,7 +159,13 @@ class Kannushi(commands.Bot):
 
     @property
     def config(self):
-        return __import__('config')
+        return config
+
+    @property
+    def mb_client(self) -> mystbin.Client:
+        if self._mb_client is None:
+            self._mb_client = mystbin.Client(session=self.session)
+        return self._mb_client
 
     async def on_ready(self) -> None:
         print(f'Ready! {self.user} - {self.user.id}\n'
@@ -62,15 +173,178 @@ class Kannushi(commands.Bot):
               f'Library Version: {discord.__version__}\n'
               f'Time: {discord.utils.utcnow()}')
         log.info('Ready! %s - %s', self.user, self.user.id)
+        self.member_guilds.rebuild(self.guilds)
+        # New session, so we might have missed messages while disconnected
+        self.recent_messages.clear()
+
+        if not self.startup.done:
+            self.startup.mark('first READY')
+            self.startup.done = True
+            report = self.startup.report()
+            print(report)
+            log.info(report)
+            if importtime.PROFILER is not None:
+                importtime.PROFILER.save(pathlib.Path('./logs/importtime.json'))
+                log.info('Slowest imports:\n%s', importtime.PROFILER.report())
+
+    async def on_guild_join(self, guild: discord.Guild) -> None:
+        self.member_guilds.add_guild(guild)
+
+    async def on_guild_available(self, guild: discord.Guild) -> None:
+        # Dispatched after the guild has been chunked, so every member is back in the full cache
+        self.member_cache.discard_guild(guild.id)
+        self.member_guilds.add_guild(guild)
+        # We might have missed role and channel updates while it was unavailable
+        self.permission_cache.invalidate_guild(guild.id)
+        self.search_index.discard_guild(guild.id)
+
+    async def on_guild_remove(self, guild: discord.Guild) -> None:
+        for member in self.member_cache.members(guild.id):
+            self.member_guilds.remove(member.id, guild.id)
+        self.member_cache.discard_guild(guild.id)
+        self.member_guilds.remove_guild(guild)
+        self.permission_cache.invalidate_guild(guild.id)
+        self.search_index.discard_guild(guild.id)
+
+    async def on_guild_update(self, before: discord.Guild, after: discord.Guild) -> None:
+        self.permission_cache.invalidate_guild(after.id)  # The owner has every permission
+
+    async def on_guild_role_create(self, role: discord.Role) -> None:
+        self.permission_cache.invalidate_guild(role.guild.id)
+        self.search_index.role(role)
+
+    async def on_guild_role_update(self, before: discord.Role, after: discord.Role) -> None:
+        self.permission_cache.invalidate_guild(after.guild.id)
+        if before.name != after.name:
+            self.search_index.role(after)
+
+    async def on_guild_role_delete(self, role: discord.Role) -> None:
+        self.permission_cache.invalidate_guild(role.guild.id)
+        self.search_index.remove_role(role.guild.id, role.id)
+
+    async def on_guild_channel_create(self, channel: discord.abc.GuildChannel) -> None:
+        self.search_index.channel(channel)
+
+    async def on_guild_channel_update(self, before: discord.abc.GuildChannel, after: discord.abc.GuildChannel) -> None:
+        self.permission_cache.invalidate_channel(after.guild.id, after.id)
+        if before.name != after.name:
+            self.search_index.channel(after)
+
+    async def on_guild_channel_delete(self, channel: discord.abc.GuildChannel) -> None:
+        self.permission_cache.invalidate_channel(channel.guild.id, channel.id)
+        self.search_index.remove_channel(channel.guild.id, channel.id)
+
+    async def on_member_join(self, member: discord.Member) -> None:
+        self.member_cache.recached(member)
+        self.member_guilds.add(member.id, member.guild.id)
+        self.search_index.member(member)
+
+    async def on_member_update(self, before: discord.Member, after: discord.Member) -> None:
+        self.member_cache.recached(after)
+        if before._roles != after._roles:
+            self.permission_cache.invalidate_member(after.guild.id, after.id)
+        if before.nick != after.nick:
+            self.search_index.member(after)
+
+    async def on_user_update(self, before: discord.User, after: discord.User) -> None:
+        if before.name != after.name or before.global_name != after.global_name:
+            for guild in self.mutual_guilds(after.id):
+                if member := guild.get_member(after.id):
+                    self.search_index.member(member)
+
+    async def on_raw_member_remove(self, payload: discord.RawMemberRemoveEvent) -> None:
+        self.member_cache.remove(payload.guild_id, payload.user.id)
+        self.member_guilds.remove(payload.user.id, payload.guild_id)
+        self.permission_cache.invalidate_member(payload.guild_id, payload.user.id)
+        self.search_index.remove_member(payload.guild_id, payload.user.id)
+
+    async def on_message(self, message: discord.Message) -> None:
+        self.member_cache.touch(message.author)
+        if message.author.bot:
+            self.recent_messages.observe(message, own=message.author.id == self.user.id, command=False)
+            return
+
+        self.metrics.messages += 1
+        ctx = await self.get_context(message)
+        self.recent_messages.observe(message, own=False, command=ctx.prefix is not None)
+        if ctx.command is not None:
+            self.lag_monitor.label(f'command {ctx.command.qualified_name}')
+        await self.invoke(ctx)
+
+    async def on_raw_message_delete(self, payload: discord.RawMessageDeleteEvent) -> None:
+        self.recent_messages.remove(payload.channel_id, (payload.message_id,))
+
+    async def on_raw_bulk_message_delete(self, payload: discord.RawBulkMessageDeleteEvent) -> None:
+        self.recent_messages.remove(payload.channel_id, payload.message_ids)
+
+    async def on_interaction(self, interaction: discord.Interaction) -> None:
+        self.member_cache.touch(interaction.user)
+
+    def mutual_guilds(self, user_id: int) -> list[discord.Guild]:
+        """Returns the guilds shared with a user, without going through every guild"""
+        return [guild for guild_id in self.member_guilds.get(user_id) if (guild := self.get_guild(guild_id))]
 
     async def get_context(self, origin: Union[discord.Message, discord.Interaction], /, *, cls=Context) -> Context:
-        return await super().get_context(origin, cls=cls)
+        start = time.perf_counter()
+        try:
+            if isinstance(origin, discord.Message):
+                # Most messages are not commands, so skip resolving the prefix entirely if it cannot match
+                guild_id = origin.guild and origin.guild.id
+                if self.prefixes.matcher(guild_id).match(origin.content) is None:
+                    return cls(prefix=None, view=StringView(origin.content), bot=self, message=origin)
+            ctx = await super().get_context(origin, cls=cls)
+            if ctx.interaction is not None:
+                self._start_interaction_command(ctx)
+            return ctx
+        finally:
+            self.metrics.context.observe(time.perf_counter() - start)
+
+    def _start_interaction_command(self, ctx: Context) -> None:
+        # Hybrid commands invoked as slash commands never go through invoke, so they are counted from here
+        # and timed until they complete or fail
+        if ctx.command is not None:
+            self.metrics.command(ctx.command.qualified_name).count += 1
+            ctx.invoke_started = time.perf_counter()
+        if self.auto_defer_after is not None:
+            ctx.start_auto_defer(self.auto_defer_after)
+
+    def _finish_interaction_command(self, ctx: Context) -> None:
+        if ctx.interaction is not None and ctx.command is not None and ctx.invoke_started is not None:
+            self.metrics.command(ctx.command.qualified_name).latency.observe(time.perf_counter() - ctx.invoke_started)
+
+    async def on_command_completion(self, ctx: Context) -> None:
+        ctx.stop_auto_defer()
+        self._finish_interaction_command(ctx)
+        # Commands that finished without sending anything would leave the "thinking" response up
+        await ctx.dismiss_auto_defer()
+
+    async def record_interaction_error(self, ctx: Context, error: commands.CommandError) -> None:
+        # Registered as an extra listener, so the error handler cog still gets the error as well
+        self._finish_interaction_command(ctx)
+
+    async def invoke(self, ctx: Context, /) -> None:
+        if ctx.command is None:
+            return await super().invoke(ctx)
+
+        stats = self.metrics.command(ctx.command.qualified_name)
+        stats.count += 1
+        ctx.invoke_started = time.perf_counter()
+        try:
+            await super().invoke(ctx)
+        finally:
+            stats.latency.observe(time.perf_counter() - ctx.invoke_started)
+
+    async def record_command_prepared(self, ctx: Context) -> None:
+        # Called as the global before invoke hook, once checks passed and arguments were converted
+        if ctx.invoke_started is not None:
+            self.metrics.command(ctx.command.qualified_name).prepare.observe(time.perf_counter() - ctx.invoke_started)
 
     async def get_or_fetch_user(self, member_id: int) -> Optional[discord.User]:
-        try:
-            return self.get_user(member_id) or (await self.fetch_user(member_id))
-        except discord.HTTPException:
-            return None
+        return await self.user_fetcher.get(member_id)
+
+    async def get_or_fetch_users(self, user_ids: Iterable[int]) -> dict[int, Optional[discord.User]]:
+        """Resolves many users at once, users that could not be found map to None"""
+        return await self.user_fetcher.get_many(user_ids)
 
     async def create_mb_paste(self, *,
                               filename: str,
@@ -96,19 +370,32 @@ class Kannushi(commands.Bot):
         await self.mb_client.delete_paste(token)
 
 
-async def create_db_pool() -> asyncpg.Pool:
+async def create_db_pool() -> InstrumentedPool:
+    metrics = PoolMetrics(slow_query=getattr(config, 'DB_SLOW_QUERY', 0.5))
+    encoder, decoder, codec_format = json_codec()
+
     async def db_init(con):
-        await con.set_type_codec('jsonb', encoder=json.dumps, decoder=json.loads, schema='pg_catalog')
+        await con.set_type_codec('jsonb', encoder=encoder, decoder=decoder, schema='pg_catalog', format=codec_format)
+        con.add_query_logger(metrics)
 
-    return asyncpg.create_pool(DBURI, init=db_init, command_timeout=60)
+    pool = await asyncpg.create_pool(DBURI,
+                                     init=db_init,
+                                     command_timeout=60,
+                                     min_size=getattr(config, 'DB_POOL_MIN_SIZE', 10),
+                                     max_size=getattr(config, 'DB_POOL_MAX_SIZE', 10),
+                                     max_inactive_connection_lifetime=getattr(config, 'DB_MAX_IDLE_LIFETIME', 300.0),
+                                     statement_cache_size=getattr(config, 'DB_STATEMENT_CACHE_SIZE', 100))
+    return InstrumentedPool(pool, metrics)
 
 
-def get_all_prefix(bot: Kannushi) -> List[str]:
-    """A callable prefix for our bot. Returns a list of valid prefixes for the guild"""
-    bot_id = bot.user.id
-    prefixes = [f'<@{bot_id}> ', f'<@!{bot_id}> ']  # Accept mentioning the bot as prefix
-    prefixes += PREFIXES
-    return prefixes
+def get_all_prefix(bot: Kannushi, message: discord.Message) -> List[str]:
+    """A callable prefix for our bot.
+    Returns the prefix the message was invoked with if any, otherwise a list of valid prefixes for the guild"""
+    guild_id = message.guild and message.guild.id
+    matched = bot.prefixes.matcher(guild_id).match(message.content)
+    if matched is not None:
+        return [matched]
+    return bot.prefixes.resolve(guild_id)
 
 
 class RemoveNoise(logging.Filter):
@@ -122,12 +409,16 @@ class RemoveNoise(logging.Filter):
 
 
 class LogHandler:
-    def __init__(self, *, stream: bool = True) -> None:
+    def __init__(self, *, stream: bool = True, json: bool = False, queue_size: int = 10_000) -> None:
         self.log: logging.Logger = logging.getLogger()
         self.max_bytes: int = 32 * 1024 * 1024  # 32 MiB
         self.logging_path = pathlib.Path('./logs/')
         self.logging_path.mkdir(exist_ok=True)
         self.stream: bool = stream
+        self.json: bool = json
+        self.queue: queue.Queue[logging.LogRecord] = queue.Queue(maxsize=queue_size)
+        self.queue_handler: DroppingQueueHandler = DroppingQueueHandler(self.queue)
+        self.listener: Optional[FlushingQueueListener] = None
 
     async def __aenter__(self):
         return self.__enter__()
@@ -140,17 +431,27 @@ class LogHandler:
         logging.getLogger('discord.state').addFilter(RemoveNoise())
 
         self.log.setLevel(logging.INFO)
-        handler = RotatingFileHandler(
-            filename=self.logging_path / "kannushi.log",
+        handler = BufferedRotatingFileHandler(
+            filename=self.logging_path / ("kannushi.jsonl" if self.json else "kannushi.log"),
             encoding='utf-8',
             mode='w',
             maxBytes=self.max_bytes,
             backupCount=5,
         )
-        dt_fmt = '%Y-%m-%d %H:%M:%S'
-        fmt = logging.Formatter('[{asctime}] [{levelname:<7}] {name}: {message}', dt_fmt, style='{')
+        if self.json:
+            fmt = JSONFormatter()
+        else:
+            dt_fmt = '%Y-%m-%d %H:%M:%S'
+            fmt = logging.Formatter('[{asctime}] [{levelname:<7}] {name}: {message}', dt_fmt, style='{')
         handler.setFormatter(fmt)
-        self.log.addHandler(handler)
+
+        # Everything is written from a background thread, so logging never blocks the event loop
+        handlers = [*self.log.handlers, handler]
+        for hdlr in self.log.handlers[:]:
+            self.log.removeHandler(hdlr)
+        self.listener = FlushingQueueListener(self.queue, *handlers, respect_handler_level=True)
+        self.listener.start()
+        self.log.addHandler(self.queue_handler)
 
         return self
 
@@ -158,43 +459,79 @@ class LogHandler:
         return self.__exit__(*args)
 
     def __exit__(self, *args) -> None:
+        self.log.removeHandler(self.queue_handler)
+        if self.listener is not None:
+            self.listener.stop()  # Writes out whatever is still queued
+            for hdlr in self.listener.handlers:
+                hdlr.close()
+            self.listener = None
+
         handlers = self.log.handlers[:]
         for hdlr in handlers:
             hdlr.close()
             self.log.removeHandler(hdlr)
 
 
+async def load_extensions(bot: Kannushi, extensions: list[str], *, optional: bool = False) -> int:
+    """
+    Loads extensions concurrently, each only waits for the extensions it depends on. Returns how many loaded.
+    Optional extensions, e.g. ones from packages that might not be installed, are skipped if they do not exist.
+    """
+    done = {ext: asyncio.Event() for ext in extensions}
+
+    async def load(ext: str) -> bool:
+        for dependency in EXTENSION_DEPENDENCIES.get(ext, ()):
+            if dependency in done:
+                await done[dependency].wait()
+        try:
+            with bot.startup.phase(f'extension {ext}'):
+                await bot.load_extension(ext)
+        except commands.ExtensionNotFound:
+            if not optional:
+                raise
+            log.error(f'Extension {ext} not found')
+            return False
+        except commands.ExtensionFailed as e:
+            raise e.original
+        finally:
+            done[ext].set()
+        return True
+
+    return sum(await asyncio.gather(*map(load, extensions)))
+
+
+def _deferred_loaded(task: asyncio.Task[int]) -> None:
+    # Logged right away, the bot keeps running for a long time before anything could await the task
+    if not task.cancelled() and (exc := task.exception()) is not None:
+        log.error('Loading deferred extensions failed', exc_info=exc)
+
+
 async def main() -> None:
+    startup = StartupTimer()
     try:
-        pool = await create_db_pool()
+        with startup.phase('db pool'):
+            pool = await create_db_pool()
     except Exception:
         traceback.print_exc()
         print(f'\nUnable to connect to PostgreSQL, exiting...\n')
         raise
 
-    async with pool, Kannushi() as bot, aiohttp.ClientSession() as session, LogHandler():
+    async with pool, Kannushi() as bot, aiohttp.ClientSession() as session, \
+            LogHandler(json=getattr(bot.config, 'LOG_JSON', False)) as log_handler:
+        bot.startup = startup
+        bot.log_handler = log_handler
         bot.pool = pool
         bot.session = session
-        bot.mb_client = mystbin.Client(session=session)
-
-        ext_count = 0
-        try:
-            await bot.load_extension('jishaku')
-            ext_count += 1
-        except commands.ExtensionNotFound:
-            log.error(f'Extension jishaku not found')
 
         # Autoload all cogs in the cogs folder except for those that start with an underscore
-        for file in pathlib.Path('cogs').glob('**/[!_]*.py'):
-            ext = ".".join(file.parts).removesuffix('.py')
-            try:
-                await bot.load_extension(ext)
-            except commands.ExtensionFailed as e:
-                raise e.original
-            ext_count += 1
+        extensions = [".".join(file.parts).removesuffix('.py') for file in pathlib.Path('cogs').glob('**/[!_]*.py')]
+        ext_count = await load_extensions(bot, extensions)
         print(f'Loaded {ext_count} extensions')
+        deferred = asyncio.create_task(load_extensions(bot, list(DEFERRED_EXTENSIONS), optional=True))
+        deferred.add_done_callback(_deferred_loaded)
 
         await bot.start(BOT_TOKEN)
+        deferred.cancel()  # Nothing left to load it into, failures were logged as soon as they happened
 
 
 def run_main(main_func: Coroutine[Any, Any, None]) -> None:
@@ -0,0 +1,29 @@
+import asyncio
+import io
+import os
+
+import discord
+
+from utils.uploads import batch_files, build_files
+
+
+def test_large_parts_are_batched_under_the_limit():
+    limit = 64 * 1024
+    data = os.urandom(limit * 7 + 123)  # Random so gzip cannot shrink it below the limit
+    files = asyncio.run(build_files([data], filename='output.txt', limit=limit))
+    assert len(files) == 8
+
+    batches = batch_files(files, limit=limit * 3)
+    assert [len(batch) for batch in batches] == [3, 3, 2]
+    for batch in batches:
+        assert sum(len(file.fp.read()) for file in batch) <= limit * 3
+
+
+def test_attachment_cap_still_applies():
+    files = [discord.File(io.BytesIO(b'x'), filename=f'{i}.txt') for i in range(23)]
+    assert [len(batch) for batch in batch_files(files, limit=1024)] == [10, 10, 3]
+
+
+def test_oversized_file_goes_out_alone():
+    files = [discord.File(io.BytesIO(b'x' * size), filename=f'{i}.txt') for i, size in enumerate((10, 500, 10))]
+    assert [len(batch) for batch in batch_files(files, limit=100)] == [1, 1, 1]
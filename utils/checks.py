@@ -5,42 +5,46 @@ from utils.context import Context
 
 
 async def check_permissions(ctx: Context, perms: dict[str, bool], *, check=all):
-    is_owner = await ctx.bot.is_owner(ctx.author)
-    if is_owner:
+    if ctx.author.id == ctx.bot.owner_id:
         return True
 
-    resolved = ctx.channel.permissions_for(ctx.author)
+    resolved = ctx.bot.permission_cache.channel(ctx.channel, ctx.author)
     return check(getattr(resolved, name, None) == value for name, value in perms.items())
 
 
 def has_permissions(*, check=all, **perms: bool):
     async def pred(ctx: Context):
-        return await check_permissions(ctx, perms, check=check)
+        passed = await check_permissions(ctx, perms, check=check)
+        ctx.bot.metrics.check('has_permissions', passed)
+        return passed
 
     return commands.check(pred)
 
 
 async def check_guild_permissions(ctx: Context, perms: dict[str, bool], *, check=all):
-    is_owner = await ctx.bot.is_owner(ctx.author)
-    if is_owner:
+    if ctx.author.id == ctx.bot.owner_id:
         return True
 
     if ctx.guild is None:
         return False
 
-    resolved = ctx.author.guild_permissions
+    resolved = ctx.bot.permission_cache.guild(ctx.author)
     return check(getattr(resolved, name, None) == value for name, value in perms.items())
 
 
 def has_guild_permissions(*, check=all, **perms: bool):
     async def pred(ctx: Context):
-        return await check_guild_permissions(ctx, perms, check=check)
+        passed = await check_guild_permissions(ctx, perms, check=check)
+        ctx.bot.metrics.check('has_guild_permissions', passed)
+        return passed
 
     return commands.check(pred)
 
 def hybrid_permissions_check(**perms: bool):
     async def pred(ctx: Context):
-        return await check_guild_permissions(ctx, perms)
+        passed = await check_guild_permissions(ctx, perms)
+        ctx.bot.metrics.check('hybrid_permissions_check', passed)
+        return passed
 
     def decorator(func):
         commands.check(pred)(func)
@@ -1,29 +1,37 @@
 from __future__ import annotations
 
-import io
+import asyncio
+import copy
 from typing import Optional, TYPE_CHECKING, Callable
 
 import discord
 from discord.ext import commands
 
+from utils.prompts import PromptView
+from utils.uploads import Chunks, DEFAULT_FILESIZE_LIMIT, batch_files, build_files
+
 if TYPE_CHECKING:
     from aiohttp import ClientSession
     from main import Kannushi
 
+# Containers with at least this many items are converted to a string off the event loop
+STR_THREAD_ITEMS = 1000
+# Containers a copy can be taken of cheaply, anything else is converted on the event loop
+_SNAPSHOT_TYPES = (list, tuple, dict, set, frozenset)
+
 
-class ConfirmView(discord.ui.View):
+class ConfirmView(PromptView):
     def __init__(self, *, context: Context, timeout: float, author: discord.User, delete_after: bool):
-        super().__init__(timeout=timeout)
-        self.ctx: Context = context
+        super().__init__(context, timeout=timeout)
         self.author: discord.User = author
         self.delete_after: bool = delete_after
-        self.message: Optional[discord.Message] = None
+        self.delete_on_timeout = delete_after
         self.choice: Optional[bool] = None
 
     async def interaction_check(self, interaction: discord.Interaction) -> bool:
         if interaction.user is None:
             return False
-        if await self.ctx.bot.is_owner(interaction.user):
+        if interaction.user.id == self.ctx.bot.owner_id:
             return True
         if interaction.user == self.author:
             return True
@@ -31,10 +39,6 @@ class ConfirmView(discord.ui.View):
             await interaction.response.send_message('You cannot use this', ephemeral=True)
             return False
 
-    async def on_timeout(self) -> None:
-        if self.message and self.delete_after:
-            await self.message.delete()
-
     @discord.ui.button(label='Confirm', style=discord.ButtonStyle.green)
     async def confirm(self, interaction: discord.Interaction, button: discord.ui.Button):
         self.choice = True
@@ -52,13 +56,13 @@ class ConfirmView(discord.ui.View):
         self.stop()
 
 
-class DisambiguatorView(discord.ui.View):
+class DisambiguatorView(PromptView):
     message: discord.Message
 
-    def __init__(self, ctx: Context, data: list, entry: Callable):
-        super().__init__()
-        self.ctx: Context = ctx
+    def __init__(self, ctx: Context, data: list, entry: Callable, *, timeout: float = 180):
+        super().__init__(ctx, timeout=timeout)
         self.data: list = data
+        self.selected = None
 
         options = []
         for i, x in enumerate(data):
@@ -97,8 +101,23 @@ class DisambiguatorView(discord.ui.View):
             pass
 
 
+def _search_entry(obj) -> discord.SelectOption:
+    if isinstance(obj, discord.Member):
+        return discord.SelectOption(label=obj.display_name[:100], description=f'{obj} ({obj.id})'[:100])
+    return discord.SelectOption(label=obj.name[:100], description=str(obj.id))
+
+
 class Context(commands.Context):
     bot: Kannushi
+    # perf_counter when the invocation started, for the command metrics
+    invoke_started: Optional[float] = None
+    # Deferring the interaction if the command has not responded in time, see start_auto_defer
+    _auto_defer: Optional[asyncio.TimerHandle] = None
+    _deferring: Optional[asyncio.Task[None]] = None
+    # Whether the automatic defer was ephemeral, None until it went through
+    _deferred_ephemeral: Optional[bool] = None
+    # Whether anything was sent through the context, after which the deferred response is a real message
+    _answered: bool = False
 
     @property
     def session(self) -> ClientSession:
@@ -137,7 +156,12 @@ class Context(commands.Context):
         Returns True if confirmed, False if cancelled, None if timed out
         """
         view = ConfirmView(context=self, timeout=timeout, author=self.author, delete_after=delete_after)
-        view.message = await self.send(msg, view=view, **kwargs)
+        view.open()
+        try:
+            view.message = await self.send(msg, view=view, **kwargs)
+        except BaseException:
+            view.stop()
+            raise
         await view.wait()
         return view.choice
 
@@ -171,6 +195,76 @@ class Context(commands.Context):
         except discord.HTTPException:
             pass
 
+    def start_auto_defer(self, delay: float) -> None:
+        """
+        Defers the interaction if nothing was sent in response to it within delay seconds, so slow commands
+        do not fail before they get to respond. Anything sent afterwards goes out as a followup,
+        an ephemeral reply after a public defer replaces the "thinking" response instead of editing it.
+        Commands can opt out with ``extras={'auto_defer': False}``, or defer ephemerally with ``'ephemeral'``.
+        """
+        if self.interaction is not None and self._auto_defer is None:
+            self._auto_defer = asyncio.get_running_loop().call_later(delay, self._fire_auto_defer)
+
+    def stop_auto_defer(self) -> None:
+        if self._auto_defer is not None:
+            self._auto_defer.cancel()
+            self._auto_defer = None
+
+    def _fire_auto_defer(self) -> None:
+        self._auto_defer = None
+        # Hybrid contexts start out with the app command and get the wrapped command once it is prepared
+        command = getattr(self.command, 'wrapped', self.command)
+        mode = command.extras.get('auto_defer', True) if command is not None else True
+        if not mode or self.interaction.response.is_done():
+            return
+        if command is not None:
+            self.bot.metrics.command(command.qualified_name).deferred += 1
+        self._deferring = asyncio.create_task(self._auto_defer_interaction(ephemeral=mode == 'ephemeral'))
+
+    async def _auto_defer_interaction(self, *, ephemeral: bool) -> None:
+        try:
+            await self.interaction.response.defer(ephemeral=ephemeral)
+        except (discord.InteractionResponded, discord.HTTPException):
+            return
+        self._deferred_ephemeral = ephemeral
+
+    async def _respond(self) -> None:
+        # Called right before responding, so the automatic defer cannot race the response
+        self.stop_auto_defer()
+        if self._deferring is not None:
+            await self._deferring
+
+    async def _send(self, *args, **kwargs) -> discord.Message:
+        await self._respond()
+        if not self._answered and self._deferred_ephemeral is False and kwargs.get('ephemeral'):
+            # The first followup edits the deferred response and keeps its visibility,
+            # without it the followup is a new message that can be ephemeral
+            try:
+                await self.interaction.delete_original_response()
+            except discord.HTTPException:
+                pass
+        self._answered = True
+        return await super().send(*args, **kwargs)
+
+    async def dismiss_auto_defer(self) -> None:
+        """
+        Deletes the "thinking" response of an automatic defer that nothing was sent after,
+        e.g. when an error is ignored, instead of leaving it up until discord expires it.
+        """
+        await self._respond()
+        if self.interaction is None or self._deferring is None or self._answered:
+            return
+        if self.interaction.response.is_done():
+            try:
+                await self.interaction.delete_original_response()
+            except discord.HTTPException:
+                pass
+
+    async def defer(self, *, ephemeral: bool = False) -> None:
+        await self._respond()
+        if self.interaction is None or not self.interaction.response.is_done():
+            await super().defer(ephemeral=ephemeral)
+
     async def send(
             self,
             content: Optional[str] = None,
@@ -178,29 +272,61 @@ class Context(commands.Context):
             mystbin: bool = False,
             filetype: str = 'txt',
             force_upload: bool = False,
+            coalesce: Optional[bool] = None,
             **kwargs,
     ) -> discord.Message:
-        """Send but if the content is too long, it will be uploaded to mystbin or a file."""
-        content = str(content) if content is not None else None
+        """Send but if the content is too long, it will be uploaded to mystbin or a file.
+        Messages to channels with coalescing enabled may be merged with other messages sent around the same time,
+        pass coalesce to override that."""
+        if content is not None and not isinstance(content, str):
+            if type(content) in _SNAPSHOT_TYPES and len(content) >= STR_THREAD_ITEMS:
+                # The repr of large containers can take a while to build. It is built from a copy taken here,
+                # the event loop might change the original while the thread goes through it.
+                snapshot = copy.copy(content)
+                content = await self.bot.executor.thread('str', str, snapshot, size=len(snapshot),
+                                                         threshold=STR_THREAD_ITEMS)
+            else:
+                content = str(content)
 
         if content and (len(content) >= 2000 or force_upload):
             if mystbin:
                 paste, password = await self.bot.create_mb_paste(filename=f'output.{filetype}', content=content)
-                return await super().send(
+                return await self._send(
                     f'Output too long, uploaded to {paste.url} instead.\n'
                     f'Password: `{password}` | Security token: `{paste.security_token}`',
                     **kwargs
                 )
             else:
-                fp = io.BytesIO(content.encode())
-                files = [discord.File(fp, filename=f'output.{filetype}')]
+                return await self.send_stream((content,), filetype=filetype, **kwargs)
 
-                files.extend(kwargs.pop('file', []))
-                files.extend(kwargs.pop('files', []))
+        # Interaction responses have to go through the interaction, they are never merged with anything
+        queue = self.bot.send_queue
+        if self.interaction is None:
+            if coalesce is None:
+                coalesce = queue.is_enabled(self.channel.id)
+            if coalesce or queue.has_pending(self.channel.id):
+                # Without an interaction this is the same as our own send, and merges with other contexts
+                return await queue.send(self.channel, content, **kwargs)
+
+        return await self._send(content, **kwargs)
 
-                return await super().send(files=files, **kwargs)
+    async def send_stream(self, chunks: Chunks, *, filetype: str = 'txt', **kwargs) -> discord.Message:
+        """
+        Upload output as a file from an iterator or async iterator of chunks, without building it in memory first.
+        Large outputs are gzipped and split over multiple files if needed. Returns the last message sent.
+        """
+        limit = min(self.guild.filesize_limit, DEFAULT_FILESIZE_LIMIT) if self.guild else DEFAULT_FILESIZE_LIMIT
+        files = await build_files(chunks, filename=f'output.{filetype}', limit=limit, executor=self.bot.executor)
 
-        return await super().send(content, **kwargs)
+        extra = kwargs.pop('files', [])
+        if file := kwargs.pop('file', None):
+            extra.append(file)
+        files.extend(extra)
+
+        batches = batch_files(files, limit=limit)
+        for batch in batches[:-1]:
+            await self._send(files=batch)
+        return await self._send(files=batches[-1], **kwargs)
 
     async def reply(self, content: Optional[str] = None, **kwargs) -> discord.Message:
         """Reply but send regular message if message was deleted or discord couldn't fetch it"""
@@ -210,6 +336,10 @@ class Context(commands.Context):
             return await self.send(content, **kwargs)
 
     async def disambiguate(self, matches: list, entry: Callable, *, ephemeral: bool = False):
+        """
+        Lets the author pick one of matches from a select menu, entry turns each into an option.
+        Returns None if the menu timed out without a pick.
+        """
         if len(matches) == 0:
             raise ValueError('No results found.')
 
@@ -220,8 +350,37 @@ class Context(commands.Context):
             raise ValueError('Too many results... sorry.')
 
         view = DisambiguatorView(self, matches, entry)
-        view.message = await self.send(
-            'There are too many matches... Which one did you mean?', view=view, ephemeral=ephemeral
-        )
+        view.open()
+        try:
+            view.message = await self.send(
+                'There are too many matches... Which one did you mean?', view=view, ephemeral=ephemeral
+            )
+        except BaseException:
+            view.stop()
+            raise
         await view.wait()
         return view.selected
+
+    async def _resolve(self, kind: str, ids: list[int]) -> list:
+        if kind == 'member':
+            # Members may have been compacted since they were indexed
+            members = await self.bot.member_cache.promote_many(self.guild, ids)
+            return [members[id] for id in ids if id in members]
+        get = self.guild.get_role if kind == 'role' else self.guild.get_channel
+        return [obj for obj in map(get, ids) if obj is not None]
+
+    async def find(self, kind: str, query: str, *, ephemeral: bool = False):
+        """
+        Finds a member, role or channel of this guild by name through the search index.
+        A single exact match is returned right away, otherwise the author picks from the best matches.
+        Returns None if the author did not pick one in time.
+        """
+        if self.guild is None:
+            raise commands.NoPrivateMessage()
+        index = await self.bot.search_index.index(self.guild, kind, executor=self.bot.executor)
+        exact = index.exact(query)
+        if len(exact) == 1 and (found := await self._resolve(kind, exact)):
+            return found[0]
+
+        matches = await self._resolve(kind, index.search(query, limit=25))
+        return await self.disambiguate(matches, _search_entry, ephemeral=ephemeral)
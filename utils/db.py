@@ -0,0 +1,182 @@
+from __future__ import annotations
+
+import logging
+import re
+import time
+from collections import deque
+from typing import Any, Callable, Optional
+
+import asyncpg
+import orjson
+
+from utils.histogram import Histogram
+
+log = logging.getLogger(__name__)
+
+_WHITESPACE = re.compile(r'\s+')
+
+
+def json_codec() -> tuple[Callable[[Any], bytes], Callable[[bytes], Any], str]:
+    """
+    Returns the encoder, decoder and format for the jsonb codec.
+    Uses orjson in binary format, which skips encoding the text in between. Encodes the same things
+    :func:`json.dumps` does, non-string keys are turned into strings and datetimes are rejected.
+    """
+    options = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+
+    # The binary format of jsonb is a version byte followed by the text
+    def encoder(obj: Any) -> bytes:
+        return b'\x01' + orjson.dumps(obj, option=options)
+
+    def decoder(data: bytes) -> Any:
+        return orjson.loads(data[1:])
+
+    return encoder, decoder, 'binary'
+
+
+class QueryStats:
+    __slots__ = ('latency', 'errors')
+
+    def __init__(self) -> None:
+        self.latency: Histogram = Histogram()
+        self.errors: int = 0
+
+
+class PoolMetrics:
+    """
+    Collects how long queries take, per query, and how long callers waited for a connection.
+    Registered as a query logger on every connection of the pool.
+    """
+
+    def __init__(self, *, slow_query: float = 0.5, max_queries: int = 500, slow_log: int = 20) -> None:
+        self.slow_query: float = slow_query
+        self.max_queries: int = max_queries
+        self.queries: dict[str, QueryStats] = {}
+        self.acquire: Histogram = Histogram()
+        # (unix time, seconds, query)
+        self.slow: deque[tuple[float, float, str]] = deque(maxlen=slow_log)
+
+    @staticmethod
+    def normalize(query: str) -> str:
+        return _WHITESPACE.sub(' ', query).strip()[:200]
+
+    def __call__(self, record: asyncpg.connection.LoggedQuery) -> None:
+        query = self.normalize(record.query)
+        try:
+            stats = self.queries[query]
+        except KeyError:
+            # Ad hoc queries, e.g. from the sql command, should not grow this forever
+            if len(self.queries) >= self.max_queries:
+                query = '<other>'
+            stats = self.queries.setdefault(query, QueryStats())
+
+        stats.latency.observe(record.elapsed)
+        if record.exception is not None:
+            stats.errors += 1
+        if record.elapsed >= self.slow_query:
+            self.slow.append((time.time(), record.elapsed, query))
+            log.warning('Slow query took %.0fms: %s', record.elapsed * 1000, query)
+
+    def top(self, limit: int = 10) -> list[tuple[str, QueryStats]]:
+        """The queries that kept connections busy the longest in total"""
+        return sorted(self.queries.items(), key=lambda item: item[1].latency.total, reverse=True)[:limit]
+
+    def reset(self) -> None:
+        self.queries.clear()
+        self.acquire = Histogram()
+        self.slow.clear()
+
+
+class _AcquireContext:
+    __slots__ = ('pool', 'timeout', 'connection')
+
+    def __init__(self, pool: InstrumentedPool, timeout: Optional[float]) -> None:
+        self.pool: InstrumentedPool = pool
+        self.timeout: Optional[float] = timeout
+        self.connection: Optional[asyncpg.Connection] = None
+
+    async def _acquire(self) -> asyncpg.Connection:
+        start = time.perf_counter()
+        con = await self.pool.pool.acquire(timeout=self.timeout)
+        self.pool.metrics.acquire.observe(time.perf_counter() - start)
+        return con
+
+    async def __aenter__(self) -> asyncpg.Connection:
+        self.connection = await self._acquire()
+        return self.connection
+
+    async def __aexit__(self, *exc) -> None:
+        con, self.connection = self.connection, None
+        await self.pool.release(con)
+
+    def __await__(self):
+        return self._acquire().__await__()
+
+
+class InstrumentedPool:
+    """
+    Wraps an :class:`asyncpg.Pool` to record how long callers wait for a connection.
+    Query latencies are recorded by :class:`PoolMetrics` on the connections themselves,
+    so queries run on an acquired connection are counted as well.
+    """
+
+    def __init__(self, pool: asyncpg.Pool, metrics: PoolMetrics) -> None:
+        self.pool: asyncpg.Pool = pool
+        self.metrics: PoolMetrics = metrics
+
+    def __getattr__(self, attr: str) -> Any:
+        # Anything not wrapped below goes straight to the pool, without recording the acquire
+        return getattr(self.pool, attr)
+
+    async def __aenter__(self) -> InstrumentedPool:
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.pool.close()
+
+    def acquire(self, *, timeout: Optional[float] = None) -> _AcquireContext:
+        return _AcquireContext(self, timeout)
+
+    async def release(self, connection: asyncpg.Connection, *, timeout: Optional[float] = None) -> None:
+        await self.pool.release(connection, timeout=timeout)
+
+    async def execute(self, query: str, *args, timeout: Optional[float] = None) -> str:
+        async with self.acquire() as con:
+            return await con.execute(query, *args, timeout=timeout)
+
+    async def executemany(self, command: str, args, *, timeout: Optional[float] = None) -> None:
+        async with self.acquire() as con:
+            return await con.executemany(command, args, timeout=timeout)
+
+    async def fetch(self, query: str, *args, timeout: Optional[float] = None, **kwargs) -> list[asyncpg.Record]:
+        async with self.acquire() as con:
+            return await con.fetch(query, *args, timeout=timeout, **kwargs)
+
+    async def fetchrow(self, query: str, *args, timeout: Optional[float] = None, **kwargs) -> Optional[asyncpg.Record]:
+        async with self.acquire() as con:
+            return await con.fetchrow(query, *args, timeout=timeout, **kwargs)
+
+    async def fetchval(self, query: str, *args, column: int = 0, timeout: Optional[float] = None) -> Any:
+        async with self.acquire() as con:
+            return await con.fetchval(query, *args, column=column, timeout=timeout)
+
+    async def copy_records_to_table(self, table_name: str, *, records, timeout: Optional[float] = None,
+                                    **kwargs) -> str:
+        async with self.acquire() as con:
+            return await con.copy_records_to_table(table_name, records=records, timeout=timeout, **kwargs)
+
+    async def copy_to_table(self, table_name: str, *, source, timeout: Optional[float] = None, **kwargs) -> str:
+        async with self.acquire() as con:
+            return await con.copy_to_table(table_name, source=source, timeout=timeout, **kwargs)
+
+    async def copy_from_table(self, table_name: str, *, output, timeout: Optional[float] = None, **kwargs) -> str:
+        async with self.acquire() as con:
+            return await con.copy_from_table(table_name, output=output, timeout=timeout, **kwargs)
+
+    async def copy_from_query(self, query: str, *args, output, timeout: Optional[float] = None, **kwargs) -> str:
+        async with self.acquire() as con:
+            return await con.copy_from_query(query, *args, output=output, timeout=timeout, **kwargs)
+
+    @property
+    def in_use(self) -> int:
+        return self.pool.get_size() - self.pool.get_idle_size()
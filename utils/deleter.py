@@ -0,0 +1,88 @@
+from __future__ import annotations
+
+import asyncio
+import datetime
+import logging
+from typing import Awaitable, Callable, Optional, Sequence, TypeVar
+
+import discord
+
+log = logging.getLogger(__name__)
+
+M = TypeVar('M', bound=discord.abc.Snowflake)
+ProgressCallback = Callable[[int, int], Awaitable[None]]
+
+# Bulk delete refuses messages older than 14 days, leave a bit of leeway for clock drift
+BULK_DELETE_MAX_AGE = datetime.timedelta(days=14, minutes=-5)
+
+
+class MessageDeleter:
+    """
+    Deletes messages from a channel as quickly as discord lets us.
+
+    Messages are bulk deleted in batches of 100 when ``bulk`` is True (this needs Manage Messages).
+    Everything else is deleted one at a time, but with up to ``concurrency`` requests in flight.
+    Single deletes share one rate limit bucket per channel which the library already waits on,
+    so the concurrency only needs to be large enough to fill the bucket without piling up behind it.
+    """
+
+    def __init__(self,
+                 channel: discord.abc.Messageable, *,
+                 bulk: bool,
+                 concurrency: int = 5,
+                 on_progress: Optional[ProgressCallback] = None) -> None:
+        self.channel = channel
+        self.bulk: bool = bulk
+        self.concurrency: int = concurrency
+        self.on_progress: Optional[ProgressCallback] = on_progress
+        self.done: int = 0
+        self.total: int = 0
+
+    async def delete(self, messages: Sequence[M]) -> list[M]:
+        """Deletes the messages and returns those that were actually deleted"""
+        self.done = 0
+        self.total = len(messages)
+        deleted: list[M] = []
+        single = list(messages)
+
+        if self.bulk:
+            cutoff = discord.utils.utcnow() - BULK_DELETE_MAX_AGE
+            recent = [m for m in single if discord.utils.snowflake_time(m.id) > cutoff]
+            single = [m for m in single if discord.utils.snowflake_time(m.id) <= cutoff]
+            for i in range(0, len(recent), 100):
+                chunk = recent[i:i + 100]
+                await self.channel.delete_messages(chunk)
+                deleted.extend(chunk)
+                await self._progress(len(chunk))
+
+        if single:
+            deleted.extend(await self._delete_single(single))
+        return deleted
+
+    async def _delete_single(self, messages: list[M]) -> list[M]:
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def delete(message: M) -> bool:
+            async with semaphore:
+                try:
+                    await self.channel.get_partial_message(message.id).delete()
+                except discord.NotFound:  # Someone else got to it first
+                    return False
+                finally:
+                    await self._progress(1)
+                return True
+
+        # Every delete is let finish before a failure is raised, so none of them keep running unobserved
+        results = await asyncio.gather(*map(delete, messages), return_exceptions=True)
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+        return [message for message, ok in zip(messages, results) if ok]
+
+    async def _progress(self, count: int) -> None:
+        self.done += count
+        if self.on_progress is not None:
+            try:
+                await self.on_progress(self.done, self.total)
+            except discord.HTTPException:
+                log.debug('Failed to report deletion progress', exc_info=True)
@@ -0,0 +1,75 @@
+from __future__ import annotations
+
+import datetime
+import hashlib
+import traceback
+from typing import Optional
+
+import discord
+
+
+class ErrorEntry:
+    __slots__ = ('fingerprint', 'name', 'summary', 'where', 'count', 'pending', 'first_seen', 'last_seen', 'paste_url')
+
+    def __init__(self, fingerprint: str, name: str, summary: str, where: str) -> None:
+        self.fingerprint: str = fingerprint
+        self.name: str = name
+        self.summary: str = summary
+        self.where: str = where
+        self.count: int = 0
+        self.pending: int = 0  # Occurrences that have not been included in a digest yet
+        self.first_seen: datetime.datetime = discord.utils.utcnow()
+        self.last_seen: datetime.datetime = self.first_seen
+        self.paste_url: Optional[str] = None
+
+
+class ErrorTracker:
+    """
+    Groups errors by fingerprint, the exception type and the last few frames of the traceback,
+    so that a single bug only notifies once and repeats are counted instead.
+    """
+
+    def __init__(self, *, frames: int = 3, max_entries: int = 500) -> None:
+        self.frames: int = frames
+        self.max_entries: int = max_entries
+        self.entries: dict[str, ErrorEntry] = {}
+
+    def fingerprint(self, error: BaseException) -> str:
+        exc_type = type(error)
+        parts = [f'{exc_type.__module__}.{exc_type.__qualname__}']
+        for frame in traceback.extract_tb(error.__traceback__)[-self.frames:]:
+            parts.append(f'{frame.filename}:{frame.name}:{frame.lineno}')
+        return hashlib.sha1('|'.join(parts).encode()).hexdigest()[:10]
+
+    def record(self, error: BaseException, *, where: str) -> tuple[ErrorEntry, bool]:
+        """Count an occurrence of an error. Returns its entry and whether this is the first time we have seen it."""
+        fingerprint = self.fingerprint(error)
+        entry = self.entries.get(fingerprint)
+        first = entry is None
+        if entry is None:
+            summary = ''.join(traceback.format_exception_only(type(error), error)).strip()
+            entry = self.entries[fingerprint] = ErrorEntry(fingerprint, type(error).__name__, summary[:200], where)
+            self._prune()
+        else:
+            entry.pending += 1
+        entry.count += 1
+        entry.last_seen = discord.utils.utcnow()
+        return entry, first
+
+    def _prune(self) -> None:
+        if len(self.entries) <= self.max_entries:
+            return
+        # Forget whatever has not happened in the longest time
+        oldest = min(self.entries.values(), key=lambda e: e.last_seen)
+        del self.entries[oldest.fingerprint]
+
+    def top(self, limit: int = 10) -> list[ErrorEntry]:
+        return sorted(self.entries.values(), key=lambda e: e.count, reverse=True)[:limit]
+
+    def take_pending(self) -> list[tuple[ErrorEntry, int]]:
+        """Returns the errors that repeated since the last digest with how many times, and resets them"""
+        pending = [(e, e.pending) for e in self.entries.values() if e.pending]
+        pending.sort(key=lambda t: t[1], reverse=True)
+        for entry, _ in pending:
+            entry.pending = 0
+        return pending
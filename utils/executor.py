@@ -0,0 +1,106 @@
+from __future__ import annotations
+
+import asyncio
+import functools
+import time
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Any, Callable, Optional, TypeVar, TYPE_CHECKING
+
+from utils.histogram import Histogram
+
+if TYPE_CHECKING:
+    from concurrent.futures import ProcessPoolExecutor
+
+T = TypeVar('T')
+
+
+def _timed(func: Callable[..., T], *args: Any) -> tuple[float, float, T]:
+    # time.monotonic is system wide, so this also works in a worker process
+    start = time.monotonic()
+    result = func(*args)
+    return start, time.monotonic(), result
+
+
+class TaskStats:
+    __slots__ = ('inline', 'wait', 'run', 'errors')
+
+    def __init__(self) -> None:
+        self.inline: int = 0
+        self.wait: Histogram = Histogram()
+        self.run: Histogram = Histogram()
+        self.errors: int = 0
+
+
+class ExecutorService:
+    """
+    Runs CPU heavy work off the event loop, in a thread pool or a process pool.
+
+    Work smaller than the threshold given by the caller runs inline, handing it off would cost more than it saves.
+    Queue wait and run time are recorded per kind of task.
+    Only picklable functions and arguments can go to the process pool, it is started on first use.
+    """
+
+    def __init__(self, *, threads: int = 4, processes: int = 2) -> None:
+        self.threads: ThreadPoolExecutor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='kannushi')
+        self.max_processes: int = processes
+        self._processes: Optional[ProcessPoolExecutor] = None
+        self.stats: dict[str, TaskStats] = {}
+
+    @property
+    def processes(self) -> ProcessPoolExecutor:
+        if self._processes is None:
+            # Imported here, most runs never use the process pool and importing it is slow
+            import multiprocessing
+            from concurrent.futures import ProcessPoolExecutor
+
+            # Forking a process with a running event loop and threads is not safe
+            self._processes = ProcessPoolExecutor(max_workers=self.max_processes,
+                                                  mp_context=multiprocessing.get_context('spawn'))
+        return self._processes
+
+    async def thread(self, kind: str, func: Callable[..., T], *args: Any,
+                     size: int = 0, threshold: int = 0, **kwargs: Any) -> T:
+        """Runs ``func`` in the thread pool, or inline if ``size`` is below ``threshold``"""
+        return await self._run(self.threads, kind, func, args, kwargs, size, threshold)
+
+    async def process(self, kind: str, func: Callable[..., T], *args: Any,
+                      size: int = 0, threshold: int = 0, **kwargs: Any) -> T:
+        """Runs ``func`` in the process pool, or inline if ``size`` is below ``threshold``"""
+        return await self._run(self.processes, kind, func, args, kwargs, size, threshold)
+
+    async def _run(self, executor: Executor, kind: str, func: Callable[..., T], args: tuple, kwargs: dict,
+                   size: int, threshold: int) -> T:
+        try:
+            stats = self.stats[kind]
+        except KeyError:
+            stats = self.stats[kind] = TaskStats()
+
+        if kwargs:
+            func = functools.partial(func, **kwargs)
+
+        if size < threshold:
+            stats.inline += 1
+            start = time.monotonic()
+            try:
+                return func(*args)
+            except Exception:
+                stats.errors += 1
+                raise
+            finally:
+                stats.run.observe(time.monotonic() - start)
+
+        submitted = time.monotonic()
+        loop = asyncio.get_running_loop()
+        try:
+            started, finished, result = await loop.run_in_executor(executor, _timed, func, *args)
+        except Exception:
+            stats.errors += 1
+            raise
+        stats.wait.observe(started - submitted)
+        stats.run.observe(finished - started)
+        return result
+
+    def shutdown(self) -> None:
+        self.threads.shutdown(wait=False, cancel_futures=True)
+        if self._processes is not None:
+            self._processes.shutdown(wait=False, cancel_futures=True)
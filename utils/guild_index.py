@@ -0,0 +1,77 @@
+from __future__ import annotations
+
+from array import array
+from bisect import bisect_left
+from typing import Iterable, Union, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import discord
+
+
+class MemberGuildIndex:
+    """
+    Reverse index of user ID to the IDs of the guilds they share with the bot.
+
+    Most users are only in a single guild with us, so those just point at the guild ID itself.
+    Users in more than one guild get a sorted array of 64-bit integers instead of a set,
+    which is a fraction of the size of a python set.
+    """
+    __slots__ = ('_guilds',)
+
+    def __init__(self) -> None:
+        self._guilds: dict[int, Union[int, array]] = {}
+
+    def __len__(self) -> int:
+        return len(self._guilds)
+
+    def get(self, user_id: int) -> tuple[int, ...]:
+        """Returns the IDs of every guild shared with the user. This is O(shared guilds)"""
+        entry = self._guilds.get(user_id)
+        if entry is None:
+            return ()
+        if isinstance(entry, int):
+            return (entry,)
+        return tuple(entry)
+
+    def add(self, user_id: int, guild_id: int) -> None:
+        entry = self._guilds.get(user_id)
+        if entry is None:
+            self._guilds[user_id] = guild_id
+        elif isinstance(entry, int):
+            if entry != guild_id:
+                self._guilds[user_id] = array('Q', sorted((entry, guild_id)))
+        else:
+            i = bisect_left(entry, guild_id)
+            if i == len(entry) or entry[i] != guild_id:
+                entry.insert(i, guild_id)
+
+    def remove(self, user_id: int, guild_id: int) -> None:
+        entry = self._guilds.get(user_id)
+        if entry is None:
+            return
+        if isinstance(entry, int):
+            if entry == guild_id:
+                del self._guilds[user_id]
+            return
+
+        i = bisect_left(entry, guild_id)
+        if i == len(entry) or entry[i] != guild_id:
+            return
+        del entry[i]
+        if len(entry) == 1:
+            self._guilds[user_id] = entry[0]
+
+    def add_guild(self, guild: discord.Guild) -> None:
+        guild_id = guild.id
+        for member_id in guild._members:
+            self.add(member_id, guild_id)
+
+    def remove_guild(self, guild: discord.Guild) -> None:
+        guild_id = guild.id
+        for member_id in guild._members:
+            self.remove(member_id, guild_id)
+
+    def rebuild(self, guilds: Iterable[discord.Guild]) -> None:
+        self._guilds.clear()
+        for guild in guilds:
+            self.add_guild(guild)
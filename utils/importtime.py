@@ -0,0 +1,94 @@
+"""
+Records how long every module takes to import, like ``python -X importtime`` but from inside the process,
+so the results can be stored next to the rest of the startup report.
+
+Enable it by setting the ``KANNUSHI_IMPORTTIME`` environment variable.
+"""
+from __future__ import annotations
+
+import json
+import pathlib
+import sys
+import time
+from typing import Any, Optional
+
+
+class _TimingLoader:
+    def __init__(self, loader: Any, profiler: ImportProfiler, name: str) -> None:
+        self._loader = loader
+        self._profiler = profiler
+        self._name = name
+
+    def create_module(self, spec):
+        return self._loader.create_module(spec)
+
+    def exec_module(self, module) -> None:
+        self._profiler._enter()
+        start = time.perf_counter()
+        try:
+            self._loader.exec_module(module)
+        finally:
+            self._profiler._exit(self._name, time.perf_counter() - start)
+
+    def __getattr__(self, attr: str) -> Any:
+        return getattr(self._loader, attr)
+
+
+class ImportProfiler:
+    def __init__(self) -> None:
+        # name: (self time, cumulative time) in seconds, in the order they finished importing
+        self.modules: dict[str, tuple[float, float]] = {}
+        self._children: list[float] = []
+
+    def find_spec(self, name: str, path=None, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, 'find_spec'):
+                continue
+            spec = finder.find_spec(name, path, target)
+            if spec is not None:
+                if spec.loader is not None and hasattr(spec.loader, 'exec_module'):
+                    spec.loader = _TimingLoader(spec.loader, self, name)
+                return spec
+        return None
+
+    def _enter(self) -> None:
+        self._children.append(0.0)
+
+    def _exit(self, name: str, cumulative: float) -> None:
+        children = self._children.pop()
+        self.modules[name] = (cumulative - children, cumulative)
+        if self._children:
+            self._children[-1] += cumulative
+
+    def install(self) -> None:
+        sys.meta_path.insert(0, self)
+
+    def uninstall(self) -> None:
+        if self in sys.meta_path:
+            sys.meta_path.remove(self)
+
+    def top(self, limit: int = 20) -> list[tuple[str, float, float]]:
+        entries = sorted(self.modules.items(), key=lambda item: item[1][1], reverse=True)
+        return [(name, own, cumulative) for name, (own, cumulative) in entries[:limit]]
+
+    def report(self, limit: int = 20) -> str:
+        lines = [f'{"self [us]":>10} | {"cumulative":>10} | module']
+        lines.extend(f'{own * 1e6:>10.0f} | {cumulative * 1e6:>10.0f} | {name}'
+                     for name, own, cumulative in self.top(limit))
+        return '\n'.join(lines)
+
+    def save(self, path: pathlib.Path) -> None:
+        data = {name: {'self_us': round(own * 1e6), 'cumulative_us': round(cumulative * 1e6)}
+                for name, (own, cumulative) in self.modules.items()}
+        path.write_text(json.dumps(data, indent=2))
+
+
+PROFILER: Optional[ImportProfiler] = None
+
+
+def install() -> ImportProfiler:
+    global PROFILER
+    if PROFILER is None:
+        PROFILER = ImportProfiler()
+        PROFILER.install()
+    return PROFILER
@@ -0,0 +1,148 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+import weakref
+from typing import Optional
+
+from utils.histogram import Histogram
+
+log = logging.getLogger(__name__)
+
+
+class Offender:
+    __slots__ = ('label', 'count', 'total', 'max', 'stack')
+
+    def __init__(self, label: str, stack: str) -> None:
+        self.label: str = label
+        self.count: int = 0
+        self.total: float = 0.0
+        self.max: float = 0.0
+        self.stack: str = stack  # From the last time it blocked the loop
+
+
+class _Sample:
+    __slots__ = ('label', 'signature', 'stack')
+
+    def __init__(self, label: str, signature: tuple[str, ...], stack: str) -> None:
+        self.label: str = label
+        self.signature: tuple[str, ...] = signature
+        self.stack: str = stack
+
+
+class LagMonitor:
+    """
+    Measures how late the event loop wakes up from a short sleep.
+
+    A sidecar thread watches for the loop falling behind. When it does, the thread takes a single sample of the
+    loop thread's stack and of the task that is running, which is what the loop is stuck on.
+    Samples are grouped by task and stack, the worst offenders by total lag can be looked at later.
+    Outside of stalls the thread only compares two timestamps, so this is cheap enough to always run.
+    """
+
+    def __init__(self, *, interval: float = 0.25, threshold: float = 0.1,
+                 frames: int = 8, max_offenders: int = 200) -> None:
+        self.interval: float = interval
+        self.threshold: float = threshold
+        self.frames: int = frames
+        self.max_offenders: int = max_offenders
+        self.lag: Histogram = Histogram()
+        self.stalls: int = 0
+        self.offenders: dict[tuple[str, tuple[str, ...]], Offender] = {}
+        # What a task is working on, when the task name alone does not say, e.g. the command being invoked
+        self.labels: weakref.WeakKeyDictionary[asyncio.Task, str] = weakref.WeakKeyDictionary()
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[int] = None
+        self._beat: float = 0.0
+        self._sample: Optional[_Sample] = None
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop: threading.Event = threading.Event()
+
+    def start(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._beat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.create_task(self._run(), name='lag-monitor')
+        self._thread = threading.Thread(target=self._watch, name='lag-monitor', daemon=True)
+        self._thread.start()
+
+    def close(self) -> None:
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def label(self, label: str) -> None:
+        """Names what the current task is doing, so it shows up as that if it blocks the loop"""
+        task = asyncio.current_task()
+        if task is not None:
+            self.labels[task] = label
+
+    async def _run(self) -> None:
+        while True:
+            start = time.monotonic()
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self._beat = now
+            lag = max(now - start - self.interval, 0.0)
+            self.lag.observe(lag)
+
+            sample, self._sample = self._sample, None
+            if lag >= self.threshold:
+                self.stalls += 1
+                if sample is not None:
+                    self._record(sample, lag)
+                    log.debug('Event loop blocked for %.0fms by %s', lag * 1000, sample.label)
+
+    def _watch(self) -> None:
+        # Check often enough to catch the loop while it is still blocked
+        while not self._stop.wait(self.threshold / 2):
+            overdue = time.monotonic() - self._beat - self.interval
+            if overdue >= self.threshold and self._sample is None:
+                try:
+                    self._sample = self._take_sample()
+                except Exception:
+                    log.exception('Could not sample the event loop')
+
+    def _take_sample(self) -> Optional[_Sample]:
+        frame = sys._current_frames().get(self._loop_thread)
+        if frame is None:
+            return None
+        task = asyncio.current_task(self._loop)
+        if task is None:
+            label = 'callback'  # Not inside a task, e.g. a call_soon callback or the loop itself
+        else:
+            label = self.labels.get(task) or task.get_name()
+
+        stack = traceback.extract_stack(frame, limit=self.frames)
+        signature = tuple(f'{entry.filename}:{entry.lineno}' for entry in stack[-3:])
+        return _Sample(label, signature, ''.join(stack.format()))
+
+    def _record(self, sample: _Sample, lag: float) -> None:
+        key = (sample.label, sample.signature)
+        try:
+            offender = self.offenders[key]
+        except KeyError:
+            if len(self.offenders) >= self.max_offenders:
+                del self.offenders[min(self.offenders, key=lambda k: self.offenders[k].total)]
+            offender = self.offenders[key] = Offender(sample.label, sample.stack)
+
+        offender.count += 1
+        offender.total += lag
+        offender.max = max(offender.max, lag)
+        offender.stack = sample.stack
+
+    def top(self, limit: int = 5) -> list[Offender]:
+        return sorted(self.offenders.values(), key=lambda o: o.total, reverse=True)[:limit]
+
+    def reset(self) -> None:
+        self.lag = Histogram()
+        self.stalls = 0
+        self.offenders.clear()
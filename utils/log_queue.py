@@ -0,0 +1,133 @@
+from __future__ import annotations
+
+import copy
+import json
+import logging
+import queue
+import time
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+_EXCEPTION_FORMATTER = logging.Formatter()
+
+
+class DroppingQueueHandler(QueueHandler):
+    """
+    Hands records over to a background thread through a bounded queue.
+
+    When the queue is full, records below WARNING are dropped rather than making the event loop wait,
+    warnings and errors wait a little for room before they are dropped too.
+    """
+
+    def __init__(self, q: queue.Queue, *, block_timeout: float = 0.05) -> None:
+        super().__init__(q)
+        self.block_timeout: float = block_timeout
+        self.dropped: int = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Formatted here, the arguments and traceback may reference objects the event loop keeps changing
+        # while the record waits in the queue. Same as QueueHandler, except the traceback stays separate.
+        record = copy.copy(record)
+        record.message = record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = _EXCEPTION_FORMATTER.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            if record.levelno >= logging.WARNING:
+                try:
+                    self.queue.put(record, timeout=self.block_timeout)
+                    return
+                except queue.Full:
+                    pass
+            self.dropped += 1
+
+
+class BufferedRotatingFileHandler(RotatingFileHandler):
+    """Only flushes to disk every ``flush_interval`` seconds, or right away for warnings and above"""
+
+    def __init__(self, *args, flush_interval: float = 1.0, **kwargs) -> None:
+        self.flush_interval: float = flush_interval
+        self._last_flush: float = time.monotonic()
+        self._force_flush: bool = False
+        super().__init__(*args, **kwargs)
+
+    def emit(self, record: logging.LogRecord) -> None:
+        self._force_flush = record.levelno >= logging.WARNING
+        super().emit(record)
+
+    def flush(self, *, force: bool = False) -> None:
+        now = time.monotonic()
+        if force or self._force_flush or now - self._last_flush >= self.flush_interval:
+            super().flush()
+            self._last_flush = now
+
+    def close(self) -> None:
+        self._force_flush = True
+        super().close()
+
+
+class FlushingQueueListener(QueueListener):
+    """
+    Flushes buffered handlers once no record came in for ``flush_interval`` seconds and when stopped,
+    otherwise the last lines before a quiet period would only be written once the next record arrives.
+    """
+
+    def __init__(self, q: queue.Queue, *handlers: logging.Handler, respect_handler_level: bool = False,
+                 flush_interval: float = 1.0) -> None:
+        super().__init__(q, *handlers, respect_handler_level=respect_handler_level)
+        self.flush_interval: float = flush_interval
+        self._unflushed: bool = False
+
+    def dequeue(self, block: bool) -> logging.LogRecord:
+        while True:
+            try:
+                return self.queue.get(block, timeout=self.flush_interval)
+            except queue.Empty:
+                if not block:
+                    raise
+                self.flush()
+
+    def handle(self, record: logging.LogRecord) -> None:
+        self._unflushed = True
+        super().handle(record)
+
+    def flush(self) -> None:
+        if not self._unflushed:
+            return
+        self._unflushed = False
+        for handler in self.handlers:
+            if isinstance(handler, BufferedRotatingFileHandler):
+                handler.flush(force=True)
+            else:
+                handler.flush()
+
+    def stop(self) -> None:
+        super().stop()
+        self._unflushed = True
+        self.flush()
+
+
+class JSONFormatter(logging.Formatter):
+    """Formats records as JSON lines for log ingestion"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            'time': self.formatTime(record, '%Y-%m-%dT%H:%M:%S') + f'.{int(record.msecs):03}',
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        # Records from the queue come with the traceback already formatted
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data['exc_info'] = record.exc_text
+        if record.stack_info:
+            data['stack_info'] = self.formatStack(record.stack_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
@@ -0,0 +1,205 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import sys
+import time
+from array import array
+from typing import Any, Iterable, Optional, TYPE_CHECKING
+
+import discord
+
+if TYPE_CHECKING:
+    from main import Kannushi
+
+log = logging.getLogger(__name__)
+
+
+class CompactMember:
+    """The bare minimum we keep around for a member that has been evicted from the library's member cache"""
+    __slots__ = ('id', 'role_ids', 'display_name')
+
+    def __init__(self, member: discord.Member) -> None:
+        self.id: int = member.id
+        self.role_ids: array = array('Q', member._roles)
+        self.display_name: str = member.display_name
+
+    def __repr__(self) -> str:
+        return f'<CompactMember id={self.id} display_name={self.display_name!r}>'
+
+
+class MemberCache:
+    """
+    Cache policy that keeps full :class:`discord.Member` objects only for recently active members
+    and for chosen guilds. Everyone else is moved into a :class:`CompactMember` and promoted again on demand.
+    """
+
+    def __init__(self,
+                 bot: Kannushi, *,
+                 enabled: bool = False,
+                 full_guilds: Iterable[int] = (),
+                 active_ttl: float = 30 * 60,
+                 interval: float = 5 * 60) -> None:
+        self.bot: Kannushi = bot
+        self.enabled: bool = enabled
+        self.full_guilds: set[int] = set(full_guilds)
+        self.active_ttl: float = active_ttl
+        self.interval: float = interval
+        self._compact: dict[int, dict[int, CompactMember]] = {}
+        self._active: dict[int, dict[int, float]] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self.enabled and self._task is None:
+            self._task = asyncio.create_task(self._compact_loop())
+
+    def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def __len__(self) -> int:
+        return sum(len(members) for members in self._compact.values())
+
+    def touch(self, member: discord.abc.User) -> None:
+        """Mark a member as active, moving them back into the full cache if they were compacted"""
+        if not self.enabled or not isinstance(member, discord.Member):
+            return
+        guild = member.guild
+        self._active.setdefault(guild.id, {})[member.id] = time.monotonic()
+        compact = self._compact.get(guild.id)
+        if compact is not None and compact.pop(member.id, None) is not None:
+            guild._add_member(member)
+
+    def get(self, guild_id: int, user_id: int) -> Optional[CompactMember]:
+        compact = self._compact.get(guild_id)
+        if compact is None:
+            return None
+        return compact.get(user_id)
+
+    def members(self, guild_id: int) -> Iterable[CompactMember]:
+        return self._compact.get(guild_id, {}).values()
+
+    def remove(self, guild_id: int, user_id: int) -> None:
+        if compact := self._compact.get(guild_id):
+            compact.pop(user_id, None)
+        if active := self._active.get(guild_id):
+            active.pop(user_id, None)
+
+    def recached(self, member: discord.Member) -> None:
+        """The library cached the member again by itself, e.g. when they joined or were updated"""
+        if compact := self._compact.get(member.guild.id):
+            compact.pop(member.id, None)
+
+    def discard_guild(self, guild_id: int) -> None:
+        """Forget a guild, e.g. when we leave it or it was chunked again"""
+        self._compact.pop(guild_id, None)
+        self._active.pop(guild_id, None)
+
+    async def promote(self, guild: discord.Guild, user_id: int) -> Optional[discord.Member]:
+        """Returns the full member, fetching it again if it was compacted"""
+        member = guild.get_member(user_id)
+        if member is not None:
+            return member
+        if self.get(guild.id, user_id) is None:
+            return None
+        try:
+            member = await guild.fetch_member(user_id)
+        except discord.NotFound:
+            self.remove(guild.id, user_id)
+            return None
+        self.touch(member)
+        return member
+
+    async def promote_many(self, guild: discord.Guild, user_ids: Iterable[int]) -> dict[int, discord.Member]:
+        """
+        Returns the full members for the IDs, the compacted ones are requested again at once over the gateway.
+        IDs that are not members of the guild are left out.
+        """
+        found: dict[int, discord.Member] = {}
+        missing: list[int] = []
+        for user_id in user_ids:
+            member = guild.get_member(user_id)
+            if member is not None:
+                found[user_id] = member
+            elif self.get(guild.id, user_id) is not None:
+                missing.append(user_id)
+
+        # The gateway takes up to 100 IDs per request
+        for i in range(0, len(missing), 100):
+            chunk = missing[i:i + 100]
+            for member in await guild.query_members(user_ids=chunk, limit=len(chunk)):
+                found[member.id] = member
+                self.touch(member)
+            for user_id in chunk:
+                if user_id not in found:
+                    self.remove(guild.id, user_id)
+        return found
+
+    def _keep(self, guild: discord.Guild, member: discord.Member, active: dict[int, float], cutoff: float) -> bool:
+        return (member.id in (guild.me.id, guild.owner_id, self.bot.owner_id)
+                or member.voice is not None  # Voice states reference the cached member
+                or active.get(member.id, 0) >= cutoff)
+
+    async def compact_guild(self, guild: discord.Guild) -> int:
+        """Moves every inactive member of a guild into the compact store, returns how many were moved"""
+        if guild.id in self.full_guilds or guild.me is None:
+            return 0
+
+        cutoff = time.monotonic() - self.active_ttl
+        active = self._active.get(guild.id, {})
+        # Forget about people that have not been active for a while
+        for user_id in [user_id for user_id, last in active.items() if last < cutoff]:
+            del active[user_id]
+
+        compact = self._compact.setdefault(guild.id, {})
+        # Some member updates cache the member again without an event we could act on
+        for user_id in compact.keys() & guild._members.keys():
+            del compact[user_id]
+
+        moved = 0
+        for i, member in enumerate(list(guild._members.values())):
+            if self._keep(guild, member, active, cutoff):
+                continue
+            compact[member.id] = CompactMember(member)
+            guild._remove_member(member)
+            moved += 1
+            if i % 1000 == 999:
+                await asyncio.sleep(0)  # Let everything else run on large guilds
+        return moved
+
+    async def _compact_loop(self) -> None:
+        await self.bot.wait_until_ready()
+        while not self.bot.is_closed():
+            moved = 0
+            for guild in self.bot.guilds:
+                moved += await self.compact_guild(guild)
+            if moved:
+                log.info('Compacted %s members, %s compact members cached', moved, len(self))
+            await asyncio.sleep(self.interval)
+
+
+_SHARED = (discord.Guild, discord.Client, discord.enums.Enum, type, type(sys))
+
+
+def sizeof(obj: Any, *, _seen: Optional[set[int]] = None) -> int:
+    """Approximate deep size of an object in bytes, not counting objects shared by the whole cache"""
+    seen = _seen if _seen is not None else set()
+    if id(obj) in seen or isinstance(obj, _SHARED) or type(obj).__name__ == 'ConnectionState':
+        return 0
+    seen.add(id(obj))
+
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(sizeof(k, _seen=seen) + sizeof(v, _seen=seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(sizeof(item, _seen=seen) for item in obj)
+    elif not isinstance(obj, (str, bytes, int, float, array)):
+        for cls in type(obj).__mro__:
+            slots = getattr(cls, '__slots__', ())
+            for slot in (slots,) if isinstance(slots, str) else slots:
+                if not slot.startswith('__'):
+                    size += sizeof(getattr(obj, slot, None), _seen=seen)
+        if hasattr(obj, '__dict__'):
+            size += sizeof(obj.__dict__, _seen=seen)
+    return size
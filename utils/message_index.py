@@ -0,0 +1,138 @@
+from __future__ import annotations
+
+from bisect import bisect_left
+from collections import OrderedDict, deque
+from typing import Iterable
+
+import discord
+
+
+class RecentEntry:
+    """A message that clean might want to delete, either sent by us or one that invoked us"""
+    __slots__ = ('id', 'seq', 'author_name', 'own', 'command', 'mentions')
+
+    def __init__(self, id: int, seq: int, *, author_name: str, own: bool, command: bool, mentions: bool) -> None:
+        self.id: int = id
+        self.seq: int = seq
+        self.author_name: str = author_name
+        self.own: bool = own
+        self.command: bool = command
+        self.mentions: bool = mentions
+
+    @classmethod
+    def from_message(cls, message: discord.Message, *, seq: int = -1, own: bool, command: bool) -> RecentEntry:
+        return cls(message.id, seq,
+                   author_name=message.author.display_name,
+                   own=own,
+                   command=command,
+                   mentions=bool(message.mentions or message.role_mentions))
+
+
+class ChannelBuffer:
+    __slots__ = ('entries', 'seq', 'complete_seq', 'boundary', 'last_id')
+
+    def __init__(self, message_id: int) -> None:
+        self.entries: deque[RecentEntry] = deque()
+        self.seq: int = 0  # How many messages we have seen in this channel, minus the ones deleted since
+        self.last_id: int = message_id
+        # Every relevant message from complete_seq onwards is in entries.
+        # Those are exactly the messages with an ID of at least boundary.
+        self.complete_seq: int = 0
+        self.boundary: int = message_id
+
+
+class RecentMessages:
+    """
+    Bounded ring buffer per channel of the recent messages clean cares about,
+    so that it can skip fetching the history that we have already seen go by.
+
+    Every message still counts towards the position in the channel, but only our own messages
+    and command invocations are kept. Channels are only tracked from the first message kept for them
+    and are evicted least recently used first once ``max_entries`` are stored in total.
+    """
+
+    def __init__(self, *, per_channel: int = 250, max_entries: int = 50_000) -> None:
+        self.per_channel: int = per_channel
+        self.max_entries: int = max_entries
+        self._channels: OrderedDict[int, ChannelBuffer] = OrderedDict()
+        self._size: int = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def observe(self, message: discord.Message, *, own: bool, command: bool) -> None:
+        channel_id = message.channel.id
+        buffer = self._channels.get(channel_id)
+        if buffer is None:
+            if not (own or command):
+                return
+            buffer = self._channels[channel_id] = ChannelBuffer(message.id)
+        else:
+            self._channels.move_to_end(channel_id)
+
+        seq = buffer.seq
+        buffer.seq += 1
+        buffer.last_id = message.id
+        if not (own or command):
+            return
+
+        entries = buffer.entries
+        if len(entries) >= self.per_channel:
+            evicted = entries.popleft()
+            buffer.complete_seq = evicted.seq + 1
+            buffer.boundary = evicted.id + 1
+            self._size -= 1
+        entries.append(RecentEntry.from_message(message, seq=seq, own=own, command=command))
+        self._size += 1
+
+        while self._size > self.max_entries:
+            _, lru = self._channels.popitem(last=False)
+            self._size -= len(lru.entries)
+
+    def remove(self, channel_id: int, message_ids: Iterable[int]) -> None:
+        buffer = self._channels.get(channel_id)
+        if buffer is None:
+            return
+        # Deleted messages we saw go by no longer count towards the position of the ones after them,
+        # otherwise window would cover fewer messages than asked for
+        deleted = sorted(id for id in set(message_ids) if buffer.boundary <= id <= buffer.last_id)
+        if not deleted:
+            return
+        removed = set(deleted)
+        entries = deque()
+        for entry in buffer.entries:
+            if entry.id not in removed:
+                entry.seq -= bisect_left(deleted, entry.id)
+                entries.append(entry)
+        self._size -= len(buffer.entries) - len(entries)
+        buffer.entries = entries
+        buffer.seq -= len(deleted)
+        if not entries:
+            del self._channels[channel_id]
+
+    def clear(self) -> None:
+        """Forget everything, e.g. when we could have missed messages"""
+        self._channels.clear()
+        self._size = 0
+
+    def window(self, channel_id: int, before_id: int, limit: int) -> tuple[list[RecentEntry], int, int]:
+        """
+        Returns the stored entries among the ``limit`` messages before ``before_id``,
+        along with how many older messages are not covered and have to come from history,
+        and the message ID to fetch that history before.
+        """
+        buffer = self._channels.get(channel_id)
+        if buffer is None:
+            return [], limit, before_id
+
+        end = next((e.seq for e in reversed(buffer.entries) if e.id == before_id), None)
+        if end is None:  # We did not see the message go by
+            return [], limit, before_id
+
+        start = end - limit
+        entries = [e for e in buffer.entries if start <= e.seq < end]
+        if start >= buffer.complete_seq:
+            return entries, 0, before_id
+
+        remaining = limit - (end - buffer.complete_seq)
+        return entries, remaining, buffer.boundary
@@ -0,0 +1,245 @@
+"""
+In-memory metrics for the bot, served in the Prometheus text format on a local HTTP endpoint.
+
+Everything is recorded on the event loop thread into plain counters and histograms, so recording
+needs no locks. Gauges such as memory use are only read when the endpoint is scraped.
+"""
+from __future__ import annotations
+
+import logging
+import math
+from typing import Iterable, Optional, TYPE_CHECKING
+
+from utils.histogram import BUCKETS, Histogram
+
+if TYPE_CHECKING:
+    import psutil
+    from aiohttp import web
+
+    from main import Kannushi
+
+log = logging.getLogger(__name__)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class CommandStats:
+    __slots__ = ('count', 'errors', 'prepare', 'latency', 'deferred')
+
+    def __init__(self) -> None:
+        self.count: int = 0
+        # error type name: count
+        self.errors: dict[str, int] = {}
+        # Checks and argument conversion, until the command callback starts
+        self.prepare: Histogram = Histogram()
+        # The whole invocation, including prepare
+        self.latency: Histogram = Histogram()
+        # Interactions deferred automatically because the command had not responded in time
+        self.deferred: int = 0
+
+
+class Metrics:
+    def __init__(self) -> None:
+        self.context: Histogram = Histogram()
+        self.messages: int = 0
+        self.commands: dict[str, CommandStats] = {}
+        # check name: (passed, failed)
+        self.checks: dict[str, list[int]] = {}
+        self._process: Optional[psutil.Process] = None
+
+    @property
+    def process(self) -> psutil.Process:
+        # Imported on the first scrape, so bots without the metrics server never import psutil
+        if self._process is None:
+            import psutil
+
+            self._process = psutil.Process()
+        return self._process
+
+    def command(self, name: str) -> CommandStats:
+        try:
+            return self.commands[name]
+        except KeyError:
+            stats = self.commands[name] = CommandStats()
+            return stats
+
+    def command_error(self, name: str, error: BaseException) -> None:
+        errors = self.command(name).errors
+        kind = type(error).__name__
+        errors[kind] = errors.get(kind, 0) + 1
+
+    def check(self, name: str, passed: bool) -> None:
+        try:
+            counts = self.checks[name]
+        except KeyError:
+            counts = self.checks[name] = [0, 0]
+        counts[not passed] += 1
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels: Optional[dict[str, str]]) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(str(value))}"' for key, value in labels.items()) + '}'
+
+
+def _number(value: float) -> str:
+    if math.isnan(value):
+        return 'NaN'
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Writer:
+    def __init__(self) -> None:
+        self.lines: list[str] = []
+
+    def header(self, name: str, kind: str, help: str) -> None:
+        self.lines.append(f'# HELP {name} {help}')
+        self.lines.append(f'# TYPE {name} {kind}')
+
+    def sample(self, name: str, value: float, labels: Optional[dict[str, str]] = None) -> None:
+        self.lines.append(f'{name}{_labels(labels)} {_number(value)}')
+
+    def metric(self, name: str, kind: str, help: str, value: float) -> None:
+        self.header(name, kind, help)
+        self.sample(name, value)
+
+    def histogram(self, name: str, histogram: Histogram, labels: Optional[dict[str, str]] = None) -> None:
+        labels = labels or {}
+        cumulative = 0
+        for bound, count in zip(BUCKETS, histogram.counts):
+            cumulative += count
+            self.sample(f'{name}_bucket', cumulative, {**labels, 'le': _number(bound)})
+        self.sample(f'{name}_sum', histogram.total, labels)
+        self.sample(f'{name}_count', histogram.count, labels)
+
+    def histograms(self, name: str, help: str, items: Iterable[tuple[dict[str, str], Histogram]]) -> None:
+        self.header(name, 'histogram', help)
+        for labels, histogram in items:
+            self.histogram(name, histogram, labels)
+
+    def render(self) -> str:
+        return '\n'.join(self.lines) + '\n'
+
+
+def render(bot: Kannushi) -> str:
+    metrics = bot.metrics
+    w = _Writer()
+
+    w.metric('kannushi_messages_total', 'counter', 'Messages seen from users', metrics.messages)
+    w.histograms('kannushi_get_context_seconds', 'Time spent building the context of a message',
+                 [({}, metrics.context)])
+
+    commands = sorted(metrics.commands.items())
+    w.header('kannushi_commands_total', 'counter', 'Commands invoked')
+    for name, stats in commands:
+        w.sample('kannushi_commands_total', stats.count, {'command': name})
+    w.header('kannushi_command_errors_total', 'counter', 'Errors raised by commands, by error type')
+    for name, stats in commands:
+        for error, count in sorted(stats.errors.items()):
+            w.sample('kannushi_command_errors_total', count, {'command': name, 'error': error})
+    w.header('kannushi_command_deferred_total', 'counter', 'Interactions deferred because the command was slow')
+    for name, stats in commands:
+        w.sample('kannushi_command_deferred_total', stats.deferred, {'command': name})
+    w.histograms('kannushi_command_prepare_seconds', 'Time spent on checks and converting arguments',
+                 (({'command': name}, stats.prepare) for name, stats in commands))
+    w.histograms('kannushi_command_seconds', 'Time spent invoking a command',
+                 (({'command': name}, stats.latency) for name, stats in commands))
+
+    w.header('kannushi_checks_total', 'counter', 'Permission checks, by result')
+    for name, (passed, failed) in sorted(metrics.checks.items()):
+        w.sample('kannushi_checks_total', passed, {'check': name, 'result': 'passed'})
+        w.sample('kannushi_checks_total', failed, {'check': name, 'result': 'failed'})
+
+    w.metric('kannushi_gateway_latency_seconds', 'gauge', 'Latency of the gateway heartbeat', bot.latency)
+    w.metric('kannushi_guilds', 'gauge', 'Guilds the bot is in', len(bot.guilds))
+    w.metric('kannushi_members', 'gauge', 'Members across all guilds',
+             sum(guild.member_count or 0 for guild in bot.guilds))
+    w.metric('kannushi_cached_members', 'gauge', 'Fully cached members',
+             sum(len(guild._members) for guild in bot.guilds))
+    w.metric('kannushi_compact_members', 'gauge', 'Members in the compact member cache', len(bot.member_cache))
+
+    process = metrics.process
+    with process.oneshot():
+        cpu = process.cpu_times()
+        w.metric('process_resident_memory_bytes', 'gauge', 'Resident memory size', process.memory_info().rss)
+        w.metric('process_cpu_seconds_total', 'counter', 'User and system CPU time', cpu.user + cpu.system)
+        if hasattr(process, 'num_fds'):  # Not available on Windows
+            w.metric('process_open_fds', 'gauge', 'Open file descriptors', process.num_fds())
+        w.metric('process_start_time_seconds', 'gauge', 'Start time of the process', process.create_time())
+
+    if bot.log_handler is not None:
+        w.metric('kannushi_log_dropped_total', 'counter', 'Log records dropped because the log queue was full',
+                 bot.log_handler.queue_handler.dropped)
+
+    queue = bot.send_queue
+    w.metric('kannushi_send_queue_depth', 'gauge', 'Messages waiting to be sent', queue.depth)
+    w.metric('kannushi_send_queue_requested_total', 'counter', 'Messages asked to be sent through the queue',
+             queue.requested)
+    w.metric('kannushi_send_queue_sent_total', 'counter', 'Messages the queue actually sent', queue.sent)
+
+    pool = bot.pool
+    w.metric('kannushi_db_pool_connections', 'gauge', 'Open database connections', pool.get_size())
+    w.metric('kannushi_db_pool_idle_connections', 'gauge', 'Idle database connections', pool.get_idle_size())
+    w.histograms('kannushi_db_acquire_seconds', 'Time spent waiting for a database connection',
+                 [({}, pool.metrics.acquire)])
+    queries = pool.metrics.queries.values()
+    w.metric('kannushi_db_queries_total', 'counter', 'Queries run', sum(q.latency.count for q in queries))
+    w.metric('kannushi_db_query_errors_total', 'counter', 'Queries that failed', sum(q.errors for q in queries))
+    w.metric('kannushi_db_query_seconds_total', 'counter', 'Time spent running queries',
+             sum(q.latency.total for q in queries))
+
+    tasks = sorted(bot.executor.stats.items())
+    w.header('kannushi_executor_inline_total', 'counter', 'Tasks small enough to run on the event loop')
+    for kind, stats in tasks:
+        w.sample('kannushi_executor_inline_total', stats.inline, {'kind': kind})
+    w.histograms('kannushi_executor_wait_seconds', 'Time tasks waited for a worker',
+                 (({'kind': kind}, stats.wait) for kind, stats in tasks))
+    w.histograms('kannushi_executor_run_seconds', 'Time tasks took to run',
+                 (({'kind': kind}, stats.run) for kind, stats in tasks))
+
+    lag = bot.lag_monitor
+    w.histograms('kannushi_loop_lag_seconds', 'How late the event loop woke up', [({}, lag.lag)])
+    w.metric('kannushi_loop_stalls_total', 'counter', 'Times the event loop was blocked past the threshold',
+             lag.stalls)
+    return w.render()
+
+
+class MetricsServer:
+    """Serves :func:`render` at ``/metrics``"""
+
+    def __init__(self, bot: Kannushi, *, host: str = '127.0.0.1', port: int = 9813) -> None:
+        self.bot: Kannushi = bot
+        self.host: str = host
+        self.port: int = port
+        self._runner: Optional[web.AppRunner] = None
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        from aiohttp import web
+
+        return web.Response(text=render(self.bot), headers={'Content-Type': CONTENT_TYPE})
+
+    async def start(self) -> None:
+        # Imported here, aiohttp.web is slow to import and only needed when the server is enabled
+        from aiohttp import web
+
+        app = web.Application()
+        app.router.add_get('/metrics', self._handle)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        try:
+            await web.TCPSite(runner, self.host, self.port).start()
+        except OSError as e:
+            await runner.cleanup()
+            log.error('Could not serve metrics on %s:%s: %s', self.host, self.port, e)
+            return
+        self._runner = runner
+
+    async def close(self) -> None:
+        if self._runner is not None:
+            runner, self._runner = self._runner, None
+            await runner.cleanup()
@@ -0,0 +1,189 @@
+from __future__ import annotations
+
+import asyncio
+import traceback
+from typing import Optional, TYPE_CHECKING
+
+import asyncpg
+import discord
+
+from utils.lazy import lazy_import
+
+if TYPE_CHECKING:
+    import tabulate
+
+    from utils.context import Context
+    from utils.db import InstrumentedPool
+else:
+    tabulate = lazy_import('tabulate')
+
+# Pages with at least this many cells are rendered off the event loop
+THREAD_TABLE_CELLS = 200
+
+
+class CursorPaginator(discord.ui.View):
+    """
+    Shows the result of a query one page at a time.
+
+    Read-only queries are fetched a page at a time, the next page is only fetched once someone asks for it.
+    Every page is fetched with a LIMIT and OFFSET on its own short acquisition and read-only transaction,
+    so an open view holds no connection. Without an ORDER BY, rows may shift between pages if the table changes.
+    Anything that writes, or cannot be paged like that, is run to completion right away and paged from memory.
+    """
+    message: discord.Message
+
+    def __init__(self, ctx: Context, pool: InstrumentedPool, query: str, *,
+                 per_page: int = 15, timeout: float = 120, max_width: int = 40) -> None:
+        super().__init__(timeout=timeout)
+        self.ctx: Context = ctx
+        self.pool: InstrumentedPool = pool
+        self.query: str = query.rstrip('; \n')
+        self.per_page: int = per_page
+        self.max_width: int = max_width
+        self.headers: list[str] = []
+        self.pages: list[str] = []
+        self.index: int = 0
+        self.exhausted: bool = False
+        # The query wrapped to fetch a page of it, None when everything was fetched up front
+        self._page_query: Optional[str] = None
+        # How many rows have been fetched with _page_query so far
+        self._offset: int = 0
+        # Rows of a query that could not be paged, fetched all at once
+        self._rows: list[asyncpg.Record] = []
+        # One row past the current page, so we know whether there is another page without asking twice
+        self._lookahead: list[asyncpg.Record] = []
+        self._lock: asyncio.Lock = asyncio.Lock()
+
+    async def start(self) -> None:
+        """Runs the query and sends the first page. Raises whatever the query raised."""
+        first: Optional[list[asyncpg.Record]] = None
+        async with self.pool.acquire() as con:
+            async with con.transaction(readonly=True):
+                statement = await con.prepare(self.query)
+                self.headers = [attr.name for attr in statement.get_attributes()]
+                if self.headers:
+                    page_query = f'SELECT * FROM ({self.query}) AS page LIMIT $1 OFFSET $2'
+                    try:
+                        # In a savepoint, queries that cannot be a subquery or that write only fail this
+                        async with con.transaction():
+                            rows = await con.fetch(page_query, self.per_page + 1, 0)
+                    except asyncpg.PostgresError:
+                        pass
+                    else:
+                        self._page_query = page_query
+                        self._offset = len(rows)
+                        first = rows
+
+            if self._page_query is None:
+                # Outside of the read-only transaction, so writes are committed like any other query
+                self._rows = await statement.fetch()
+                status = statement.get_statusmsg()
+
+        if not self.headers:
+            await self.ctx.send(f'```\n{status}```')
+            return
+        await self._fetch_page(first)
+
+        if not self.pages:
+            await self.ctx.send('```\nNo rows```')
+            return
+
+        self._update_buttons()
+        if self.exhausted:
+            self.stop()
+            self.message = await self.ctx.send(self.pages[0])
+            return
+        try:
+            self.message = await self.ctx.send(self.pages[0], view=self)
+        except BaseException:
+            self.stop()
+            raise
+
+    async def _fetch_rows(self, count: int) -> list[asyncpg.Record]:
+        if self._page_query is None:
+            rows, self._rows = self._rows[:count], self._rows[count:]
+            return rows
+        async with self.pool.acquire() as con:
+            async with con.transaction(readonly=True):
+                rows = await con.fetch(self._page_query, count, self._offset)
+        self._offset += len(rows)
+        return rows
+
+    async def _fetch_page(self, rows: Optional[list[asyncpg.Record]] = None) -> None:
+        if rows is None:
+            rows = self._lookahead + await self._fetch_rows(self.per_page + 1 - len(self._lookahead))
+        if len(rows) > self.per_page:
+            self._lookahead = rows[self.per_page:]
+            rows = rows[:self.per_page]
+        else:
+            self._lookahead = []
+            self.exhausted = True
+
+        if rows:
+            self.pages.append(await self._render(rows, len(self.pages) * self.per_page))
+
+    async def _render(self, rows: list[asyncpg.Record], offset: int) -> str:
+        values = [[self._shorten(repr(value)) for value in row] for row in rows]
+        table = await self.ctx.bot.executor.thread('tabulate', tabulate.tabulate, values,
+                                                   tablefmt='psql', headers=self.headers,
+                                                   size=len(values) * len(self.headers), threshold=THREAD_TABLE_CELLS)
+        footer = f'Page {len(self.pages) + 1} | rows {offset + 1}-{offset + len(rows)}'
+        # Keep the page inside a single message, wide rows are cut off on the right
+        room = 2000 - len(footer) - 10
+        if len(table) > room:
+            table = table[:room - 1] + '…'
+        return f'```\n{table}```{footer}'
+
+    def _shorten(self, value: str) -> str:
+        if len(value) > self.max_width:
+            return value[:self.max_width - 1] + '…'
+        return value
+
+    def _update_buttons(self) -> None:
+        self.previous_page.disabled = self.index == 0
+        self.next_page.disabled = self.exhausted and self.index >= len(self.pages) - 1
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        if interaction.user.id != self.ctx.author.id:
+            await interaction.response.send_message('This paginator is not meant for you, sorry.', ephemeral=True)
+            return False
+        return True
+
+    async def on_timeout(self) -> None:
+        for item in self.children:
+            item.disabled = True
+        try:
+            await self.message.edit(view=self)
+        except discord.HTTPException:
+            pass
+
+    @discord.ui.button(label='Previous', style=discord.ButtonStyle.grey)
+    async def previous_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        self.index = max(self.index - 1, 0)
+        self._update_buttons()
+        await interaction.response.edit_message(content=self.pages[self.index], view=self)
+
+    @discord.ui.button(label='Next', style=discord.ButtonStyle.grey)
+    async def next_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        async with self._lock:
+            if self.index + 1 >= len(self.pages) and not self.exhausted:
+                # Fetching can take longer than discord waits for a response
+                await interaction.response.defer()
+                try:
+                    await self._fetch_page()
+                except Exception:
+                    self.stop()
+                    await interaction.followup.send(f'```py\n{traceback.format_exc()[-1900:]}\n```')
+                    return
+            self.index = min(self.index + 1, len(self.pages) - 1)
+
+        self._update_buttons()
+        if interaction.response.is_done():
+            await interaction.edit_original_response(content=self.pages[self.index], view=self)
+        else:
+            await interaction.response.edit_message(content=self.pages[self.index], view=self)
+
+    @discord.ui.button(label='Stop', style=discord.ButtonStyle.red)
+    async def stop_pages(self, interaction: discord.Interaction, button: discord.ui.Button):
+        self.stop()
+        await interaction.response.edit_message(view=None)
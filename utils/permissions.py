@@ -0,0 +1,97 @@
+from __future__ import annotations
+
+from array import array
+from typing import Optional, Union
+
+import discord
+
+
+class PermissionCache:
+    """
+    Remembers resolved permissions per guild, channel and member, so checks do not go through
+    every role and overwrite again for each command.
+
+    Role, overwrite and guild changes have to be reported through the ``invalidate_*`` methods.
+    A member's role ids are stored with their permissions and compared on lookup, so role changes are
+    picked up even when the update event never reached us, e.g. for members that were not cached.
+    Timed out members and threads are never cached, their permissions depend on more than that.
+    """
+
+    def __init__(self, *, max_entries: int = 100_000) -> None:
+        self.max_entries: int = max_entries
+        # guild_id: {channel_id, or None for guild permissions: {member_id: (role ids, permission value)}}
+        self._guilds: dict[int, dict[Optional[int], dict[int, tuple[array, int]]]] = {}
+        self._size: int = 0
+        self.hits: int = 0
+        self.misses: int = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def channel(self, channel: Union[discord.abc.GuildChannel, discord.abc.PrivateChannel, discord.Thread],
+                member: Union[discord.Member, discord.User]) -> discord.Permissions:
+        """Cached ``channel.permissions_for(member)``"""
+        guild = getattr(channel, 'guild', None)
+        if (guild is None or isinstance(channel, discord.Thread) or not isinstance(member, discord.Member)
+                or member.is_timed_out()):
+            return channel.permissions_for(member)  # type: ignore
+
+        members = self._members(guild.id, channel.id)
+        entry = members.get(member.id)
+        if entry is not None and entry[0] == member._roles:
+            self.hits += 1
+            return discord.Permissions(entry[1])
+
+        permissions = channel.permissions_for(member)
+        self._store(members, member, permissions, channel.id)
+        return permissions
+
+    def guild(self, member: discord.Member) -> discord.Permissions:
+        """Cached ``member.guild_permissions``"""
+        members = self._members(member.guild.id, None)
+        entry = members.get(member.id)
+        if entry is not None and entry[0] == member._roles:
+            self.hits += 1
+            return discord.Permissions(entry[1])
+
+        permissions = member.guild_permissions
+        self._store(members, member, permissions, None)
+        return permissions
+
+    def _members(self, guild_id: int, channel_id: Optional[int]) -> dict[int, tuple[array, int]]:
+        try:
+            return self._guilds[guild_id][channel_id]
+        except KeyError:
+            return self._guilds.setdefault(guild_id, {}).setdefault(channel_id, {})
+
+    def _store(self, members: dict[int, tuple[array, int]], member: discord.Member,
+               permissions: discord.Permissions, channel_id: Optional[int]) -> None:
+        self.misses += 1
+        if member.id not in members:
+            if self._size >= self.max_entries:
+                # Starting over is cheaper than tracking what was used least
+                self.clear()
+                members = self._members(member.guild.id, channel_id)
+            self._size += 1
+        members[member.id] = (array('Q', member._roles), permissions.value)
+
+    def invalidate_guild(self, guild_id: int) -> None:
+        """Roles, the owner or the guild itself changed"""
+        channels = self._guilds.pop(guild_id, None)
+        if channels:
+            self._size -= sum(map(len, channels.values()))
+
+    def invalidate_channel(self, guild_id: int, channel_id: int) -> None:
+        """The overwrites of a channel changed"""
+        channels = self._guilds.get(guild_id)
+        if channels and (members := channels.pop(channel_id, None)):
+            self._size -= len(members)
+
+    def invalidate_member(self, guild_id: int, member_id: int) -> None:
+        for members in self._guilds.get(guild_id, {}).values():
+            if members.pop(member_id, None) is not None:
+                self._size -= 1
+
+    def clear(self) -> None:
+        self._guilds.clear()
+        self._size = 0
@@ -0,0 +1,214 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import re
+from typing import Optional, Iterable, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import asyncpg
+
+log = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS guild_prefixes (
+    guild_id BIGINT PRIMARY KEY,
+    prefixes TEXT[] NOT NULL DEFAULT '{}'
+);
+"""
+
+
+class PrefixMatcher:
+    """
+    Matches the start of a message against a set of prefixes with a single precompiled regex.
+
+    The prefixes are folded into a trie first so that prefixes sharing a common start are only compared once,
+    and the longest matching prefix always wins.
+    """
+    __slots__ = ('prefixes', 'pattern')
+
+    def __init__(self, prefixes: Iterable[str], *, case_insensitive: bool = False) -> None:
+        self.prefixes: tuple[str, ...] = tuple(p for p in prefixes if p)
+        if not self.prefixes:
+            self.pattern: Optional[re.Pattern[str]] = None
+            return
+
+        words = [p.lower() for p in self.prefixes] if case_insensitive else self.prefixes
+        trie: dict = {}
+        for word in words:
+            node = trie
+            for char in word:
+                node = node.setdefault(char, {})
+            node[''] = {}  # Marks the end of a prefix
+
+        flags = re.IGNORECASE if case_insensitive else 0
+        self.pattern = re.compile(self._build(trie), flags)
+
+    @classmethod
+    def _build(cls, node: dict) -> str:
+        terminal = '' in node
+        branches = [re.escape(char) + cls._build(child) for char, child in node.items() if char]
+        if not branches:
+            return ''
+        if len(branches) == 1 and not terminal:
+            return branches[0]
+        # Greedy so the longer prefix is tried first, falling back to the shorter one
+        return f'(?:{"|".join(branches)}){"?" if terminal else ""}'
+
+    def match(self, content: str) -> Optional[str]:
+        """Returns the prefix as it appears in content, or None if content does not start with a prefix"""
+        if self.pattern is None:
+            return None
+        m = self.pattern.match(content)
+        return m.group() if m else None
+
+
+class PrefixStore:
+    """
+    Per-guild prefixes stored in Postgres and served from an in-process cache.
+
+    Every guild's prefixes are loaded once at startup, so resolving a prefix never touches the database.
+    Writes go through :meth:`set` which notifies every other bot process through LISTEN/NOTIFY.
+    """
+    CHANNEL = 'kannushi_prefixes'
+    RESYNC_DELAY = 5
+
+    def __init__(self,
+                 pool: asyncpg.Pool,
+                 default: Iterable[str], *,
+                 bot_id: int,
+                 case_insensitive: bool = False) -> None:
+        self.pool: asyncpg.Pool = pool
+        self.default: list[str] = list(default)
+        self.mentions: list[str] = [f'<@{bot_id}> ', f'<@!{bot_id}> ']  # Accept mentioning the bot as prefix
+        self.case_insensitive: bool = case_insensitive
+        self._cache: dict[int, list[str]] = {}
+        # Built lazily and thrown away whenever the prefixes of a guild change, the None key holds the defaults
+        self._resolved: dict[Optional[int], list[str]] = {}
+        self._matchers: dict[Optional[int], PrefixMatcher] = {}
+        self._listener: Optional[asyncpg.Connection] = None
+        # Reloads and reconnects started from asyncpg callbacks, kept so they are not garbage collected midway
+        self._tasks: set[asyncio.Task[None]] = set()
+
+    async def start(self) -> None:
+        await self.pool.execute(SCHEMA)
+        await self.reload()
+        await self._listen()
+
+    async def close(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        if self._listener is None:
+            return
+        con, self._listener = self._listener, None
+        try:
+            await con.remove_listener(self.CHANNEL, self._on_notify)
+        finally:
+            await self.pool.release(con)
+
+    async def _listen(self) -> None:
+        # LISTEN is bound to a single connection, so we hold on to one for the lifetime of the store
+        con = await self.pool.acquire()
+        await con.add_listener(self.CHANNEL, self._on_notify)
+        con.add_termination_listener(self._on_termination)
+        self._listener = con
+
+    def _on_termination(self, con: asyncpg.Connection) -> None:
+        if self._listener is not con:
+            return
+        log.warning('Prefix listener connection was closed, reconnecting')
+        self._listener = None
+        self._spawn(self._resync())
+
+    async def _resync(self) -> None:
+        while True:
+            try:
+                if self._listener is None:
+                    await self._listen()
+                # We might have missed notifications while disconnected
+                await self.reload()
+                return
+            except Exception:
+                log.exception('Resyncing prefixes failed, retrying in %ss', self.RESYNC_DELAY)
+                await asyncio.sleep(self.RESYNC_DELAY)
+
+    def _spawn(self, coro) -> None:
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._task_done)
+
+    def _task_done(self, task: asyncio.Task[None]) -> None:
+        self._tasks.discard(task)
+        if not task.cancelled() and (exc := task.exception()) is not None:
+            log.error('Reloading prefixes failed', exc_info=exc)
+
+    def _on_notify(self, con: asyncpg.Connection, pid: int, channel: str, payload: str) -> None:
+        try:
+            guild_id = int(payload)
+        except ValueError:
+            log.warning('Received malformed prefix notification: %r', payload)
+            return
+        self._spawn(self.reload(guild_id))
+
+    async def reload(self, guild_id: Optional[int] = None) -> None:
+        """Reload prefixes from the database, for a single guild if specified, otherwise everything."""
+        if guild_id is None:
+            rows = await self.pool.fetch('SELECT guild_id, prefixes FROM guild_prefixes;')
+            self.load({row['guild_id']: row['prefixes'] for row in rows})
+            return
+
+        prefixes = await self.pool.fetchval('SELECT prefixes FROM guild_prefixes WHERE guild_id=$1;', guild_id)
+        self._update(guild_id, prefixes)
+
+    def load(self, prefixes: dict[int, Iterable[str]]) -> None:
+        """Replaces the prefixes of every guild in the cache, without touching the database"""
+        self._cache = {guild_id: list(guild_prefixes) for guild_id, guild_prefixes in prefixes.items()}
+        self._resolved.clear()
+        self._matchers.clear()
+
+    def _update(self, guild_id: int, prefixes: Optional[Iterable[str]]) -> None:
+        if prefixes is None:
+            self._cache.pop(guild_id, None)
+        else:
+            self._cache[guild_id] = list(prefixes)
+        self._resolved.pop(guild_id, None)
+        self._matchers.pop(guild_id, None)
+
+    def get(self, guild_id: Optional[int]) -> list[str]:
+        """Returns the prefixes for a guild. This never does any I/O."""
+        if guild_id is None:
+            return self.default
+        return self._cache.get(guild_id, self.default)
+
+    def resolve(self, guild_id: Optional[int]) -> list[str]:
+        """Returns every valid prefix for a guild, including mentioning the bot. The list must not be modified."""
+        key = guild_id if guild_id in self._cache else None
+        try:
+            return self._resolved[key]
+        except KeyError:
+            prefixes = self._resolved[key] = self.mentions + self.get(key)
+            return prefixes
+
+    def matcher(self, guild_id: Optional[int]) -> PrefixMatcher:
+        """Returns the matcher for every valid prefix of a guild, it is only rebuilt when the prefixes change."""
+        key = guild_id if guild_id in self._cache else None
+        try:
+            return self._matchers[key]
+        except KeyError:
+            matcher = self._matchers[key] = PrefixMatcher(self.resolve(key), case_insensitive=self.case_insensitive)
+            return matcher
+
+    async def set(self, guild_id: int, prefixes: Optional[Iterable[str]]) -> None:
+        """Set the prefixes for a guild. Passing None resets to the default prefixes."""
+        async with self.pool.acquire() as con, con.transaction():
+            if prefixes is None:
+                await con.execute('DELETE FROM guild_prefixes WHERE guild_id=$1;', guild_id)
+            else:
+                prefixes = list(dict.fromkeys(prefixes))  # Remove duplicates but keep order
+                await con.execute('INSERT INTO guild_prefixes (guild_id, prefixes) VALUES ($1, $2) '
+                                  'ON CONFLICT (guild_id) DO UPDATE SET prefixes=EXCLUDED.prefixes;',
+                                  guild_id, prefixes)
+            # Notifications are only delivered once the transaction commits
+            await con.execute('SELECT pg_notify($1, $2);', self.CHANNEL, str(guild_id))
+
+        self._update(guild_id, prefixes)
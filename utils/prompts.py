@@ -0,0 +1,132 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from typing import Optional, TYPE_CHECKING
+
+import discord
+from discord.ext import commands
+
+from utils.deleter import MessageDeleter
+from utils.timer_wheel import TimerWheel
+
+if TYPE_CHECKING:
+    from utils.context import Context
+
+log = logging.getLogger(__name__)
+
+
+class TooManyPrompts(commands.CommandError):
+    def __init__(self, limit: int) -> None:
+        self.limit: int = limit
+        super().__init__(f'You already have {limit} open prompts, answer one of them or wait for it to expire first.')
+
+
+class PromptView(discord.ui.View):
+    """
+    A view waiting on a single user, whose timeout is owned by the bot's :class:`PromptTracker`
+    instead of a task per view. Call :meth:`open` before sending it.
+
+    If ``delete_on_timeout`` is set the message is deleted when it expires, batched with the other prompts in
+    the channel that expired at the same time, otherwise :meth:`on_timeout` is called.
+    """
+    message: Optional[discord.Message] = None
+    delete_on_timeout: bool = False
+
+    def __init__(self, ctx: Context, *, timeout: float) -> None:
+        super().__init__(timeout=None)
+        self.ctx: Context = ctx
+        self.prompt_timeout: float = timeout
+        self.timed_out: bool = False
+
+    def open(self) -> None:
+        """Starts the timeout, raises :exc:`TooManyPrompts` if the author has too many open prompts already"""
+        self.ctx.bot.prompts.add(self, self.ctx.author.id, self.prompt_timeout)
+
+    def stop(self) -> None:
+        self.ctx.bot.prompts.remove(self, self.ctx.author.id)
+        super().stop()
+
+
+class PromptTracker:
+    """
+    Owns the timeouts of every open prompt through a single :class:`TimerWheel`,
+    limits how many prompts a user can have open and cleans expired prompts up in batches.
+    """
+
+    def __init__(self, *, per_user: int = 5, concurrency: int = 5, resolution: float = 1.0) -> None:
+        self.per_user: int = per_user
+        self.concurrency: int = concurrency
+        self.wheel: TimerWheel[PromptView] = TimerWheel(self._expire, resolution=resolution)
+        # user_id: open prompts
+        self._users: dict[int, int] = {}
+        self.expired: int = 0
+        self._cleanups: set[asyncio.Task[None]] = set()
+
+    def __len__(self) -> int:
+        return len(self.wheel)
+
+    def add(self, view: PromptView, user_id: int, timeout: float) -> None:
+        count = self._users.get(user_id, 0)
+        if count >= self.per_user:
+            raise TooManyPrompts(self.per_user)
+        self._users[user_id] = count + 1
+        self.wheel.schedule(view, timeout)
+
+    def remove(self, view: PromptView, user_id: int) -> None:
+        if self.wheel.cancel(view):
+            self._release(user_id)
+
+    def _release(self, user_id: int) -> None:
+        count = self._users.pop(user_id, 0) - 1
+        if count > 0:
+            self._users[user_id] = count
+
+    def _expire(self, views: list[PromptView]) -> None:
+        self.expired += len(views)
+        for view in views:
+            self._release(view.ctx.author.id)
+            view.timed_out = True
+            view.stop()
+        task = asyncio.create_task(self._cleanup(views))
+        self._cleanups.add(task)
+        task.add_done_callback(self._cleanups.discard)
+
+    async def _cleanup(self, views: list[PromptView]) -> None:
+        # Regular messages are deleted per channel, in bulk where we can
+        channels: dict[int, list[discord.Message]] = {}
+        jobs = []
+        for view in views:
+            message = view.message
+            if message is None:
+                continue
+            if not view.delete_on_timeout:
+                jobs.append(view.on_timeout())
+            elif isinstance(message, discord.InteractionMessage):
+                jobs.append(message.delete())  # Has to go through the interaction webhook
+            else:
+                channels.setdefault(message.channel.id, []).append(message)
+
+        for messages in channels.values():
+            channel = messages[0].channel
+            guild = getattr(channel, 'guild', None)
+            bulk = len(messages) > 1 and guild is not None and channel.permissions_for(guild.me).manage_messages
+            jobs.append(MessageDeleter(channel, bulk=bulk, concurrency=self.concurrency).delete(messages))
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def run(job) -> None:
+            async with semaphore:
+                try:
+                    await job
+                except discord.HTTPException:
+                    pass
+                except Exception:
+                    log.exception('Cleaning up an expired prompt failed')
+
+        await asyncio.gather(*map(run, jobs))
+
+    def close(self) -> None:
+        self.wheel.close()
+        for task in self._cleanups:
+            task.cancel()
@@ -0,0 +1,390 @@
+from __future__ import annotations
+
+import asyncio
+import heapq
+import re
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import islice
+from typing import Iterable, Iterator, Optional, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import discord
+
+    from utils.executor import ExecutorService
+
+_WORD = re.compile(r'\w+')
+# Sorts after every other character, so prefix + _END is past every string starting with prefix
+_END = '\U0010ffff'
+# Tokens per block, blocks are split once they grow to twice this
+_LOAD = 512
+# Guilds with at least this many members, roles or channels are indexed off the event loop
+THREAD_INDEX_ITEMS = 5000
+_WORST = (3,)
+
+
+class _SortedTokens:
+    """
+    Tokens kept sorted in blocks of a few hundred, so inserting or removing one only moves one block around
+    instead of everything. The ID and whether the token is a full name are kept in arrays next to them.
+    """
+    __slots__ = ('blocks', 'ids', 'full', 'maxes')
+
+    def __init__(self, tokens: list[str], ids: list[int], full: list[bool]) -> None:
+        """Takes the tokens already sorted"""
+        self.blocks: list[list[str]] = [tokens[i:i + _LOAD] for i in range(0, len(tokens), _LOAD)]
+        self.ids: list[array] = [array('Q', ids[i:i + _LOAD]) for i in range(0, len(ids), _LOAD)]
+        self.full: list[bytearray] = [bytearray(full[i:i + _LOAD]) for i in range(0, len(full), _LOAD)]
+        # The last token of each block
+        self.maxes: list[str] = [block[-1] for block in self.blocks]
+
+    def __len__(self) -> int:
+        return sum(map(len, self.blocks))
+
+    def insert(self, token: str, id: int, full: bool) -> None:
+        if not self.blocks:
+            self.blocks.append([token])
+            self.ids.append(array('Q', [id]))
+            self.full.append(bytearray([full]))
+            self.maxes.append(token)
+            return
+
+        b = min(bisect_right(self.maxes, token), len(self.blocks) - 1)
+        block = self.blocks[b]
+        i = bisect_right(block, token)
+        block.insert(i, token)
+        self.ids[b].insert(i, id)
+        self.full[b].insert(i, full)
+        self.maxes[b] = block[-1]
+        if len(block) >= 2 * _LOAD:
+            ids, full = self.ids[b], self.full[b]
+            self.blocks[b:b + 1] = [block[:_LOAD], block[_LOAD:]]
+            self.ids[b:b + 1] = [ids[:_LOAD], ids[_LOAD:]]
+            self.full[b:b + 1] = [full[:_LOAD], full[_LOAD:]]
+            self.maxes[b:b + 1] = [block[_LOAD - 1], block[-1]]
+
+    def delete(self, token: str, id: int) -> None:
+        b, i = self.locate(token)
+        while i == len(self.blocks[b]) or self.ids[b][i] != id:  # Other IDs with the same token
+            b, i = (b + 1, 0) if i == len(self.blocks[b]) else (b, i + 1)
+        block = self.blocks[b]
+        del block[i]
+        del self.ids[b][i]
+        del self.full[b][i]
+        if block:
+            self.maxes[b] = block[-1]
+        else:
+            del self.blocks[b], self.ids[b], self.full[b], self.maxes[b]
+
+    def locate(self, token: str) -> tuple[int, int]:
+        """Block and position of the first token that is not smaller than token"""
+        b = bisect_left(self.maxes, token)
+        if b == len(self.maxes):
+            return b, 0
+        return b, bisect_left(self.blocks[b], token)
+
+    def starting_with(self, prefix: str) -> Iterator[tuple[str, int, int]]:
+        """(token, id, full) of every token starting with prefix, in order"""
+        b, i = self.locate(prefix)
+        while b < len(self.blocks):
+            block, ids, full = self.blocks[b], self.ids[b], self.full[b]
+            for j in range(i, len(block)):
+                token = block[j]
+                if not token.startswith(prefix):
+                    return
+                yield token, ids[j], full[j]
+            b, i = b + 1, 0
+
+    def next_chars(self, prefix: str) -> Iterator[str]:
+        """Every character that follows prefix in a token, by jumping over the tokens sharing each one"""
+        b, i = self.locate(prefix)
+        while b < len(self.blocks):
+            block = self.blocks[b]
+            if i == len(block):
+                b, i = b + 1, 0
+                continue
+            token = block[i]
+            if not token.startswith(prefix):
+                return
+            if len(token) == len(prefix):
+                i += 1
+                continue
+            char = token[len(prefix)]
+            yield char
+            b, i = self.locate(prefix + char + _END)
+
+
+class NameIndex:
+    """
+    Sorted index from the names of things to their IDs, for ranked prefix lookups and names with a typo in them.
+
+    Every name is stored once in full and once from the start of each further word, so "john smith"
+    is found by "smi" as well. Tokens are also kept sorted per rank, that is per length and whether they are
+    a full name, so the best matches for a short prefix are found without going through every token sharing it.
+    """
+    __slots__ = ('scan', '_tokens', '_ranked', '_entries')
+
+    def __init__(self, *, scan: int = 200) -> None:
+        # Prefixes shared by at most this many tokens are ranked by going through all of them
+        self.scan: int = scan
+        self._tokens: _SortedTokens = _SortedTokens([], [], [])
+        # (is a later word rather than a full name, length): the tokens of that rank
+        self._ranked: dict[tuple[bool, int], _SortedTokens] = {}
+        # id: (how many of the tokens are full names, tokens)
+        self._entries: dict[int, tuple[int, tuple[str, ...]]] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def tokens(self) -> int:
+        return len(self._tokens)
+
+    @staticmethod
+    def _tokenize(names: Iterable[Optional[str]]) -> tuple[int, tuple[str, ...]]:
+        tokens = []
+        for name in names:
+            if name and (name := name.casefold()) not in tokens:
+                tokens.append(name)
+        n_full = len(tokens)
+        for name in tokens[:n_full]:
+            if name.isalnum():  # Most names are a single word
+                continue
+            for m in _WORD.finditer(name):
+                if m.start() and (word := name[m.start():]) not in tokens:
+                    tokens.append(word)
+        return n_full, tuple(tokens)
+
+    def build(self, items: Iterable[tuple[int, Iterable[Optional[str]]]]) -> None:
+        """Replaces everything in the index, much faster than adding one by one"""
+        self._entries = {id: self._tokenize(names) for id, names in items}
+        tokens, ids, full = [], [], []
+        for id, (n_full, id_tokens) in self._entries.items():
+            for i, token in enumerate(id_tokens):
+                tokens.append(token)
+                ids.append(id)
+                full.append(i < n_full)
+
+        order = sorted(range(len(tokens)), key=tokens.__getitem__)
+        self._tokens = _SortedTokens([tokens[i] for i in order], [ids[i] for i in order], [full[i] for i in order])
+        # Split up in sorted order, so every rank comes out sorted as well
+        ranked: dict[tuple[bool, int], tuple[list[str], list[int], list[bool]]] = {}
+        for i in order:
+            token = tokens[i]
+            key = (not full[i], len(token))
+            try:
+                rank_tokens, rank_ids, rank_full = ranked[key]
+            except KeyError:
+                rank_tokens, rank_ids, rank_full = ranked[key] = ([], [], [])
+            rank_tokens.append(token)
+            rank_ids.append(ids[i])
+            rank_full.append(full[i])
+        self._ranked = {key: _SortedTokens(*lists) for key, lists in ranked.items()}
+
+    def add(self, id: int, names: Iterable[Optional[str]]) -> None:
+        """Adds or replaces the names of an ID"""
+        entry = self._tokenize(names)
+        if self._entries.get(id) == entry:
+            return
+        self.remove(id)
+        self._entries[id] = entry
+        n_full, tokens = entry
+        for i, token in enumerate(tokens):
+            full = i < n_full
+            self._tokens.insert(token, id, full)
+            key = (not full, len(token))
+            ranked = self._ranked.get(key)
+            if ranked is None:
+                ranked = self._ranked[key] = _SortedTokens([], [], [])
+            ranked.insert(token, id, full)
+
+    def remove(self, id: int) -> None:
+        entry = self._entries.pop(id, None)
+        if entry is None:
+            return
+        n_full, tokens = entry
+        for i, token in enumerate(tokens):
+            self._tokens.delete(token, id)
+            key = (i >= n_full, len(token))
+            ranked = self._ranked[key]
+            ranked.delete(token, id)
+            if not ranked.blocks:
+                del self._ranked[key]
+
+    def exact(self, query: str) -> list[int]:
+        """IDs with a name that is exactly the query, ignoring case and surrounding whitespace"""
+        query = query.strip().casefold()
+        if not query:
+            return []
+        found = []
+        # The query itself sorts before everything else starting with it
+        for token, id, full in self._tokens.starting_with(query):
+            if token != query:
+                break
+            if full:
+                found.append(id)
+        return list(dict.fromkeys(found))
+
+    def search(self, query: str, *, limit: int = 25) -> list[int]:
+        """
+        Returns up to limit IDs, best match first: exact names, then names starting with the query,
+        then words starting with it. Shorter names rank higher within each.
+        If nothing starts with the query, names starting one typo away from it are returned instead.
+        """
+        query = query.strip().casefold()
+        if not query:
+            return []
+
+        best = self._matches(query, limit, typo=False)
+        if not best:
+            for variant in self._typos(query):
+                for id, rank in self._matches(variant, limit, typo=True).items():
+                    if rank < best.get(id, _WORST):
+                        best[id] = rank
+                if len(best) >= limit:
+                    break
+
+        return [id for id, _ in heapq.nsmallest(limit, best.items(), key=lambda item: item[1])]
+
+    def _matches(self, prefix: str, limit: int, *, typo: bool) -> dict[int, tuple]:
+        """The best limit IDs with a token starting with prefix, with the rank of their best token"""
+        def rank(not_full: bool, length: int) -> tuple:
+            return 2 if typo else length != len(prefix), not_full, length
+
+        best: dict[int, tuple] = {}
+        window = list(islice(self._tokens.starting_with(prefix), self.scan + 1))
+        if len(window) <= self.scan:
+            for token, id, full in window:
+                token_rank = rank(not full, len(token))
+                if token_rank < best.get(id, _WORST):
+                    best[id] = token_rank
+            return best
+
+        # Too many to rank them all, take them from the best rank down until there are enough.
+        # IDs come up with their best rank first, so the first one seen is the one kept.
+        keys = sorted((rank(*key), key) for key in self._ranked if key[1] >= len(prefix))
+        for key_rank, key in keys:
+            for _, id, _ in self._ranked[key].starting_with(prefix):
+                if id not in best:
+                    best[id] = key_rank
+                    if len(best) >= limit:
+                        return best
+        return best
+
+    def _typos(self, query: str) -> Iterator[str]:
+        """Strings one edit away from query, the ones without guessing a character first"""
+        seen = {query, ''}
+        for i in range(len(query)):
+            for variant in (query[:i] + query[i + 1:], query[:i] + query[i + 1:i + 2] + query[i:i + 1] + query[i + 2:]):
+                if variant not in seen:
+                    seen.add(variant)
+                    yield variant
+
+        # A wrong or missing character, trying only the characters that actually come next in the index.
+        # Typos in the first character would have to try every character, so those are not found.
+        for i in range(1, len(query) + 1):
+            for char in self._tokens.next_chars(query[:i]):
+                for variant in (query[:i] + char + query[i + 1:], query[:i] + char + query[i:]):
+                    if variant not in seen:
+                        seen.add(variant)
+                        yield variant
+
+
+def _member_names(member: discord.Member) -> tuple[Optional[str], ...]:
+    return member.nick, member.global_name, member.name
+
+
+class SearchIndex:
+    """
+    Name indexes of the members, roles and channels of each guild.
+
+    A guild's indexes are built the first time it is searched and kept up to date from gateway events afterwards,
+    most guilds are never searched and never pay for it. Members that are not cached cannot be found.
+    """
+    KINDS = ('member', 'role', 'channel')
+
+    def __init__(self) -> None:
+        # guild_id: {kind: index}
+        self._guilds: dict[int, dict[str, NameIndex]] = {}
+        self._loading: dict[tuple[int, str], asyncio.Task[NameIndex]] = {}
+        # (guild_id, kind): changes that came in while the index was being built, names are None for removals
+        self._pending: dict[tuple[int, str], list[tuple[int, Optional[tuple[Optional[str], ...]]]]] = {}
+
+    async def index(self, guild: discord.Guild, kind: str, *, executor: ExecutorService) -> NameIndex:
+        if kind not in self.KINDS:
+            raise ValueError(f'Unknown kind {kind!r}, expected one of {", ".join(self.KINDS)}')
+
+        index = self._existing(guild.id, kind)
+        if index is not None:
+            return index
+
+        key = (guild.id, kind)
+        task = self._loading.get(key)
+        if task is None:
+            self._pending[key] = []
+            task = self._loading[key] = asyncio.create_task(self._load(guild, kind, executor))
+        # Shielded so a cancelled search does not cancel building the index for everyone else waiting on it
+        return await asyncio.shield(task)
+
+    async def _load(self, guild: discord.Guild, kind: str, executor: ExecutorService) -> NameIndex:
+        key = (guild.id, kind)
+        try:
+            if kind == 'member':
+                items = [(m.id, _member_names(m)) for m in guild.members]
+            elif kind == 'role':
+                items = [(r.id, (r.name,)) for r in guild.roles if not r.is_default()]
+            else:
+                items = [(c.id, (c.name,)) for c in guild.channels]
+            index = NameIndex()
+            await executor.thread('search', index.build, items, size=len(items), threshold=THREAD_INDEX_ITEMS)
+        finally:
+            del self._loading[key]
+            pending = self._pending.pop(key, None)
+
+        if pending is not None:  # Otherwise the guild was discarded while we were building
+            for id, names in pending:
+                if names is None:
+                    index.remove(id)
+                else:
+                    index.add(id, names)
+            self._guilds.setdefault(guild.id, {})[kind] = index
+        return index
+
+    def _existing(self, guild_id: int, kind: str) -> Optional[NameIndex]:
+        indexes = self._guilds.get(guild_id)
+        return None if indexes is None else indexes.get(kind)
+
+    def _update(self, guild_id: int, kind: str, id: int, names: Optional[tuple[Optional[str], ...]]) -> None:
+        index = self._existing(guild_id, kind)
+        if index is None:
+            pending = self._pending.get((guild_id, kind))
+            if pending is not None:
+                pending.append((id, names))
+        elif names is None:
+            index.remove(id)
+        else:
+            index.add(id, names)
+
+    def member(self, member: discord.Member) -> None:
+        self._update(member.guild.id, 'member', member.id, _member_names(member))
+
+    def remove_member(self, guild_id: int, user_id: int) -> None:
+        self._update(guild_id, 'member', user_id, None)
+
+    def role(self, role: discord.Role) -> None:
+        self._update(role.guild.id, 'role', role.id, (role.name,))
+
+    def remove_role(self, guild_id: int, role_id: int) -> None:
+        self._update(guild_id, 'role', role_id, None)
+
+    def channel(self, channel: discord.abc.GuildChannel) -> None:
+        self._update(channel.guild.id, 'channel', channel.id, (channel.name,))
+
+    def remove_channel(self, guild_id: int, channel_id: int) -> None:
+        self._update(guild_id, 'channel', channel_id, None)
+
+    def discard_guild(self, guild_id: int) -> None:
+        """Forget a guild's indexes, they are rebuilt the next time it is searched"""
+        self._guilds.pop(guild_id, None)
+        for key in [key for key in self._pending if key[0] == guild_id]:
+            del self._pending[key]
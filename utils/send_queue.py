@@ -0,0 +1,145 @@
+from __future__ import annotations
+
+import asyncio
+from collections import deque
+from typing import Any, Awaitable, Callable, Iterable, Optional
+
+import discord
+
+Sender = Callable[..., Awaitable[discord.Message]]
+
+
+class _Pending:
+    __slots__ = ('content', 'sender', 'future')
+
+    def __init__(self, content: str, sender: Sender, future: asyncio.Future[discord.Message]) -> None:
+        self.content: str = content
+        self.sender: Sender = sender
+        self.future: asyncio.Future[discord.Message] = future
+
+
+class _ChannelQueue:
+    __slots__ = ('pending', 'length', 'timer', 'batches', 'worker')
+
+    def __init__(self) -> None:
+        self.pending: list[_Pending] = []
+        self.length: int = 0
+        self.timer: Optional[asyncio.TimerHandle] = None
+        # Batches that are ready to go out, a single worker sends them so the channel stays in order
+        self.batches: deque[list[_Pending]] = deque()
+        self.worker: Optional[asyncio.Task] = None
+
+
+class SendQueue:
+    """
+    Per-channel outbound queue that merges plain text messages sent within ``window`` seconds of each other
+    into a single message, as long as it stays under discord's character limit.
+
+    Each caller gets back the message their content ended up in. Messages are only merged with ones
+    going out through the same sender.
+    Anything that cannot be merged, e.g. embeds or files, flushes the queue first so order is kept.
+    """
+
+    def __init__(self, *, window: float = 0.25, limit: int = 2000, channels: Iterable[int] = ()) -> None:
+        self.window: float = window
+        self.limit: int = limit
+        self.channels: set[int] = set(channels)
+        self._queues: dict[int, _ChannelQueue] = {}
+        self.requested: int = 0  # Messages callers asked us to send
+        self.sent: int = 0  # Messages that actually went out
+
+    @property
+    def depth(self) -> int:
+        """Messages waiting to be sent"""
+        return sum(len(q.pending) for q in self._queues.values())
+
+    @property
+    def merge_ratio(self) -> float:
+        """How many requested messages went out per actual message"""
+        return self.requested / self.sent if self.sent else 1.0
+
+    def is_enabled(self, channel_id: int) -> bool:
+        return channel_id in self.channels
+
+    def has_pending(self, channel_id: int) -> bool:
+        """Whether anything for the channel has not gone out yet, including batches being sent right now"""
+        queue = self._queues.get(channel_id)
+        return queue is not None and bool(queue.pending or queue.batches or queue.worker is not None)
+
+    async def send(self,
+                   destination: discord.abc.Messageable,
+                   content: Optional[str] = None, *,
+                   sender: Optional[Sender] = None,
+                   **kwargs: Any) -> discord.Message:
+        sender = sender or destination.send
+        key = getattr(destination, 'id', None) or id(destination)
+        self.requested += 1
+
+        if kwargs or not content or len(content) > self.limit:
+            await self.flush(key)
+            self.sent += 1
+            return await sender(content, **kwargs)
+
+        queue = self._queues.get(key)
+        if queue is None:
+            queue = self._queues[key] = _ChannelQueue()
+
+        # Only messages going out through the same sender can be merged, +1 for the newline joining them together
+        if queue.pending and (queue.pending[-1].sender != sender or queue.length + 1 + len(content) > self.limit):
+            self._schedule(key, queue, 0)
+
+        future = asyncio.get_running_loop().create_future()
+        queue.pending.append(_Pending(content, sender, future))
+        queue.length += len(content) + (1 if len(queue.pending) > 1 else 0)
+        if queue.timer is None:
+            self._schedule(key, queue, self.window)
+        return await future
+
+    def _schedule(self, key: int, queue: _ChannelQueue, delay: float) -> None:
+        if queue.timer is not None:
+            queue.timer.cancel()
+            queue.timer = None
+        if delay:
+            queue.timer = asyncio.get_running_loop().call_later(delay, self._cut, key, queue)
+        else:
+            self._cut(key, queue)
+
+    def _cut(self, key: int, queue: _ChannelQueue) -> None:
+        """Turn everything pending into a batch and make sure the worker will send it"""
+        if queue.timer is not None:
+            queue.timer.cancel()
+            queue.timer = None
+        if queue.pending:
+            queue.batches.append(queue.pending)
+            queue.pending, queue.length = [], 0
+        if queue.batches and queue.worker is None:
+            queue.worker = asyncio.create_task(self._worker(key, queue))
+
+    async def flush(self, key: int) -> None:
+        """Send everything queued for a channel right away and wait for it to go out"""
+        queue = self._queues.get(key)
+        if queue is None:
+            return
+        self._cut(key, queue)
+        if queue.worker is not None:
+            await asyncio.shield(queue.worker)
+
+    async def _worker(self, key: int, queue: _ChannelQueue) -> None:
+        try:
+            while queue.batches:
+                batch = queue.batches.popleft()
+                self.sent += 1
+                try:
+                    message = await batch[0].sender('\n'.join(p.content for p in batch))
+                except Exception as e:
+                    for pending in batch:
+                        if not pending.future.done():
+                            pending.future.set_exception(e)
+                else:
+                    for pending in batch:
+                        if not pending.future.done():
+                            pending.future.set_result(message)
+        finally:
+            queue.worker = None
+            if not queue.pending and self._queues.get(key) is queue:
+                del self._queues[key]
@@ -0,0 +1,39 @@
+from __future__ import annotations
+
+import time
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+
+class StartupTimer:
+    """Records how long each phase of startup takes, relative to when the process was started"""
+
+    def __init__(self) -> None:
+        # name, time.time() when the phase began, duration (None for a point in time)
+        self.phases: list[tuple[str, float, Optional[float]]] = []
+        self.done: bool = False
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        began = time.time()
+        try:
+            yield
+        finally:
+            self.phases.append((name, began, time.perf_counter() - start))
+
+    def mark(self, name: str) -> None:
+        self.phases.append((name, time.time(), None))
+
+    def report(self) -> str:
+        # Only needed here, so psutil is not imported during startup
+        import psutil
+
+        process_start = psutil.Process().create_time()
+        width = max((len(name) for name, _, _ in self.phases), default=0)
+        lines = ['Startup report:']
+        for name, began, duration in sorted(self.phases, key=lambda p: p[1]):
+            offset = began - process_start
+            took = f'{duration * 1000:9.1f}ms' if duration is not None else ' ' * 11
+            lines.append(f'  {name:<{width}} {took}  (at {offset:6.2f}s)')
+        return '\n'.join(lines)
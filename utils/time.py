@@ -10,77 +10,85 @@ from __future__ import annotations
 
 import re
 import datetime
-from typing import TYPE_CHECKING, Optional
+from typing import TYPE_CHECKING, Iterable, Optional
 
 from dateutil.relativedelta import relativedelta
 
-from utils.formats import plural, human_join, format_dt as format_dt
-def human_timedelta(
-        dt: datetime.datetime,
-        *,
-        source: Optional[datetime.datetime] = None,
-        accuracy: Optional[int] = 3,
-        brief: bool = False,
-        suffix: bool = True,
-) -> str:
-    now = source or datetime.datetime.now(datetime.timezone.utc)
+from utils.formats import human_join, format_dt as format_dt
+
+_UTC = datetime.timezone.utc
+_EPOCH = datetime.datetime(1970, 1, 1)
+_UTC_EPOCH = _EPOCH.replace(tzinfo=_UTC)
+# Every month has at least 28 days, so shorter deltas never need calendar arithmetic
+_MIN_MONTH = 28 * 86400
+# (singular, plural, brief)
+_UNITS = {
+    'year': ('year', 'years', 'y'),
+    'month': ('month', 'months', 'mo'),
+    'week': ('week', 'weeks', 'w'),
+    'day': ('day', 'days', 'd'),
+    'hour': ('hour', 'hours', 'h'),
+    'minute': ('minute', 'minutes', 'm'),
+    'second': ('second', 'seconds', 's'),
+}
+
+
+def _normalize(dt: datetime.datetime) -> datetime.datetime:
     if dt.tzinfo is None:
-        dt = dt.replace(tzinfo=datetime.timezone.utc)
-
-    if now.tzinfo is None:
-        now = now.replace(tzinfo=datetime.timezone.utc)
+        dt = dt.replace(tzinfo=_UTC)
 
     # Microsecond free zone
-    now = now.replace(microsecond=0)
     dt = dt.replace(microsecond=0)
 
     # Make sure they're both in the timezone
-    now = now.astimezone(datetime.timezone.utc)
-    dt = dt.astimezone(datetime.timezone.utc)
-
-    # This implementation uses relativedelta instead of the much more obvious
-    # divmod approach with seconds because the seconds approach is not entirely
-    # accurate once you go over 1 week in terms of accuracy since you have to
-    # hardcode a month as 30 or 31 days.
-    # A query like "11 months" can be interpreted as "!1 month and 6 days"
-    if dt > now:
-        delta = relativedelta(dt, now)
+    return dt.astimezone(_UTC)
+
+
+def _timestamp(dt: datetime.datetime) -> int:
+    """Whole seconds since the epoch, naive datetimes are UTC. Same as :func:`_normalize` without building a datetime."""
+    delta = dt - (_EPOCH if dt.tzinfo is None else _UTC_EPOCH)
+    return delta.days * 86400 + delta.seconds
+
+
+def _format_delta(dt: datetime.datetime,
+                  now: datetime.datetime,
+                  now_timestamp: int,
+                  accuracy: Optional[int],
+                  brief: bool,
+                  suffix: bool) -> str:
+    diff = _timestamp(dt) - now_timestamp
+    if diff > 0:
         output_suffix = ''
     else:
-        delta = relativedelta(now, dt)
+        diff = -diff
         output_suffix = ' ago' if suffix else ''
 
-    attrs = [
-        ('year', 'y'),
-        ('month', 'mo'),
-        ('day', 'd'),
-        ('hour', 'h'),
-        ('minute', 'm'),
-        ('second', 's'),
-    ]
-
+    if diff < _MIN_MONTH:
+        years = months = 0
+        days, seconds = divmod(diff, 86400)
+        hours, seconds = divmod(seconds, 3600)
+        minutes, seconds = divmod(seconds, 60)
+    else:
+        # This implementation uses relativedelta instead of the much more obvious
+        # divmod approach with seconds because the seconds approach is not entirely
+        # accurate once you go over 1 week in terms of accuracy since you have to
+        # hardcode a month as 30 or 31 days.
+        # A query like "11 months" can be interpreted as "!1 month and 6 days"
+        dt = _normalize(dt)
+        delta = relativedelta(dt, now) if dt > now else relativedelta(now, dt)
+        years, months, days = delta.years, delta.months, delta.days
+        hours, minutes, seconds = delta.hours, delta.minutes, delta.seconds
+
+    weeks, days = divmod(days, 7)
     output = []
-    for attr, brief_attr in attrs:
-        elem = getattr(delta, attr + 's')
-        if not elem:
-            continue
-
-        if attr == 'day':
-            weeks = delta.weeks
-            if weeks:
-                elem -= weeks * 7
-                if not brief:
-                    output.append(format(plural(weeks), 'week'))
-                else:
-                    output.append(f'{weeks}w')
-
-        if elem <= 0:
-            continue
-
-        if brief:
-            output.append(f'{elem}{brief_attr}')
-        else:
-            output.append(format(plural(elem), attr))
+    for value, unit in ((years, 'year'), (months, 'month'), (weeks, 'week'), (days, 'day'),
+                        (hours, 'hour'), (minutes, 'minute'), (seconds, 'second')):
+        if value:
+            singular, plural, brief_unit = _UNITS[unit]
+            if brief:
+                output.append(f'{value}{brief_unit}')
+            else:
+                output.append(f'{value} {singular if value == 1 else plural}')
 
     if accuracy is not None:
         output = output[:accuracy]
@@ -94,5 +102,31 @@ def human_timedelta(
             return ' '.join(output) + output_suffix
 
 
+def human_timedelta(
+        dt: datetime.datetime,
+        *,
+        source: Optional[datetime.datetime] = None,
+        accuracy: Optional[int] = 3,
+        brief: bool = False,
+        suffix: bool = True,
+) -> str:
+    now = _normalize(source or datetime.datetime.now(_UTC))
+    return _format_delta(dt, now, _timestamp(now), accuracy, brief, suffix)
+
+
+def human_timedeltas(
+        dts: Iterable[datetime.datetime],
+        *,
+        source: Optional[datetime.datetime] = None,
+        accuracy: Optional[int] = 3,
+        brief: bool = False,
+        suffix: bool = True,
+) -> list[str]:
+    """Formats every datetime like :func:`human_timedelta`, all against the same source"""
+    now = _normalize(source or datetime.datetime.now(_UTC))
+    now_timestamp = _timestamp(now)
+    return [_format_delta(dt, now, now_timestamp, accuracy, brief, suffix) for dt in dts]
+
+
 def format_relative(dt: datetime.datetime) -> str:
     return format_dt(dt, 'R')
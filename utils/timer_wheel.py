@@ -0,0 +1,134 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import math
+import time
+from typing import Any, Callable, Generic, Hashable, Optional, TypeVar
+
+log = logging.getLogger(__name__)
+
+T = TypeVar('T', bound=Hashable)
+
+
+class TimerWheel(Generic[T]):
+    """
+    Hierarchical timer wheel for many timeouts that share a single task and no handle per timeout.
+
+    Level ``n`` has ``slots`` buckets that each cover ``slots ** n`` ticks of ``resolution`` seconds.
+    Scheduling and cancelling are O(1). Timeouts on the higher levels move down a level when their bucket
+    comes up, and timeouts past the last level wait in its furthest bucket until they are close enough.
+    Everything that expires on the same tick is passed to ``callback`` as one list, at most one tick late.
+    """
+
+    def __init__(self, callback: Callable[[list[T]], Any], *,
+                 resolution: float = 1.0,
+                 slots: int = 64,
+                 levels: int = 4) -> None:
+        self.callback: Callable[[list[T]], Any] = callback
+        self.resolution: float = resolution
+        self.slots: int = slots
+        self.levels: int = levels
+        # Per level and bucket {item: tick it expires on}
+        self._buckets: list[list[dict[T, int]]] = [[{} for _ in range(slots)] for _ in range(levels)]
+        # item: (level, bucket)
+        self._where: dict[T, tuple[int, int]] = {}
+        # The last tick that was processed
+        self._tick: int = self._now()
+        self._wakeup: asyncio.Event = asyncio.Event()
+        self._task: Optional[asyncio.Task[None]] = None
+
+    def __len__(self) -> int:
+        return len(self._where)
+
+    def __contains__(self, item: T) -> bool:
+        return item in self._where
+
+    def _now(self) -> int:
+        return int(time.monotonic() / self.resolution)
+
+    def schedule(self, item: T, delay: float) -> None:
+        """Calls back with item after delay seconds, replacing its previous timeout if it had one"""
+        self.cancel(item)
+        if not self._where:
+            # Nothing to move down or expire in between, so we can skip straight to now
+            self._tick = self._now()
+        tick = max(math.ceil((time.monotonic() + delay) / self.resolution), self._tick + 1)
+        self._insert(item, tick)
+
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+        self._wakeup.set()
+
+    def cancel(self, item: T) -> bool:
+        """Returns whether the item was scheduled"""
+        where = self._where.pop(item, None)
+        if where is None:
+            return False
+        level, index = where
+        del self._buckets[level][index][item]
+        return True
+
+    def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def _insert(self, item: T, tick: int) -> None:
+        span = 1
+        for level in range(self.levels):
+            block = tick // span
+            if block - self._tick // span < self.slots:
+                break
+            span *= self.slots
+        else:
+            span //= self.slots
+            block = self._tick // span + self.slots - 1
+
+        index = block % self.slots
+        self._buckets[level][index][item] = tick
+        self._where[item] = (level, index)
+
+    def _advance(self, tick: int) -> list[T]:
+        self._tick = tick
+        # Highest level first, so timeouts moving down can move down again within the same tick
+        for level in range(self.levels - 1, 0, -1):
+            span = self.slots ** level
+            if tick % span:
+                continue
+            buckets = self._buckets[level]
+            index = (tick // span) % self.slots
+            bucket = buckets[index]
+            if bucket:
+                buckets[index] = {}
+                for item, expires in bucket.items():
+                    self._insert(item, expires)
+
+        buckets = self._buckets[0]
+        index = tick % self.slots
+        bucket = buckets[index]
+        if not bucket:
+            return []
+        buckets[index] = {}
+        for item in bucket:
+            del self._where[item]
+        return list(bucket)
+
+    async def _run(self) -> None:
+        while True:
+            if not self._where:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            now = self._now()
+            while self._tick < now and self._where:
+                expired = self._advance(self._tick + 1)
+                if expired:
+                    try:
+                        self.callback(expired)
+                    except Exception:
+                        log.exception('Timer wheel callback failed for %s items', len(expired))
+
+            if self._where:
+                await asyncio.sleep((self._tick + 1) * self.resolution - time.monotonic())
@@ -0,0 +1,208 @@
+from __future__ import annotations
+
+import asyncio
+import datetime
+import logging
+from typing import Any, Callable, Iterable, Optional, TYPE_CHECKING
+
+import discord
+
+from utils.time import human_timedelta
+
+if TYPE_CHECKING:
+    import asyncpg
+
+log = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS timers (
+    id BIGSERIAL PRIMARY KEY,
+    event TEXT NOT NULL,
+    expires TIMESTAMPTZ NOT NULL,
+    created TIMESTAMPTZ NOT NULL DEFAULT now(),
+    extra JSONB NOT NULL DEFAULT '{}'::jsonb
+);
+CREATE INDEX IF NOT EXISTS timers_expires_idx ON timers (expires);
+ALTER TABLE timers ADD COLUMN IF NOT EXISTS claimed_until TIMESTAMPTZ;
+CREATE INDEX IF NOT EXISTS timers_claimed_until_idx ON timers (claimed_until) WHERE claimed_until IS NOT NULL;
+"""
+
+# Claims a batch of expired timers until $3, SKIP LOCKED lets several bot processes share the table.
+# Timers are only deleted once dispatched, a claim that runs out was lost with its process and is claimed again.
+_CLAIM_DUE = """
+UPDATE timers SET claimed_until = $3 WHERE id IN (
+    SELECT id FROM timers WHERE expires <= $1 AND (claimed_until IS NULL OR claimed_until <= $1)
+    ORDER BY expires LIMIT $2 FOR UPDATE SKIP LOCKED
+) RETURNING *;
+"""
+
+# When the next timer can be claimed: the earliest unclaimed expiry, or the earliest claim running out
+_NEXT_DUE = """
+SELECT least(
+    (SELECT expires FROM timers WHERE claimed_until IS NULL ORDER BY expires LIMIT 1),
+    (SELECT min(claimed_until) FROM timers WHERE claimed_until IS NOT NULL)
+);
+"""
+
+
+def _aware(dt: datetime.datetime) -> datetime.datetime:
+    # Naive datetimes are UTC, they are compared with the aware ones coming back from the table
+    if dt.tzinfo is None:
+        return dt.replace(tzinfo=datetime.timezone.utc)
+    return dt
+
+
+class Timer:
+    __slots__ = ('id', 'event', 'expires', 'created', 'args', 'kwargs')
+
+    def __init__(self, record: asyncpg.Record) -> None:
+        self.id: int = record['id']
+        self.event: str = record['event']
+        self.expires: datetime.datetime = record['expires']
+        self.created: datetime.datetime = record['created']
+        extra = record['extra']
+        self.args: list[Any] = extra.get('args', [])
+        self.kwargs: dict[str, Any] = extra.get('kwargs', {})
+
+    @property
+    def human_delta(self) -> str:
+        return human_timedelta(self.created)
+
+    def __repr__(self) -> str:
+        return f'<Timer id={self.id} event={self.event!r} expires={self.expires}>'
+
+
+class TimerManager:
+    """
+    Timers stored in Postgres, dispatched as ``on_<event>_timer_complete(timer)`` once they expire.
+
+    Only the expiry of the next timer is kept in memory, the dispatcher sleeps until then and is woken early
+    when a sooner timer is created. Expired timers, e.g. everything that expired while the bot was down,
+    are claimed and dispatched ``batch_size`` at a time, so memory does not grow with the number of timers.
+    Timers are deleted after they were dispatched, if the process dies in between they are dispatched again
+    once their claim runs out.
+    """
+    # Long sleeps drift and the clock might jump, so we look at the table again at least this often
+    MAX_SLEEP = 60 * 60
+    RETRY_DELAY = 5
+    # How long a claim on due timers lasts, only matters when the process dies before deleting them
+    CLAIM_LEASE = datetime.timedelta(minutes=5)
+    # Due timers that could not be claimed are being claimed by another process, we look again after this long
+    CLAIMED_BACKOFF = 1.0
+
+    def __init__(self, pool: asyncpg.Pool, dispatch: Callable[..., Any], *, batch_size: int = 1000) -> None:
+        self.pool: asyncpg.Pool = pool
+        self.dispatch: Callable[..., Any] = dispatch
+        self.batch_size: int = batch_size
+        # What the dispatcher is sleeping until, None while it does not know yet
+        self._next: Optional[datetime.datetime] = None
+        self._wakeup: asyncio.Event = asyncio.Event()
+        self._task: Optional[asyncio.Task[None]] = None
+        self.dispatched: int = 0
+
+    async def start(self) -> None:
+        await self.pool.execute(SCHEMA)
+        self._task = asyncio.create_task(self._run())
+
+    def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def create(self, event: str, when: datetime.datetime, *args: Any,
+                     created: Optional[datetime.datetime] = None, **kwargs: Any) -> Timer:
+        """Creates a timer that dispatches ``on_<event>_timer_complete`` at ``when``, naive datetimes are UTC"""
+        when = _aware(when)
+        created = discord.utils.utcnow() if created is None else _aware(created)
+        record = await self.pool.fetchrow('INSERT INTO timers (event, expires, created, extra) '
+                                          'VALUES ($1, $2, $3, $4) RETURNING *;',
+                                          event, when, created,
+                                          {'args': args, 'kwargs': kwargs})
+        self._schedule(when)
+        return Timer(record)
+
+    async def create_many(self, event: str, timers: Iterable[tuple[datetime.datetime, dict[str, Any]]]) -> int:
+        """Creates a timer per (when, kwargs) pair with a single COPY, returns how many were created.
+        Naive datetimes are UTC.
+        """
+        now = discord.utils.utcnow()
+        soonest: Optional[datetime.datetime] = None
+        count = 0
+
+        def records():
+            nonlocal soonest, count
+            for when, kwargs in timers:
+                when = _aware(when)
+                if soonest is None or when < soonest:
+                    soonest = when
+                count += 1
+                yield event, when, now, {'args': [], 'kwargs': kwargs}
+
+        await self.pool.copy_records_to_table('timers', records=records(),
+                                              columns=('event', 'expires', 'created', 'extra'))
+        if soonest is not None:
+            self._schedule(soonest)
+        return count
+
+    async def delete(self, timer_id: int) -> bool:
+        """Deletes a timer, returns whether it existed. The dispatcher notices by itself when it wakes up."""
+        status = await self.pool.execute('DELETE FROM timers WHERE id=$1;', timer_id)
+        return status != 'DELETE 0'
+
+    def _schedule(self, when: datetime.datetime) -> None:
+        if self._next is None or when < self._next:
+            self._next = when
+            self._wakeup.set()
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                dispatched = await self._dispatch_due()
+                await self._sleep(backoff=not dispatched)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                log.exception('Dispatching timers failed, retrying in %ss', self.RETRY_DELAY)
+                await asyncio.sleep(self.RETRY_DELAY)
+
+    async def _dispatch_due(self) -> int:
+        """Dispatches every timer that is due, returns how many"""
+        # Cleared before looking at the table, so timers created from here on always wake us up again
+        self._next = None
+        self._wakeup.clear()
+        dispatched = 0
+        while True:
+            now = discord.utils.utcnow()
+            records = await self.pool.fetch(_CLAIM_DUE, now, self.batch_size, now + self.CLAIM_LEASE)
+            for record in sorted(records, key=lambda r: r['expires']):
+                timer = Timer(record)
+                self.dispatch(f'{timer.event}_timer_complete', timer)
+            if records:
+                await self.pool.execute('DELETE FROM timers WHERE id = ANY($1::bigint[]);', [r['id'] for r in records])
+            dispatched += len(records)
+            self.dispatched += len(records)
+            if len(records) < self.batch_size:
+                return dispatched
+            await asyncio.sleep(0)  # Let everything else run between batches of a big backlog
+
+    async def _sleep(self, *, backoff: bool = False) -> None:
+        """
+        Sleeps until the next timer can be claimed. With backoff, due timers that are still there
+        are being claimed by another process right now, so we wait a little instead of trying again right away.
+        """
+        expires = await self.pool.fetchval(_NEXT_DUE)
+        if expires is None:
+            await self._wakeup.wait()
+            return
+
+        if self._next is None or expires < self._next:
+            self._next = expires  # A sooner timer created in the meantime has already set the event
+        delay = (self._next - discord.utils.utcnow()).total_seconds()
+        if delay <= 0:
+            if not backoff:
+                return
+            delay = self.CLAIMED_BACKOFF
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout=min(delay, self.MAX_SLEEP))
+        except asyncio.TimeoutError:
+            pass
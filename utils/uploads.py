@@ -0,0 +1,164 @@
+from __future__ import annotations
+
+import asyncio
+import functools
+import gzip
+import inspect
+import io
+import tempfile
+from typing import AsyncIterable, Iterable, Optional, Union, IO, TYPE_CHECKING
+
+import discord
+
+if TYPE_CHECKING:
+    from utils.executor import ExecutorService
+
+Chunk = Union[str, bytes]
+Chunks = Union[Iterable[Chunk], AsyncIterable[Chunk]]
+
+# Discord's attachment limit for unboosted guilds and DMs, minus some room for the multipart overhead
+DEFAULT_FILESIZE_LIMIT = 10 * 1024 * 1024 - 64 * 1024
+# Outputs larger than this get gzipped before uploading
+GZIP_THRESHOLD = 1024 * 1024
+# Anything larger than this is spooled to disk instead of being kept in memory
+SPOOL_SIZE = 4 * 1024 * 1024
+COPY_BUFSIZE = 64 * 1024
+# Discord only allows this many attachments per message
+MAX_ATTACHMENTS = 10
+
+
+def _write(fp: IO[bytes], data: bytes) -> IO[bytes]:
+    """Write to an in memory file, moving it to a temporary file on disk once it grows too large"""
+    fp.write(data)
+    if isinstance(fp, io.BytesIO) and fp.tell() > SPOOL_SIZE:
+        disk = tempfile.TemporaryFile()
+        disk.write(fp.getbuffer())
+        fp.close()
+        return disk
+    return fp
+
+
+async def _write_chunks(chunks: Chunks) -> IO[bytes]:
+    fp: IO[bytes] = io.BytesIO()
+    try:
+        if inspect.isasyncgen(chunks) or hasattr(chunks, '__aiter__'):
+            async for chunk in chunks:  # type: ignore
+                fp = _write(fp, chunk.encode() if isinstance(chunk, str) else chunk)
+        else:
+            for i, chunk in enumerate(chunks):  # type: ignore
+                fp = _write(fp, chunk.encode() if isinstance(chunk, str) else chunk)
+                if i % 64 == 63:
+                    await asyncio.sleep(0)  # Generators can be slow, let everything else run
+    except BaseException:
+        fp.close()
+        raise
+    return fp
+
+
+class _GzipSink(io.RawIOBase):
+    """Lets GzipFile write into our spooled files"""
+
+    def __init__(self) -> None:
+        self.fp: IO[bytes] = io.BytesIO()
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self.fp = _write(self.fp, bytes(data))
+        return len(data)
+
+
+def _gzip(src: IO[bytes]) -> IO[bytes]:
+    src.seek(0)
+    sink = _GzipSink()
+    with gzip.GzipFile(fileobj=sink, mode='wb', compresslevel=6) as gz:
+        while block := src.read(COPY_BUFSIZE):
+            gz.write(block)
+    src.close()
+    return sink.fp
+
+
+def _split(src: IO[bytes], size: int, limit: int) -> list[IO[bytes]]:
+    if size <= limit:
+        src.seek(0)
+        return [src]
+
+    parts = []
+    src.seek(0)
+    for _ in range(0, size, limit):
+        part: IO[bytes] = io.BytesIO()
+        remaining = limit
+        while remaining:
+            block = src.read(min(COPY_BUFSIZE, remaining))
+            if not block:
+                break
+            part = _write(part, block)
+            remaining -= len(block)
+        part.seek(0)
+        parts.append(part)
+    src.close()
+    return parts
+
+
+async def build_files(chunks: Chunks, *,
+                      filename: str,
+                      limit: int = DEFAULT_FILESIZE_LIMIT,
+                      gzip_threshold: int = GZIP_THRESHOLD,
+                      executor: Optional[ExecutorService] = None) -> list[discord.File]:
+    """
+    Write chunks of output into files ready to upload, without holding the whole output in memory.
+
+    Output past ``gzip_threshold`` bytes is gzipped, and anything still larger than ``limit``
+    is split into numbered parts that can be joined back together with ``cat``.
+    The copying runs on ``executor`` when given, otherwise in the default thread pool.
+    """
+    if executor is not None:
+        run = functools.partial(executor.thread, 'upload')
+    else:
+        run = asyncio.to_thread
+
+    fp = await _write_chunks(chunks)
+    size = fp.tell()
+
+    if size > gzip_threshold:
+        fp = await run(_gzip, fp)
+        size = fp.tell()
+        filename += '.gz'
+
+    if size <= limit:
+        parts = _split(fp, size, limit)  # Nothing to copy
+    else:
+        parts = await run(_split, fp, size, limit)
+    if len(parts) == 1:
+        return [discord.File(parts[0], filename=filename)]
+    return [discord.File(part, filename=f'{filename}.{i:03}') for i, part in enumerate(parts, start=1)]
+
+
+def _file_size(file: discord.File) -> int:
+    fp = file.fp
+    position = fp.tell()
+    size = fp.seek(0, io.SEEK_END) - position
+    fp.seek(position)
+    return size
+
+
+def batch_files(files: list[discord.File], *, limit: int = DEFAULT_FILESIZE_LIMIT,
+                max_files: int = MAX_ATTACHMENTS) -> list[list[discord.File]]:
+    """
+    Groups files into messages, each with at most ``max_files`` attachments and ``limit`` bytes in total,
+    since the upload limit applies to the whole request. A file larger than ``limit`` goes out on its own.
+    """
+    batches: list[list[discord.File]] = []
+    batch: list[discord.File] = []
+    total = 0
+    for file in files:
+        size = _file_size(file)
+        if batch and (len(batch) >= max_files or total + size > limit):
+            batches.append(batch)
+            batch, total = [], 0
+        batch.append(file)
+        total += size
+    if batch:
+        batches.append(batch)
+    return batches
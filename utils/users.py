@@ -0,0 +1,114 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Iterable, Optional, TYPE_CHECKING
+
+import discord
+
+if TYPE_CHECKING:
+    from main import Kannushi
+
+
+class UserFetcher:
+    """
+    Looks users up in the library's cache and fetches them from the API otherwise.
+
+    Fetched users are kept in a bounded LRU for ``ttl`` seconds, users that do not exist are remembered
+    for ``missing_ttl`` seconds. Concurrent lookups of the same user share a single request.
+    """
+
+    def __init__(self, bot: Kannushi, *,
+                 max_users: int = 5000,
+                 ttl: float = 60 * 60,
+                 missing_ttl: float = 10 * 60,
+                 concurrency: int = 5) -> None:
+        self.bot: Kannushi = bot
+        self.max_users: int = max_users
+        self.ttl: float = ttl
+        self.missing_ttl: float = missing_ttl
+        self.concurrency: int = concurrency
+        # user_id: (expires at, user), least recently used first
+        self._users: OrderedDict[int, tuple[float, discord.User]] = OrderedDict()
+        # user_id: expires at
+        self._missing: OrderedDict[int, float] = OrderedDict()
+        self._inflight: dict[int, asyncio.Task[Optional[discord.User]]] = {}
+        self.fetches: int = 0
+
+    def cached(self, user_id: int) -> tuple[bool, Optional[discord.User]]:
+        """Returns whether the user is known without a request, and the user if they exist"""
+        user = self.bot.get_user(user_id)
+        if user is not None:
+            return True, user
+
+        now = time.monotonic()
+        entry = self._users.get(user_id)
+        if entry is not None:
+            if entry[0] > now:
+                self._users.move_to_end(user_id)
+                return True, entry[1]
+            del self._users[user_id]
+
+        expires = self._missing.get(user_id)
+        if expires is not None:
+            if expires > now:
+                return True, None
+            del self._missing[user_id]
+        return False, None
+
+    async def get(self, user_id: int) -> Optional[discord.User]:
+        found, user = self.cached(user_id)
+        if found:
+            return user
+
+        task = self._inflight.get(user_id)
+        if task is None:
+            task = self._inflight[user_id] = asyncio.create_task(self._fetch(user_id))
+        # Shielded so a cancelled caller does not cancel the request for everyone else waiting on it
+        return await asyncio.shield(task)
+
+    async def get_many(self, user_ids: Iterable[int]) -> dict[int, Optional[discord.User]]:
+        """Resolves every user, fetching the ones that are not cached at most ``concurrency`` at a time"""
+        result: dict[int, Optional[discord.User]] = {}
+        missing = []
+        for user_id in dict.fromkeys(user_ids):
+            found, user = self.cached(user_id)
+            if found:
+                result[user_id] = user
+            else:
+                missing.append(user_id)
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def fetch(user_id: int) -> None:
+            async with semaphore:
+                result[user_id] = await self.get(user_id)
+
+        await asyncio.gather(*map(fetch, missing))
+        return result
+
+    async def _fetch(self, user_id: int) -> Optional[discord.User]:
+        self.fetches += 1
+        try:
+            user = await self.bot.fetch_user(user_id)
+        except discord.NotFound:
+            self._missing[user_id] = time.monotonic() + self.missing_ttl
+            self._missing.move_to_end(user_id)
+            if len(self._missing) > self.max_users:
+                self._missing.popitem(last=False)
+            return None
+        except discord.HTTPException:
+            return None  # Might work next time, so not remembered
+        finally:
+            del self._inflight[user_id]
+
+        self._users[user_id] = (time.monotonic() + self.ttl, user)
+        self._users.move_to_end(user_id)
+        if len(self._users) > self.max_users:
+            self._users.popitem(last=False)
+        return user
+
+    def clear(self) -> None:
+        self._users.clear()
+        self._missing.clear()